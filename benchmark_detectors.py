@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the detection pipeline
+
+Benchmarks that replay a recorded session read the raw frames saved with
+`visuals.save_frames` (clashroyalebuildabot/debug/frames by default).
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from loguru import logger
+import numpy as np
+from PIL import Image
+
+from clashroyalebuildabot.constants import FRAMES_DIR
+from clashroyalebuildabot.constants import MODELS_DIR
+from clashroyalebuildabot.constants import SCREENSHOT_HEIGHT
+from clashroyalebuildabot.constants import SCREENSHOT_WIDTH
+
+
+def _synthetic_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    small = rng.integers(
+        0, 256, (SCREENSHOT_HEIGHT // 4, SCREENSHOT_WIDTH // 4, 3), np.uint8
+    )
+    return Image.fromarray(small).resize(
+        (SCREENSHOT_WIDTH, SCREENSHOT_HEIGHT), Image.Resampling.BILINEAR
+    )
+
+
+def _synthetic_bboxes(n_units, seed=0):
+    rng = np.random.default_rng(seed)
+    bboxes = []
+    for _ in range(n_units):
+        left = int(rng.integers(0, SCREENSHOT_WIDTH - 40))
+        top = int(rng.integers(0, SCREENSHOT_HEIGHT - 50))
+        width = int(rng.integers(12, 40))
+        height = int(rng.integers(15, 50))
+        bboxes.append((left, top, left + width, top + height))
+    return bboxes
+
+
+def _time_ms(func, repeats, rounds=5):
+    """Best-of-rounds mean latency in milliseconds"""
+    func()
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000 / repeats
+
+
+def benchmark_side_detector(repeats=200):
+    """Per-crop vs batched side classification for 1, 10 and 30 units"""
+    from clashroyalebuildabot.detectors.side_detector import SideDetector
+
+    side_detector = SideDetector(os.path.join(MODELS_DIR, "side.onnx"))
+    image = _synthetic_frame()
+
+    logger.info("Side classification (ms per frame)")
+    for n_units in (1, 10, 30):
+        bboxes = _synthetic_bboxes(n_units)
+
+        def per_crop():
+            return [side_detector.run(image.crop(bbox)) for bbox in bboxes]
+
+        def batched():
+            return side_detector.run_batch(image, bboxes)
+
+        per_crop_ms = _time_ms(per_crop, repeats)
+        batched_ms = _time_ms(batched, repeats)
+        logger.info(
+            f"  {n_units:>2} units: per-crop {per_crop_ms:.3f} "
+            f"({per_crop_ms / n_units:.3f}/unit), batched {batched_ms:.3f} "
+            f"({batched_ms / n_units:.3f}/unit)"
+        )
+
+
+def benchmark_letterbox(repeats=100):
+    """Four-pass vs fused letterbox of the unit band to the model size"""
+    from clashroyalebuildabot.detectors.side_detector import SideDetector
+
+    # Any OnnxDetector works, the model size is given explicitly
+    detector = SideDetector(os.path.join(MODELS_DIR, "side.onnx"))
+    size = detector.DEFAULT_MODEL_SIZE
+    image = _synthetic_frame()
+    band = image.crop((0, 33, image.width, 554))
+
+    reference, reference_padding = detector.resize_pad_transpose_and_scale(
+        band, size
+    )
+    fused, padding = detector.letterbox(band, size)
+    # The side model is NHWC
+    max_diff = np.abs(reference[None] - fused.transpose(0, 3, 1, 2)).max()
+    logger.info("Letterbox preprocessing (ms per frame)")
+    logger.info(
+        f"  max abs difference {max_diff:.2e}, "
+        f"same padding {reference_padding == padding}"
+    )
+
+    def four_pass():
+        x, _ = detector.resize_pad_transpose_and_scale(band, size)
+        return np.ascontiguousarray(np.expand_dims(x, axis=0))
+
+    four_pass_ms = _time_ms(four_pass, repeats)
+    fused_ms = _time_ms(lambda: detector.letterbox(band, size), repeats)
+    logger.info(f"  four-pass {four_pass_ms:.3f}, fused {fused_ms:.3f}")
+
+
+def _reference_numbers(number_detector, image, window_size=10, threshold=50):
+    """HP of each bar and elixir, computed bar by bar with PIL"""
+    from clashroyalebuildabot.constants import ELIXIR_BOUNDING_BOX
+    from clashroyalebuildabot.constants import HP_HEIGHT
+    from clashroyalebuildabot.constants import HP_WIDTH
+    from clashroyalebuildabot.constants import NUMBER_CONFIG
+
+    numbers = [
+        number_detector._calculate_hp(
+            image, (x, y, x + HP_WIDTH, y + HP_HEIGHT), lhs, rhs
+        )
+        for x, y, lhs, rhs in NUMBER_CONFIG.values()
+    ]
+    crop = image.crop(ELIXIR_BOUNDING_BOX)
+    std = np.array(crop).std(axis=(0, 2))
+    rolling_std = np.convolve(
+        std, np.ones(window_size) / window_size, mode="valid"
+    )
+    change_points = np.nonzero(rolling_std < threshold)[0]
+    if len(change_points) == 0:
+        numbers.append(10)
+    else:
+        numbers.append((change_points[0] + window_size) * 10 // crop.width)
+    return numbers
+
+
+def benchmark_number_detector(frames_dir=FRAMES_DIR, limit=None, repeats=200):
+    """Per-bar vs batched HP bars and elixir, checked on recorded frames"""
+    from clashroyalebuildabot.constants import NUMBER_CONFIG
+    from clashroyalebuildabot.detectors.number_detector import NumberDetector
+
+    number_detector = NumberDetector()
+    names = list(NUMBER_CONFIG) + ["elixir"]
+
+    def batched(image):
+        numbers = number_detector.run(image)
+        return [getattr(numbers, name).number for name in names]
+
+    frames = _load_frames(frames_dir, limit)
+    mismatches = sum(
+        batched(frame) != _reference_numbers(number_detector, frame)
+        for frame in frames
+    )
+
+    image = frames[0] if frames else _synthetic_frame()
+    per_bar_ms = _time_ms(
+        lambda: _reference_numbers(number_detector, image), repeats
+    )
+    batched_ms = _time_ms(lambda: batched(image), repeats)
+    logger.info("Number detection (ms per frame)")
+    logger.info(f"  per-bar {per_bar_ms:.3f}, batched {batched_ms:.3f}")
+    if frames:
+        logger.info(f"  {mismatches}/{len(frames)} recorded frames differ")
+
+
+def benchmark_screen_detector(repeats=500):
+    """Per-ROI vs batched screen classification for 3 and 30 screens"""
+    from clashroyalebuildabot.detectors.screen_detector import ScreenDetector
+
+    image = _synthetic_frame()
+    logger.info("Screen classification (ms per frame)")
+    for copies in (1, 10):
+        screen_detector = ScreenDetector()
+        # More screens, as if chests, shop and popups were added
+        screen_detector.screens = screen_detector.screens * copies
+        screen_detector.reference_hashes = np.tile(
+            screen_detector.reference_hashes, (copies, 1)
+        )
+        boxes = screen_detector._get_rois(image.size)[0]
+
+        def per_roi():
+            return [
+                np.mean(np.abs(screen_detector._image_hash(image.crop(box))))
+                for box in boxes
+            ]
+
+        per_roi_ms = _time_ms(per_roi, repeats)
+        batched_ms = _time_ms(lambda: screen_detector.run(image), repeats)
+        logger.info(
+            f"  {len(boxes):>2} screens: per-ROI {per_roi_ms:.3f}, "
+            f"batched {batched_ms:.3f}"
+        )
+
+
+def _reference_unit_detections(pred, sides):
+    """Per-object construction of the untracked detections"""
+    from clashroyalebuildabot.constants import DETECTOR_UNITS
+    from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+    from clashroyalebuildabot.namespaces.units import Position
+    from clashroyalebuildabot.namespaces.units import UnitDetection
+
+    allies, enemies = [], []
+    for p, side in zip(pred, sides):
+        l, t, r, b, conf, cls = p
+        bbox = (round(l), round(t), round(r), round(b))
+        tile_x, tile_y = UnitDetector._get_tile_xy(bbox)
+        detection = UnitDetection(
+            DETECTOR_UNITS[int(cls)], Position(bbox, conf, tile_x, tile_y)
+        )
+        (allies if side == "ally" else enemies).append(detection)
+    return allies, enemies
+
+
+def benchmark_unit_post_process(repeats=500):
+    """Per-object detections vs the structured array, for 10 and 30 units"""
+    from clashroyalebuildabot.constants import DETECTOR_UNITS
+    from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+
+    rng = np.random.default_rng(0)
+    logger.info("Unit post-processing (ms per frame)")
+    for n_units in (10, 30):
+        pred = np.zeros((n_units, 6), dtype=np.float32)
+        pred[:, :4] = _synthetic_bboxes(n_units)
+        pred[:, 4] = rng.uniform(0.2, 1, n_units)
+        pred[:, 5] = rng.integers(0, len(DETECTOR_UNITS), n_units)
+        sides = rng.choice(["ally", "enemy"], n_units).tolist()
+
+        def structured():
+            return UnitDetector._split_sides(
+                UnitDetector._to_array(
+                    pred[:, :4], pred[:, 4], pred[:, 5].astype(int), sides
+                )
+            )
+
+        def structured_views():
+            allies, enemies = structured()
+            return list(allies) + list(enemies)
+
+        reference_ms = _time_ms(
+            lambda: _reference_unit_detections(pred, sides), repeats
+        )
+        array_ms = _time_ms(structured, repeats)
+        views_ms = _time_ms(structured_views, repeats)
+        logger.info(
+            f"  {n_units:>2} units: dataclasses {reference_ms:.3f}, "
+            f"array {array_ms:.3f}, array + all views {views_ms:.3f}"
+        )
+
+
+def _load_frames(frames_dir, limit=None):
+    paths = sorted(
+        glob.glob(os.path.join(frames_dir, "*.png"))
+        + glob.glob(os.path.join(frames_dir, "*.jpg"))
+    )
+    return [Image.open(path).convert("RGB") for path in paths[:limit]]
+
+
+def _units_model_path():
+    path = os.path.join(MODELS_DIR, "units_M_480x352.onnx")
+    if not os.path.isfile(path):
+        logger.warning(f"Skipping, units model not found at {path}")
+        return None
+    return path
+
+
+def _detection_agreement(reference, other, iou_threshold=0.5):
+    """Precision and recall of `other` against `reference` detections"""
+    unmatched = list(other)
+    matched = 0
+    for ref in reference:
+        for det in unmatched:
+            if det.unit != ref.unit:
+                continue
+            a, b = ref.position.bbox, det.position.bbox
+            inter = max(0, min(a[2], b[2]) - max(a[0], b[0])) * max(
+                0, min(a[3], b[3]) - max(a[1], b[1])
+            )
+            union = (
+                (a[2] - a[0]) * (a[3] - a[1])
+                + (b[2] - b[0]) * (b[3] - b[1])
+                - inter
+            )
+            if union > 0 and inter / union >= iou_threshold:
+                unmatched.remove(det)
+                matched += 1
+                break
+    precision = matched / len(other) if other else 1.0
+    recall = matched / len(reference) if reference else 1.0
+    return precision, recall
+
+
+def benchmark_unit_change_detection(frames_dir=FRAMES_DIR, limit=None):
+    """Inference calls saved by frame differencing on a recorded session"""
+    from clashroyalebuildabot import Cards
+    from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+
+    model_path = _units_model_path()
+    if model_path is None:
+        return
+    frames = _load_frames(frames_dir, limit)
+    if not frames:
+        logger.warning(f"Skipping, no frames found in {frames_dir}")
+        return
+
+    cards = [Cards.KNIGHT, Cards.ARCHERS, Cards.GIANT, Cards.MUSKETEER]
+    reference = UnitDetector(model_path, cards, track_units=False)
+    gated = UnitDetector(
+        model_path, cards, track_units=False, change_detection=True
+    )
+
+    precisions, recalls = [], []
+    reference_ms = gated_ms = 0.0
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        ref_allies, ref_enemies = reference.run(frame, timestamp=i)
+        mid = time.perf_counter()
+        allies, enemies = gated.run(frame, timestamp=i)
+        end = time.perf_counter()
+        reference_ms += (mid - start) * 1000
+        gated_ms += (end - mid) * 1000
+
+        precision, recall = _detection_agreement(
+            ref_allies + ref_enemies, allies + enemies
+        )
+        precisions.append(precision)
+        recalls.append(recall)
+
+    n_frames = len(frames)
+    stats = gated.stats
+    logger.info(f"Unit change detection over {n_frames} frames")
+    logger.info(
+        f"  full {stats['full']}, roi {stats['roi']}, "
+        f"skipped {stats['skipped']} "
+        f"({stats['skipped'] / n_frames:.1%} of inference calls saved)"
+    )
+    logger.info(
+        f"  ms per frame: reference {reference_ms / n_frames:.2f}, "
+        f"gated {gated_ms / n_frames:.2f}"
+    )
+    logger.info(
+        f"  agreement with reference: precision {np.mean(precisions):.3f}, "
+        f"recall {np.mean(recalls):.3f}"
+    )
+
+
+def benchmark_unit_cascade(small_model, frames_dir=FRAMES_DIR, limit=None):
+    """Medium model calls and latency saved by the small/medium cascade"""
+    from clashroyalebuildabot import Cards
+    from clashroyalebuildabot.detectors.onnx_detector import get_model_path
+    from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+
+    model_path = _units_model_path()
+    if model_path is None:
+        return
+    small_model_path = get_model_path(small_model)
+    if not os.path.isfile(small_model_path):
+        logger.warning(
+            f"Skipping, small model not found at {small_model_path}"
+        )
+        return
+    frames = _load_frames(frames_dir, limit)
+    if not frames:
+        logger.warning(f"Skipping, no frames found in {frames_dir}")
+        return
+
+    cards = [Cards.KNIGHT, Cards.ARCHERS, Cards.GIANT, Cards.MUSKETEER]
+    reference = UnitDetector(model_path, cards, track_units=False)
+    cascade = UnitDetector(
+        model_path,
+        cards,
+        track_units=False,
+        small_model_path=small_model_path,
+    )
+
+    precisions, recalls = [], []
+    reference_ms = cascade_ms = 0.0
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        ref_allies, ref_enemies = reference.run(frame, timestamp=i)
+        mid = time.perf_counter()
+        allies, enemies = cascade.run(frame, timestamp=i)
+        end = time.perf_counter()
+        reference_ms += (mid - start) * 1000
+        cascade_ms += (end - mid) * 1000
+
+        precision, recall = _detection_agreement(
+            ref_allies + ref_enemies, allies + enemies
+        )
+        precisions.append(precision)
+        recalls.append(recall)
+
+    n_frames = len(frames)
+    logger.info(f"Unit model cascade over {n_frames} frames")
+    logger.info(f"  {cascade.cascade_summary()}")
+    logger.info(
+        f"  ms per frame: medium only {reference_ms / n_frames:.2f}, "
+        f"cascade {cascade_ms / n_frames:.2f}"
+    )
+    logger.info(
+        f"  agreement with medium only: precision {np.mean(precisions):.3f}, "
+        f"recall {np.mean(recalls):.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", default=FRAMES_DIR)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument(
+        "--cascade-model",
+        default=None,
+        help="Small units model to benchmark the cascade with",
+    )
+    args = parser.parse_args()
+
+    benchmark_side_detector()
+    benchmark_letterbox()
+    benchmark_number_detector(args.frames, args.limit)
+    benchmark_screen_detector()
+    benchmark_unit_post_process()
+    benchmark_unit_change_detection(args.frames, args.limit)
+    if args.cascade_model:
+        benchmark_unit_cascade(args.cascade_model, args.frames, args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Benchmark the MCTS search on synthetic game states.
+
+Reports the iterations per second run_mcts reaches within the bot's
+200 ms budget, with 0, 10 and 30 units on the board.
+"""
+
+import argparse
+from copy import deepcopy
+from dataclasses import replace
+import math
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from loguru import logger
+import numpy as np
+
+from clashroyalebuildabot.actions import ArchersAction
+from clashroyalebuildabot.actions import GiantAction
+from clashroyalebuildabot.actions import KnightAction
+from clashroyalebuildabot.actions import MusketeerAction
+from clashroyalebuildabot.ai.action_space import ActionSpace
+from clashroyalebuildabot.ai.macro_actions import build_hierarchy
+from clashroyalebuildabot.ai.mcts import action_priors
+from clashroyalebuildabot.ai.mcts import best_action
+from clashroyalebuildabot.ai.mcts import evaluate_actions
+from clashroyalebuildabot.ai.mcts import evaluate_codes
+from clashroyalebuildabot.ai.mcts import run_mcts
+from clashroyalebuildabot.ai.mcts import get_card_from_action
+from clashroyalebuildabot.ai.mcts import heuristic_evaluation
+from clashroyalebuildabot.ai.mcts import MCTSNode
+from clashroyalebuildabot.ai.mcts import search
+from clashroyalebuildabot.ai.mcts import simulate_action
+from clashroyalebuildabot.ai.search_state import KEY_TILE_STEP
+from clashroyalebuildabot.ai.search_state import SearchState
+from clashroyalebuildabot.ai.tree_cache import TreeCache
+from clashroyalebuildabot.constants import ALLY_TILES
+from clashroyalebuildabot.constants import DETECTOR_UNITS
+from clashroyalebuildabot.namespaces import Cards
+from clashroyalebuildabot.namespaces import Screens
+from clashroyalebuildabot.namespaces import State
+from clashroyalebuildabot.namespaces.numbers import NumberDetection
+from clashroyalebuildabot.namespaces.numbers import Numbers
+from clashroyalebuildabot.namespaces.units import Position
+from clashroyalebuildabot.namespaces.units import UnitDetection
+
+ACTIONS = [KnightAction, ArchersAction, GiantAction, MusketeerAction]
+
+
+def synthetic_state(n_units, elixir=7.0, towers=(1.0, 0.4, 1.0, 0.7), seed=0):
+    """In-game state with `n_units` units, half of them enemies"""
+    rng = np.random.default_rng(seed)
+    units = []
+    for _ in range(n_units):
+        tile_x, tile_y = rng.integers(0, 18), rng.integers(0, 32)
+        position = Position((0, 0, 0, 0), 0.9, int(tile_x), int(tile_y))
+        unit = DETECTOR_UNITS[rng.integers(len(DETECTOR_UNITS))]
+        units.append(UnitDetection(unit, position))
+
+    def number(value):
+        return NumberDetection((0, 0, 0, 0), value)
+
+    left_ally, right_ally, left_enemy, right_enemy = towers
+    numbers = Numbers(
+        number(left_enemy),
+        number(right_enemy),
+        number(left_ally),
+        number(right_ally),
+        number(elixir),
+    )
+    cards = (Cards.MINIONS, Cards.KNIGHT, Cards.ARCHERS, Cards.GIANT)
+    cards += (Cards.MUSKETEER,)
+    return State(
+        units[: n_units // 2],
+        units[n_units // 2 :],
+        numbers,
+        cards,
+        [0, 1, 2, 3],
+        Screens.IN_GAME,
+    )
+
+
+def next_frame(state, rng, tile_step=KEY_TILE_STEP):
+    """
+    `state` as seen on a next frame: units detected in another order,
+    moved within their quantized_key cell, and a bit more elixir
+    """
+
+    def moved(units):
+        units = [units[i] for i in rng.permutation(len(units))]
+        return [
+            replace(
+                unit,
+                position=replace(
+                    unit.position,
+                    tile_x=unit.position.tile_x // tile_step * tile_step
+                    + int(rng.integers(tile_step)),
+                    tile_y=unit.position.tile_y // tile_step * tile_step
+                    + int(rng.integers(tile_step)),
+                ),
+            )
+            for unit in units
+        ]
+
+    elixir = state.numbers.elixir
+    # Stay within the same whole elixir
+    number = min(elixir.number + 0.05, math.floor(elixir.number) + 0.95)
+    return replace(
+        state,
+        allies=moved(state.allies),
+        enemies=moved(state.enemies),
+        numbers=replace(state.numbers, elixir=replace(elixir, number=number)),
+    )
+
+
+def synthetic_actions():
+    """What Bot.get_actions gives for the synthetic hand"""
+    return [
+        action(i, x, y)
+        for i, action in enumerate(ACTIONS)
+        for x, y in ALLY_TILES
+    ]
+
+
+def synthetic_space(state):
+    """What Bot.get_action_space gives for the synthetic hand"""
+    return ActionSpace.from_state(
+        state, {action.CARD: action for action in ACTIONS}
+    )
+
+
+def _reference_simulate_action(state, action):
+    """Simulation that rebuilds the numbers and state of every node"""
+    card = get_card_from_action(state, action)
+    new_elixir = NumberDetection(
+        bbox=state.numbers.elixir.bbox,
+        number=max(0, state.numbers.elixir.number - card.cost),
+    )
+    new_numbers = Numbers(
+        left_enemy_princess_hp=state.numbers.left_enemy_princess_hp,
+        right_enemy_princess_hp=state.numbers.right_enemy_princess_hp,
+        left_ally_princess_hp=state.numbers.left_ally_princess_hp,
+        right_ally_princess_hp=state.numbers.right_ally_princess_hp,
+        elixir=new_elixir,
+    )
+    new_allies = list(state.allies)
+    for unit in card.units:
+        position = Position((0, 0, 0, 0), 1.0, action.tile_x, action.tile_y)
+        new_allies.append(UnitDetection(unit, position))
+    return State(
+        allies=new_allies,
+        enemies=list(state.enemies),
+        numbers=new_numbers,
+        cards=state.cards,
+        ready=state.ready,
+        screen=state.screen,
+    )
+
+
+def _reference_heuristic_evaluation(state):
+    """heuristic_evaluation over the State dataclasses"""
+    score = 0.0
+    numbers = state.numbers
+    my_left_hp = numbers.left_ally_princess_hp.number
+    my_right_hp = numbers.right_ally_princess_hp.number
+    enemy_left_hp = numbers.left_enemy_princess_hp.number
+    enemy_right_hp = numbers.right_enemy_princess_hp.number
+    desperate_defense = my_left_hp == 0 or my_right_hp == 0
+    score += (my_left_hp + my_right_hp - enemy_left_hp - enemy_right_hp) * 300
+    if my_left_hp == 0:
+        score -= 10000
+    if my_right_hp == 0:
+        score -= 10000
+
+    enemy_on_our_side = False
+    for enemy in state.enemies:
+        if enemy.position.tile_y < 16:
+            enemy_on_our_side = True
+            threat_multiplier = 16 - enemy.position.tile_y
+            score -= getattr(enemy.unit, "cost", 3) * threat_multiplier * 250
+    if enemy_on_our_side:
+        for ally in state.allies:
+            if ally.position.tile_y > 16:
+                score -= 20000
+
+    current_elixir = numbers.elixir.number
+    if desperate_defense:
+        score -= 20000
+        for ally in state.allies:
+            if ally.position.tile_y > 16:
+                score -= 10000
+    elif enemy_on_our_side:
+        score -= 5000
+        score += current_elixir * 250
+    elif current_elixir == 10:
+        score -= 2000
+    elif current_elixir >= 8:
+        score += 500
+
+    defensive_troops_value = 0
+    for ally in state.allies:
+        if ally.position.tile_y <= 16:
+            defensive_troops_value += getattr(ally.unit, "cost", 0)
+    if (
+        not desperate_defense
+        and not enemy_on_our_side
+        and defensive_troops_value > 5
+    ):
+        score += defensive_troops_value * 200
+
+    for ally in state.allies:
+        tile = (ally.position.tile_x, ally.position.tile_y)
+        if tile in {(7, 5), (10, 5)} and enemy_on_our_side:
+            score += 500
+    return score
+
+
+def _reference_evaluation(state):
+    return _reference_heuristic_evaluation(deepcopy(state))
+
+
+def iterations_per_second(state, actions, time_limit_ms, rounds, **kwargs):
+    """Best-of-rounds search throughput"""
+    best = 0.0
+    for i in range(rounds):
+        random.seed(i)
+        _, iterations = search(state, actions, time_limit_ms, **kwargs)
+        best = max(best, iterations * 1000 / time_limit_ms)
+    return best
+
+
+def benchmark_search(time_limit_ms=200, rounds=3):
+    space = synthetic_space(synthetic_state(0, elixir=10.0))
+    logger.info(
+        f"MCTS iterations per second ({len(space)} root actions, "
+        f"{time_limit_ms} ms budget)"
+    )
+    for n_units in (0, 10, 30):
+        state = synthetic_state(n_units, elixir=10.0)
+
+        def reference_simulate(state, code):
+            return _reference_simulate_action(state, space.to_action(code))
+
+        reference = iterations_per_second(
+            state,
+            space.codes,
+            time_limit_ms,
+            rounds,
+            simulate=reference_simulate,
+            evaluate=_reference_evaluation,
+        )
+        current = iterations_per_second(
+            SearchState.from_state(state), space.codes, time_limit_ms, rounds
+        )
+        cards = build_hierarchy(
+            state, space.codes, action_priors(state, space.actions())
+        )
+        puct = iterations_per_second(
+            SearchState.from_state(state),
+            cards.actions,
+            time_limit_ms,
+            rounds,
+            priors=cards.priors,
+        )
+        logger.info(
+            f"  {n_units:>2} units: copying {reference:,.0f}, "
+            f"current {current:,.0f} ({current / reference:.1f}x), "
+            f"PUCT over the hierarchy {puct:,.0f}"
+        )
+
+
+def _time_ms(func, repeats):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def benchmark_evaluate_actions(repeats=20):
+    actions = synthetic_actions()
+    logger.info(f"Scoring all {len(actions)} root actions (ms)")
+    for n_units in (0, 10, 30):
+        state = SearchState.from_state(synthetic_state(n_units))
+
+        def one_by_one():
+            return [
+                heuristic_evaluation(simulate_action(state, action))
+                for action in actions
+            ]
+
+        loop_ms = _time_ms(one_by_one, repeats)
+        batch_ms = _time_ms(lambda: evaluate_actions(state, actions), repeats)
+        codes = synthetic_space(synthetic_state(n_units)).codes
+        codes_ms = _time_ms(lambda: evaluate_codes(state, codes), repeats)
+        logger.info(
+            f"  {n_units:>2} units: one by one {loop_ms:.2f}, "
+            f"batched {batch_ms:.2f}, encoded {codes_ms:.2f}"
+        )
+
+
+def benchmark_action_generation(repeats=200):
+    state = synthetic_state(10, elixir=10.0)
+    space = synthetic_space(state)
+    logger.info(f"Generating the {len(space)} legal actions (ms)")
+    objects_ms = _time_ms(lambda: space.actions(), repeats)
+    codes_ms = _time_ms(lambda: synthetic_space(state), repeats)
+    logger.info(f"  Action objects {objects_ms:.3f}, codes {codes_ms:.3f}")
+
+    untried = space.codes.tolist()
+
+    def remove_all():
+        actions = list(untried)
+        while actions:
+            actions.remove(random.choice(actions))
+
+    def pop_all():
+        node = MCTSNode(None)
+        node.get_untried_actions(list(untried))
+        while node.untried_actions:
+            node.pop_untried_action()
+
+    logger.info(f"Emptying {len(untried)} untried actions (ms)")
+    remove_ms = _time_ms(remove_all, 5)
+    pop_ms = _time_ms(pop_all, 5)
+    logger.info(f"  list.remove {remove_ms:.2f}, swap and pop {pop_ms:.2f}")
+
+
+def stable_best_move(state, actions, priors, checkpoints, **kwargs):
+    """
+    Fewest checkpoint iterations from which the most visited move no
+    longer changes, and that move
+    """
+    search_state = SearchState.from_state(state)
+    moves = []
+    for n in checkpoints:
+        random.seed(0)
+        root, _ = search(
+            search_state,
+            actions,
+            math.inf,
+            priors=priors,
+            max_iterations=n,
+            **kwargs,
+        )
+        moves.append(best_action(root))
+    stable = len(moves) - 1
+    while stable and moves[stable - 1] == moves[-1]:
+        stable -= 1
+    return checkpoints[stable], moves[-1]
+
+
+def benchmark_convergence(max_iterations=3200):
+    """
+    UCB1 against PUCT with calculate_score priors, over the flat actions
+    and over the card, region and tile hierarchy, on a set of states
+    """
+    checkpoints = [25 * 2**i for i in range(8) if 25 * 2**i <= max_iterations]
+    logger.info(
+        "Iterations until the best move is stable, and how far that move "
+        "is from the best one-ply score"
+    )
+    for n_units, elixir, seed in [
+        (0, 10.0, 0),
+        (10, 6.0, 1),
+        (10, 9.0, 2),
+        (30, 4.0, 3),
+        (30, 8.0, 4),
+        (30, 7.0, 5),
+    ]:
+        state = synthetic_state(n_units, elixir, seed=seed)
+        space = synthetic_space(state)
+        values = evaluate_codes(state, space.codes)
+        priors = action_priors(state, space.actions())
+        cards = build_hierarchy(state, space.codes, priors)
+        results = []
+        for name, actions, method_priors, kwargs in [
+            ("UCB1", space.codes, None, {}),
+            ("PUCT", space.codes, priors, {"c_puct": 30, "widening": None}),
+            ("hierarchy", cards.actions, cards.priors, {}),
+        ]:
+            stable, move = stable_best_move(
+                state, actions, method_priors, checkpoints, **kwargs
+            )
+            gap = values.max() - values[list(space.codes).index(move)]
+            results.append(f"{name} {stable:>4} (gap {gap:,.0f})")
+        logger.info(
+            f"  {n_units:>2} units, {elixir:>4} elixir: " + ", ".join(results)
+        )
+
+
+def benchmark_tree_reuse(decisions=10, time_limit_ms=50):
+    """Search budget of trees kept across decisions"""
+    logger.info(
+        f"Root visits over {decisions} decisions of {time_limit_ms} ms on "
+        "consecutive frames of the same state"
+    )
+    for n_units in (10, 30):
+        state = synthetic_state(n_units, elixir=6.2, seed=n_units)
+        space = synthetic_space(state)
+        bot = SimpleNamespace(state=state, get_action_space=lambda: space)
+        cache = TreeCache()
+        rng = np.random.default_rng(0)
+        visits = []
+        for _ in range(decisions):
+            bot.state = next_frame(bot.state, rng)
+            run_mcts(bot, time_limit_ms, cache=cache)
+            root = cache.get(SearchState.from_state(bot.state))
+            visits.append(root.visits)
+        logger.info(
+            f"  {n_units:>2} units: {visits[0]:,} for a new tree, "
+            f"{visits[-1]:,} reused"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--time-limit-ms", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    benchmark_search(args.time_limit_ms, args.rounds)
+    benchmark_evaluate_actions()
+    benchmark_action_generation()
+    benchmark_convergence()
+    benchmark_tree_reuse()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
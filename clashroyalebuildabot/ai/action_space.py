@@ -0,0 +1,73 @@
+import numpy as np
+
+from clashroyalebuildabot.constants import ALL_TILES
+from clashroyalebuildabot.constants import N_WIDE_TILES
+from clashroyalebuildabot.constants import VALID_TILES
+
+# Tiles are numbered row by row over the whole arena
+N_TILE_ROWS = 32
+N_TILE_IDS = N_TILE_ROWS * N_WIDE_TILES
+
+
+def tile_ids(tiles):
+    return np.array([y * N_WIDE_TILES + x for x, y in tiles], dtype=np.int64)
+
+
+ALL_TILE_IDS = tile_ids(ALL_TILES)
+VALID_TILE_IDS = {key: tile_ids(tiles) for key, tiles in VALID_TILES.items()}
+
+
+def encode(slot, tile_x, tile_y):
+    """Integer code of playing the card in hand `slot` on a tile"""
+    return slot * N_TILE_IDS + tile_y * N_WIDE_TILES + tile_x
+
+
+def decode(codes):
+    """(slot, tile_x, tile_y) of a code, or elementwise of an array"""
+    slots, tiles = divmod(codes, N_TILE_IDS)
+    tile_y, tile_x = divmod(tiles, N_WIDE_TILES)
+    return slots, tile_x, tile_y
+
+
+class ActionSpace:
+    """
+    Legal plays of a state as integer codes, see `encode`, in the order
+    Bot.get_actions used to create them. Action objects are only built
+    by `to_action`, for the move that is played or for scoring.
+    """
+
+    def __init__(self, codes, cards, cards_to_actions):
+        self.codes = codes
+        self.cards = cards
+        self.cards_to_actions = cards_to_actions
+
+    @classmethod
+    def from_state(cls, state, cards_to_actions):
+        numbers = state.numbers
+        valid_tile_ids = VALID_TILE_IDS[
+            (
+                numbers.left_enemy_princess_hp.number == 0,
+                numbers.right_enemy_princess_hp.number == 0,
+            )
+        ]
+        codes = []
+        for i in state.ready:
+            card = state.cards[i + 1]
+            if numbers.elixir.number < card.cost:
+                continue
+            ids = ALL_TILE_IDS if card.target_anywhere else valid_tile_ids
+            codes.append(i * N_TILE_IDS + ids)
+        codes = np.concatenate(codes) if codes else np.zeros(0, np.int64)
+        return cls(codes, state.cards, cards_to_actions)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def to_action(self, code):
+        slot, tile_x, tile_y = decode(int(code))
+        return self.cards_to_actions[self.cards[slot + 1]](
+            slot, tile_x, tile_y
+        )
+
+    def actions(self):
+        return [self.to_action(code) for code in self.codes]
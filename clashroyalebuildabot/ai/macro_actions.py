@@ -0,0 +1,110 @@
+import numpy as np
+
+from clashroyalebuildabot.ai.action_space import decode
+from clashroyalebuildabot.ai.search_state import SearchState
+
+# Regions of the arena, by tile row on our side of the river. Tiles
+# within a tile of an enemy unit are "overhead" whatever their row.
+OVERHEAD = "overhead"
+KING = "king"
+LANES = ("left lane", "right lane")
+BRIDGES = ("left bridge", "right bridge")
+ENEMY_SIDE = "enemy side"
+# Spells place no units: away from the enemies any tile is as good
+ANYWHERE = "anywhere"
+KING_MAX_TILE_Y = 2
+BRIDGE_MIN_TILE_Y = 12
+ENEMY_SIDE_MIN_TILE_Y = 15
+LEFT_MAX_TILE_X = 8
+
+
+class MacroAction:
+    """
+    A choice among `actions`, encoded actions or finer MacroActions,
+    with `priors` summing to 1, for a coarse-to-fine search over the
+    placements. `label` names the card slot or region.
+    """
+
+    def __init__(self, label, actions, priors):
+        self.label = label
+        self.actions = actions
+        self.priors = priors
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __repr__(self):
+        return f"MacroAction({self.label}, {len(self)} actions)"
+
+
+def tile_regions(tile_x, tile_y, enemies, target_anywhere=False):
+    """Region of each tile, for a card that targets anywhere or not"""
+    side = (tile_x > LEFT_MAX_TILE_X).astype(int)
+    regions = np.where(
+        tile_y >= BRIDGE_MIN_TILE_Y,
+        np.array(BRIDGES, dtype=object)[side],
+        np.array(LANES, dtype=object)[side],
+    )
+    regions[tile_y <= KING_MAX_TILE_Y] = KING
+    regions[tile_y >= ENEMY_SIDE_MIN_TILE_Y] = ENEMY_SIDE
+    if target_anywhere:
+        regions[:] = ANYWHERE
+
+    overhead = np.zeros(len(tile_x), dtype=bool)
+    for enemy_x, enemy_y in zip(enemies["tile_x"], enemies["tile_y"]):
+        overhead |= (abs(tile_x - enemy_x) <= 1) & (abs(tile_y - enemy_y) <= 1)
+    regions[overhead] = OVERHEAD
+    return regions
+
+
+def _choice(label, groups):
+    """MacroAction over (actions, weights) groups, by decreasing weight"""
+    groups = [(actions, weights.sum()) for actions, weights in groups]
+    total = sum(weight for _, weight in groups)
+    groups.sort(key=lambda group: -group[1])
+    return MacroAction(
+        label,
+        [actions for actions, _ in groups],
+        np.array([weight / total for _, weight in groups]),
+    )
+
+
+def build_hierarchy(state, codes, priors):
+    """
+    Card slot, then region, then tile MacroActions over the encoded
+    actions `codes`. The prior of each choice is the sum of the `priors`
+    of the actions under it, so their product along a path is the prior
+    of the action.
+    """
+    state = SearchState.from_state(state)
+    codes = np.asarray(codes)
+    priors = np.asarray(priors, dtype=np.float64)
+    slots, tile_x, tile_y = decode(codes)
+    enemies = state.enemies
+
+    cards = []
+    for slot in np.unique(slots):
+        in_slot = slots == slot
+        card = state.cards[slot + 1]
+        regions = tile_regions(
+            tile_x[in_slot], tile_y[in_slot], enemies, card.target_anywhere
+        )
+        slot_codes, slot_priors = codes[in_slot], priors[in_slot]
+        tiles = []
+        for region in np.unique(regions):
+            in_region = regions == region
+            order = np.argsort(-slot_priors[in_region], kind="stable")
+            region_codes = slot_codes[in_region][order]
+            region_priors = slot_priors[in_region][order]
+            tiles.append(
+                (
+                    MacroAction(
+                        (card.name, region),
+                        region_codes.tolist(),
+                        region_priors / region_priors.sum(),
+                    ),
+                    region_priors,
+                )
+            )
+        cards.append((_choice(card.name, tiles), slot_priors))
+    return _choice("card", cards)
@@ -1,15 +1,46 @@
 import math
 import random
 import time
-from copy import deepcopy
 
-from clashroyalebuildabot.namespaces.units import UnitDetection, Position
-from clashroyalebuildabot.namespaces.numbers import NumberDetection
-from clashroyalebuildabot.namespaces.state import State
+from loguru import logger
+import numpy as np
+
+from clashroyalebuildabot.ai.action_space import decode
+from clashroyalebuildabot.ai.macro_actions import build_hierarchy
+from clashroyalebuildabot.ai.macro_actions import MacroAction
+from clashroyalebuildabot.ai.search_state import KING_ACTIVATION_TILES
+from clashroyalebuildabot.ai.search_state import RIVER_TILE_Y
+from clashroyalebuildabot.ai.search_state import SearchState
+
+
+# Exploration weight of the PUCT selection, on values scaled to [0, 1].
+# For the card, region and tile levels of build_hierarchy: searching the
+# thousand flat actions at once needs about 30.
+C_PUCT = 3.0
+# Progressive widening (c, alpha): a node visited n times selects among
+# its ceil(c * n**alpha) actions of highest prior
+WIDENING = (4.0, 0.5)
+
+
+class MinMaxStats:
+    """Range of the values seen in the tree, to scale them to [0, 1]"""
+
+    def __init__(self):
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def update(self, value):
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def normalize(self, values):
+        if self.maximum > self.minimum:
+            return (values - self.minimum) / (self.maximum - self.minimum)
+        return np.zeros_like(values)
 
 
 class MCTSNode:
-    def __init__(self, game_state, parent=None, action=None):
+    def __init__(self, game_state, parent=None, action=None, index=None):
         self.game_state = game_state
         self.parent = parent
         self.action = action
@@ -18,29 +49,95 @@ class MCTSNode:
         self.value = 0.0
         self.untried_actions = None
 
+        # PUCT selection, see set_priors. `index` is the position of the
+        # node's action among the parent's actions.
+        self.index = index
+        self.actions = None
+        self.priors = None
+        self.child_visits = None
+        self.child_values = None
+        self.expanded = None
+        # MinMaxStats of the tree, on the root
+        self.stats = None
+
     def get_untried_actions(self, all_possible_actions):
         if self.untried_actions is None:
             self.untried_actions = all_possible_actions
         return self.untried_actions
 
+    def pop_untried_action(self):
+        """Remove and return a random untried action in O(1)"""
+        untried = self.untried_actions
+        i = random.randrange(len(untried))
+        untried[i], untried[-1] = untried[-1], untried[i]
+        return untried.pop()
+
+    def set_priors(self, actions, priors):
+        """Select among `actions` with PUCT, see select_puct"""
+        priors = np.asarray(priors, dtype=np.float64)
+        order = np.argsort(-priors, kind="stable")
+        self.actions = [actions[i] for i in order]
+        self.priors = priors[order]
+        self.child_visits = np.zeros(len(self.actions))
+        self.child_values = np.zeros(len(self.actions))
+        self.expanded = {}
+
+    def n_widened(self, widening=WIDENING):
+        """Number of actions, by decreasing prior, open to selection"""
+        if widening is None:
+            return len(self.actions)
+        c, alpha = widening
+        n = math.ceil(c * max(self.visits, 1) ** alpha)
+        return min(n, len(self.actions))
+
+    def select_puct(self, stats, c_puct=C_PUCT, widening=WIDENING):
+        """
+        Index of the action maximizing the PUCT score: the mean value
+        scaled by `stats`, the node's own for actions never tried, plus
+        exploration proportional to the prior. Expanded or not, unlike
+        UCB1, among the actions opened by progressive widening.
+        """
+        n = self.n_widened(widening)
+        visits = self.child_visits[:n]
+        tried = visits > 0
+        q = np.full(n, 0.0)
+        if self.visits:
+            q[:] = stats.normalize(self.value / self.visits)
+        q[tried] = stats.normalize(
+            self.child_values[:n][tried] / visits[tried]
+        )
+        u = self.priors[:n] * (c_puct * math.sqrt(max(self.visits, 1)))
+        return int(np.argmax(q + u / (1 + visits)))
+
+    def exclude(self, index):
+        """Never select the action at `index` again"""
+        self.priors[index] = -np.inf
+
     def select_child(self, exploration_weight=1.41):
         """Select a child node using the UCB1 formula."""
-        best_child = max(self.children,
-                         key=lambda c: (c.value / c.visits) + exploration_weight * math.sqrt(
-                             2 * math.log(self.visits) / c.visits))
+        best_child = max(
+            self.children,
+            key=lambda c: (c.value / c.visits)
+            + exploration_weight
+            * math.sqrt(2 * math.log(self.visits) / c.visits),
+        )
         return best_child
 
-    def expand(self, action, new_state):
+    def expand(self, action, new_state, index=None):
         """Expand the tree with a new child node."""
-        child = MCTSNode(new_state, parent=self, action=action)
-        self.untried_actions.remove(action)
+        child = MCTSNode(new_state, parent=self, action=action, index=index)
         self.children.append(child)
+        if index is not None:
+            self.expanded[index] = child
         return child
 
     def update(self, result):
         """Backpropagate the simulation result."""
         self.visits += 1
         self.value += result
+        if self.index is not None:
+            self.parent.child_visits[self.index] += 1
+            self.parent.child_values[self.index] += result
 
 
 def get_card_from_action(state, action):
@@ -48,57 +145,48 @@ def get_card_from_action(state, action):
 
 
 def simulate_action(state, action):
-    """Create a hypothetical future state after an action."""
+    """
+    Create a hypothetical future state after an action: the card's units
+    are placed on the tile, without predicting movement or combat
+    """
+    state = SearchState.from_state(state)
     card = get_card_from_action(state, action)
+    return state.play(card, action.tile_x, action.tile_y)
 
-    # 1. Create new elixir state (decrease elixir)
-    new_elixir = NumberDetection(
-        bbox=state.numbers.elixir.bbox,
-        number=max(0, state.numbers.elixir.number - card.cost)
-    )
-
-    # 2. Create new numbers object with updated elixir
-    new_numbers = state.numbers.__class__(
-        left_enemy_princess_hp=state.numbers.left_enemy_princess_hp,
-        right_enemy_princess_hp=state.numbers.right_enemy_princess_hp,
-        left_ally_princess_hp=state.numbers.left_ally_princess_hp,
-        right_ally_princess_hp=state.numbers.right_ally_princess_hp,
-        elixir=new_elixir
-    )
 
-    # 3. Add new units to the board (approximation)
-    new_allies = list(state.allies)  # Copy existing allies
-    for unit_template in card.units:
-        # This is a simplified simulation. A more advanced version would
-        # predict movement and combat.
-        new_unit_pos = Position(bbox=(0, 0, 0, 0), conf=1.0, tile_x=action.tile_x, tile_y=action.tile_y)
-        new_unit = UnitDetection(unit_template, new_unit_pos)
-        new_allies.append(new_unit)
-
-    # 4. Create new state with updated values
-    new_state = State(
-        allies=new_allies,
-        enemies=list(state.enemies),  # Copy enemies
-        numbers=new_numbers,
-        cards=state.cards,
-        ready=state.ready,
-        screen=state.screen
+def action_priors(state, actions, floor=0.1):
+    """
+    Search priors over `actions` from the first term of their
+    calculate_score rule, on the observed `state`. Every action keeps
+    `floor` weight, so none is ruled out.
+    """
+    weights = np.full(len(actions), floor)
+    for i, action in enumerate(actions):
+        try:
+            weights[i] += max(action.calculate_score(state)[0], 0)
+        except Exception:
+            continue
+    return weights / weights.sum()
+
+
+def simulate_code(state, code):
+    """simulate_action for an action encoded by action_space.encode"""
+    slot, tile_x, tile_y = decode(code)
+    return SearchState.from_state(state).play(
+        state.cards[slot + 1], tile_x, tile_y
     )
 
-    return new_state
-
 
-def heuristic_evaluation(state):
+def _score(state, elixir, allies_across, defensive_troops_value, king_allies):
     """
-    V4: Final version with extreme defensive focus.
+    heuristic_evaluation of `state` with its ally features and elixir
+    replaced by the given ones, which can be arrays over candidate plays:
+    siblings only differ in those
     """
     score = 0.0
 
     # 1. TOWER HEALTH & Desperate Defense Mode
-    my_left_hp = state.numbers.left_ally_princess_hp.number
-    my_right_hp = state.numbers.right_ally_princess_hp.number
-    enemy_left_hp = state.numbers.left_enemy_princess_hp.number
-    enemy_right_hp = state.numbers.right_enemy_princess_hp.number
+    my_left_hp, my_right_hp, enemy_left_hp, enemy_right_hp = state.towers
 
     desperate_defense = my_left_hp == 0 or my_right_hp == 0
 
@@ -112,114 +200,263 @@ def heuristic_evaluation(state):
     if my_right_hp == 0:
         score -= 10000
 
+    threat, enemy_on_our_side = state.enemy_features
+
     # 2. ADVANCED THREAT ASSESSMENT & EXTREME OFFENSIVE PENALTY
-    enemy_on_our_side = False
-    enemy_push_value = 0
-    for enemy in state.enemies:
-        if enemy.position.tile_y < 16:
-            enemy_on_our_side = True
-            threat_multiplier = (16 - enemy.position.tile_y)
-            enemy_cost = getattr(enemy.unit, 'cost', 3)
-            score -= enemy_cost * threat_multiplier * 250
-            enemy_push_value += enemy_cost
+    score -= threat * 250
 
     # Extreme penalty for playing troops on opponent's side while defending
     if enemy_on_our_side:
-        for ally in state.allies:
-            if ally.position.tile_y > 16:
-                score -= 20000
+        score -= 20000 * allies_across
 
     # 3. DEFENSIVE URGENCY & ELIXIR MANAGEMENT
-    current_elixir = state.numbers.elixir.number
-
     if desperate_defense:
         score -= 20000
-        for ally in state.allies:
-            if ally.position.tile_y > 16:
-                score -= 10000
+        score -= 10000 * allies_across
     elif enemy_on_our_side:
         score -= 5000
-        score += current_elixir * 250
+        score += elixir * 250
     else:
-        if current_elixir == 10:
-            score -= 2000
-        elif current_elixir >= 8:
-            score += 500
+        score -= 2000 * (elixir == 10)
+        score += 500 * ((elixir >= 8) & (elixir != 10))
 
     # 4. COUNTER-PUSHING & OFFENSIVE STRATEGY
-    defensive_troops_value = 0
-    for ally in state.allies:
-        if ally.position.tile_y <= 16:
-            defensive_troops_value += getattr(ally.unit, 'cost', 0)
-
-    if not desperate_defense and not enemy_on_our_side and defensive_troops_value > 5:
-        score += defensive_troops_value * 200
+    if not desperate_defense and not enemy_on_our_side:
+        score += (defensive_troops_value > 5) * defensive_troops_value * 200
 
     # 5. POSITIONAL INTELLIGENCE & KING TOWER ACTIVATION
-    king_activation_tiles = {(7, 5), (10, 5)}
-    for ally in state.allies:
-        if (ally.position.tile_x, ally.position.tile_y) in king_activation_tiles and enemy_on_our_side:
-            score += 500
+    if enemy_on_our_side:
+        score += 500 * king_allies
 
     return score
 
 
-def run_mcts(bot_instance, time_limit_ms=300):
-    """Run the MCTS algorithm to find the best action."""
-    try:
-        start_time = time.time()
-        root = MCTSNode(bot_instance.state)
-        all_actions = bot_instance.get_actions()
-
-        if not all_actions:
-            return None
-
-        root.get_untried_actions(all_actions)
-        iterations = 0
-
-        while (time.time() - start_time) * 1000 < time_limit_ms:
-            node = root
+def heuristic_evaluation(state):
+    """
+    V4: Final version with extreme defensive focus.
+    """
+    state = SearchState.from_state(state)
+    return float(_score(state, state.elixir, *state.ally_features))
+
+
+def best_action(root):
+    """Most visited move, refining MacroActions down to an encoded one"""
+    node = root
+    while node.children:
+        node = max(node.children, key=lambda c: c.visits)
+        if not isinstance(node.action, MacroAction):
+            return node.action
+    return None
+
+
+def _evaluate(state, slots, tile_x, tile_y):
+    """Scores of playing the cards in hand `slots` on the given tiles"""
+    state = SearchState.from_state(state)
+    if not len(slots):
+        return np.zeros(0)
+
+    # Units, ally value and cost of the card in each hand slot
+    n_slots = slots.max() + 1
+    n_placed = np.zeros(n_slots)
+    placed_value = np.zeros(n_slots)
+    costs = np.zeros(n_slots)
+    for slot in np.unique(slots):
+        card = state.cards[slot + 1]
+        _, n_placed[slot], placed_value[slot] = state._placed(card, 0, 0)
+        costs[slot] = card.cost
+    n_placed, placed_value = n_placed[slots], placed_value[slots]
+
+    across = tile_y > RIVER_TILE_Y
+    king = np.zeros(len(slots), dtype=bool)
+    for king_x, king_y in KING_ACTIVATION_TILES:
+        king |= (tile_x == king_x) & (tile_y == king_y)
+
+    allies_across, defensive_troops_value, king_allies = state.ally_features
+    return _score(
+        state,
+        np.maximum(state.elixir - costs[slots], 0),
+        allies_across + n_placed * across,
+        defensive_troops_value + placed_value * ~across,
+        king_allies + n_placed * king,
+    )
 
-            # 1. Selection
-            while not node.untried_actions and node.children:
-                node = node.select_child()
 
-            # 2. Expansion
-            if node.untried_actions:
-                action = random.choice(node.untried_actions)
-                try:
-                    new_state = simulate_action(node.game_state, action)
-                    node = node.expand(action, new_state)
-                except Exception:
-                    # If simulation fails, skip this action
-                    node.untried_actions.remove(action)
+def evaluate_actions(state, actions):
+    """
+    heuristic_evaluation of the state after each of `actions`, as one
+    array, without simulating them one by one
+    """
+    if not actions:
+        return np.zeros(0)
+    slots, tile_x, tile_y = np.array(
+        [(action.index, action.tile_x, action.tile_y) for action in actions]
+    ).T
+    return _evaluate(state, slots, tile_x, tile_y)
+
+
+def evaluate_codes(state, codes):
+    """evaluate_actions for an array of encoded actions"""
+    return _evaluate(state, *decode(np.asarray(codes)))
+
+
+def search(
+    state,
+    codes,
+    time_limit_ms,
+    simulate=simulate_code,
+    evaluate=heuristic_evaluation,
+    priors=None,
+    c_puct=C_PUCT,
+    widening=WIDENING,
+    max_iterations=None,
+    root=None,
+):
+    """
+    Grow a tree from `state` over the encoded actions `codes` for
+    `time_limit_ms`, or `max_iterations`, returning the root and the
+    number of iterations. Node actions are codes, see
+    ActionSpace.to_action, or MacroActions grouping them: those refine
+    the move without changing the state, see build_hierarchy.
+
+    With `priors` over `codes` the nodes select with PUCT on min-max
+    normalized values and progressive `widening`, otherwise the root
+    expands every action once, at random, and then selects with UCB1.
+
+    Given the `root` of an earlier search from a state like `state`, see
+    TreeCache, the search goes on from its statistics instead.
+    """
+    start_time = time.time()
+    if root is None:
+        root = MCTSNode(state)
+        if isinstance(codes, np.ndarray):
+            codes = codes.tolist()
+        if priors is None:
+            root.get_untried_actions(list(codes))
+        else:
+            root.set_priors(list(codes), priors)
+        root.stats = MinMaxStats()
+    else:
+        root.game_state = state
+    stats = root.stats
+    iterations = 0
+
+    while (time.time() - start_time) * 1000 < time_limit_ms and (
+        max_iterations is None or iterations < max_iterations
+    ):
+        node = root
+
+        # 1. Selection
+        index = None
+        while True:
+            if node.priors is not None:
+                index = node.select_puct(stats, c_puct, widening)
+                if index in node.expanded:
+                    node = node.expanded[index]
                     continue
+                action = node.actions[index]
+                if not isinstance(action, MacroAction):
+                    break
+                node = node.expand(action, node.game_state, index)
+                node.set_priors(action.actions, action.priors)
+            elif not node.untried_actions and node.children:
+                node = node.select_child()
+            else:
+                break
 
-            # 3. Simulation (Rollout)
-            # A simple rollout: evaluate the state after the first move.
-            # A more complex simulation would continue for a few more random moves.
+        # 2. Expansion
+        if node.priors is not None:
+            action = node.actions[index]
             try:
-                rollout_state = deepcopy(node.game_state)
-                result = heuristic_evaluation(rollout_state)
+                new_state = simulate(node.game_state, action)
+                node = node.expand(action, new_state, index)
             except Exception:
-                # If evaluation fails, use neutral result
-                result = 0.0
+                node.exclude(index)
+                continue
+        elif node.untried_actions:
+            action = node.pop_untried_action()
+            try:
+                new_state = simulate(node.game_state, action)
+                node = node.expand(action, new_state)
+            except Exception:
+                # If simulation fails, skip this action
+                continue
 
-            # 4. Backpropagation
-            while node is not None:
-                node.update(result)
-                node = node.parent
+        # 3. Simulation (Rollout)
+        # A simple rollout: evaluate the state after the first move.
+        # Evaluation only reads the state, so it needs no copy.
+        try:
+            result = evaluate(node.game_state)
+        except Exception:
+            # If evaluation fails, use neutral result
+            result = 0.0
+        stats.update(result)
 
-            iterations += 1
+        # 4. Backpropagation
+        while node is not None:
+            node.update(result)
+            node = node.parent
 
-        # After time is up, choose the best move based on the simulations
-        if not root.children:
-            return random.choice(all_actions) if all_actions else None
+        iterations += 1
 
-        best_child = max(root.children, key=lambda c: c.visits)
-        return best_child.action
+    return root, iterations
+
+
+def run_mcts(bot_instance, time_limit_ms=300, cache=None):
+    """
+    Run the MCTS algorithm to find the best action. With a TreeCache,
+    the search resumes the tree of a similar earlier state if it has one
+    and keeps its tree for the next decisions.
+    """
+    try:
+        start_time = time.time()
+        space = bot_instance.get_action_space()
+
+        if not len(space):
+            return None
+
+        # Priors come out of the search budget
+        state = SearchState.from_state(bot_instance.state)
+        root = actions = priors = None
+        if cache is not None:
+            root = cache.get(state)
+        if root is None:
+            priors = action_priors(bot_instance.state, space.actions())
+            cards = build_hierarchy(state, space.codes, priors)
+            actions, priors = cards.actions, cards.priors
+        elapsed_ms = (time.time() - start_time) * 1000
+        root, iterations = search(
+            state,
+            actions,
+            time_limit_ms - elapsed_ms,
+            priors=priors,
+            root=root,
+        )
+        if cache is not None:
+            cache.put(state, root)
+        logger.debug(
+            f"MCTS ran {iterations} iterations, {root.visits} in the tree"
+        )
+
+        # After time is up, choose the best move based on the simulations
+        code = best_action(root)
+        if code is None:
+            return space.to_action(random.choice(space.codes))
+        return space.to_action(code)
 
     except Exception:
         # If MCTS completely fails, fall back to random action
         all_actions = bot_instance.get_actions()
         return random.choice(all_actions) if all_actions else None
+
+
+def run_one_ply(bot_instance):
+    """
+    Pick the action leading to the best evaluated state, scoring every
+    candidate at once with evaluate_codes; ties are broken at random
+    """
+    space = bot_instance.get_action_space()
+    if not len(space):
+        return None
+    values = evaluate_codes(bot_instance.state, space.codes)
+    best = np.flatnonzero(values == values.max())
+    return space.to_action(space.codes[random.choice(best)])
@@ -0,0 +1,250 @@
+import numpy as np
+
+from clashroyalebuildabot.constants import DETECTOR_UNITS
+from clashroyalebuildabot.namespaces.units import SIDES
+
+# Unit type ids are the detector class ids
+UNIT_IDS = {unit: i for i, unit in enumerate(DETECTOR_UNITS)}
+ALLY = SIDES.index("ally")
+ENEMY = SIDES.index("enemy")
+
+# Units have no cost attribute yet: enemies count as 3 elixir, allies as 0
+ENEMY_COSTS = np.array(
+    [getattr(unit, "cost", 3) for unit in DETECTOR_UNITS], dtype=np.float64
+)
+ALLY_COSTS = np.array(
+    [getattr(unit, "cost", 0) for unit in DETECTOR_UNITS], dtype=np.float64
+)
+# Units below this tile row are on our side of the river
+RIVER_TILE_Y = 16
+KING_ACTIVATION_TILES = ((7, 5), (10, 5))
+
+# One row per unit on the board. Detections carry no health, so `hp` is
+# the fraction left as simulated, 1 for every detected unit.
+UNIT_DTYPE = np.dtype(
+    [
+        ("unit_id", np.int16),
+        ("side", np.int8),
+        ("tile_x", np.int16),
+        ("tile_y", np.int16),
+        ("hp", np.float32),
+    ]
+)
+
+# Width in tiles of the cells units are quantized to by quantized_key
+KEY_TILE_STEP = 2
+
+# Placed units by (card name, tile_x, tile_y), see SearchState._placed
+_PLACED = {}
+
+
+def _units_array(detections, side):
+    array = getattr(detections, "array", None)
+    if array is not None:
+        # UnitDetections from the detector, class ids are the unit ids
+        units = np.zeros(len(array), dtype=UNIT_DTYPE)
+        units["unit_id"] = array["cls"]
+        units["tile_x"] = array["tile_x"]
+        units["tile_y"] = array["tile_y"]
+    else:
+        units = np.array(
+            [
+                (
+                    UNIT_IDS[det.unit],
+                    side,
+                    det.position.tile_x,
+                    det.position.tile_y,
+                    1.0,
+                )
+                for det in detections
+            ],
+            dtype=UNIT_DTYPE,
+        )
+    units["side"] = side
+    units["hp"] = 1.0
+    return units
+
+
+def _enemy_features(units):
+    """Threat of the enemies on our side, and whether there are any"""
+    enemies = units[units["side"] == ENEMY]
+    on_our_side = enemies["tile_y"] < RIVER_TILE_Y
+    threat = ENEMY_COSTS[enemies["unit_id"][on_our_side]] @ (
+        RIVER_TILE_Y - enemies["tile_y"][on_our_side]
+    )
+    return float(threat), bool(on_our_side.any())
+
+
+def _ally_features(units):
+    """
+    Allies across the river, elixir value of the allies on our side and
+    allies on a king activation tile
+    """
+    allies = units[units["side"] == ALLY]
+    tile_x, tile_y = allies["tile_x"], allies["tile_y"]
+    across = tile_y > RIVER_TILE_Y
+    defence = ALLY_COSTS[allies["unit_id"][~across]].sum()
+    king = sum(
+        int(np.count_nonzero((tile_x == x) & (tile_y == y)))
+        for x, y in KING_ACTIVATION_TILES
+    )
+    return int(np.count_nonzero(across)), float(defence), king
+
+
+class SearchState:
+    """
+    Compact, immutable game state for the search: one UNIT_DTYPE array
+    for the units of both sides, our elixir and the princess towers' health
+    as (left ally, right ally, left enemy, right enemy) fractions. `cards`
+    and `ready` are shared with the observed state. States hash and
+    compare by value.
+
+    The sums over units that heuristic_evaluation needs are kept along:
+    `enemy_features` from _enemy_features, which plays never change, and
+    `ally_features` from _ally_features, updated for the placed units
+    only, so evaluating a state does not loop over the board.
+    """
+
+    __slots__ = (
+        "units",
+        "elixir",
+        "towers",
+        "cards",
+        "ready",
+        "enemy_features",
+        "ally_features",
+        "_hash",
+    )
+
+    def __init__(
+        self,
+        units,
+        elixir,
+        towers,
+        cards,
+        ready,
+        enemy_features=None,
+        ally_features=None,
+    ):
+        units.flags.writeable = False
+        self.units = units
+        self.elixir = elixir
+        self.towers = towers
+        self.cards = cards
+        self.ready = ready
+        self.enemy_features = enemy_features or _enemy_features(units)
+        self.ally_features = ally_features or _ally_features(units)
+        self._hash = None
+
+    @classmethod
+    def from_state(cls, state):
+        if isinstance(state, cls):
+            return state
+        numbers = state.numbers
+        units = np.concatenate(
+            [
+                _units_array(state.allies, ALLY),
+                _units_array(state.enemies, ENEMY),
+            ]
+        )
+        towers = (
+            numbers.left_ally_princess_hp.number,
+            numbers.right_ally_princess_hp.number,
+            numbers.left_enemy_princess_hp.number,
+            numbers.right_enemy_princess_hp.number,
+        )
+        return cls(
+            units, numbers.elixir.number, towers, state.cards, state.ready
+        )
+
+    @staticmethod
+    def _placed(card, tile_x, tile_y):
+        """UNIT_DTYPE bytes of the units of `card` and their ally costs"""
+        key = (card.name, tile_x, tile_y)
+        if key not in _PLACED:
+            unit_ids = [UNIT_IDS[unit] for unit in card.units]
+            placed = np.array(
+                [(i, ALLY, tile_x, tile_y, 1.0) for i in unit_ids],
+                dtype=UNIT_DTYPE,
+            )
+            _PLACED[key] = (
+                placed.tobytes(),
+                len(unit_ids),
+                float(ALLY_COSTS[unit_ids].sum()),
+            )
+        return _PLACED[key]
+
+    def play(self, card, tile_x, tile_y):
+        """State after playing `card` at (tile_x, tile_y)"""
+        placed, n_placed, cost = self._placed(card, tile_x, tile_y)
+
+        across, defence, king = self.ally_features
+        if tile_y > RIVER_TILE_Y:
+            across += n_placed
+        else:
+            defence += cost
+        if (tile_x, tile_y) in KING_ACTIVATION_TILES:
+            king += n_placed
+
+        # Much faster than np.concatenate for small structured arrays
+        units = np.frombuffer(self.units.tobytes() + placed, dtype=UNIT_DTYPE)
+        return SearchState(
+            units,
+            max(0, self.elixir - card.cost),
+            self.towers,
+            self.cards,
+            self.ready,
+            self.enemy_features,
+            (across, defence, king),
+        )
+
+    @property
+    def allies(self):
+        return self.units[self.units["side"] == ALLY]
+
+    @property
+    def enemies(self):
+        return self.units[self.units["side"] == ENEMY]
+
+    def quantized_key(self, tile_step=KEY_TILE_STEP):
+        """
+        Hashable summary, the same for states within tolerance: units of
+        the same types on the same `tile_step` wide cells, in any order,
+        the same whole elixir, tower health within a tenth and the same
+        ready cards. Their legal actions are then the same too.
+        """
+        units = self.units
+        cells = np.stack(
+            [
+                units["unit_id"],
+                units["side"],
+                units["tile_x"] // tile_step,
+                units["tile_y"] // tile_step,
+            ]
+        ).astype(np.int16)
+        cells = cells[:, np.lexsort(cells)]
+        return (
+            int(self.elixir),
+            tuple((hp == 0, round(hp, 1)) for hp in self.towers),
+            tuple((i, self.cards[i + 1].name) for i in self.ready),
+            cells.tobytes(),
+        )
+
+    def _key(self):
+        return (self.elixir, self.towers, self.units.tobytes())
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self._key())
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, SearchState):
+            return NotImplemented
+        return hash(self) == hash(other) and self._key() == other._key()
+
+    def __repr__(self):
+        return (
+            f"SearchState({len(self.units)} units, elixir={self.elixir}, "
+            f"towers={self.towers})"
+        )
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+
+def count_nodes(root):
+    n_nodes = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        n_nodes += 1
+        stack.extend(node.children)
+    return n_nodes
+
+
+class TreeCache:
+    """
+    Search trees kept from one decision to the next, by the
+    SearchState.quantized_key of their root, so a search can resume
+    from the statistics of a state seen within tolerance. At most
+    `max_trees` trees and `max_nodes` nodes in total are kept, the least
+    recently used trees are evicted first.
+    """
+
+    def __init__(self, max_trees=16, max_nodes=100_000):
+        self.max_trees = max_trees
+        self.max_nodes = max_nodes
+        self.trees = OrderedDict()
+        self.n_nodes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.trees)
+
+    def get(self, state):
+        """Root of the tree searched from a state like `state`, or None"""
+        key = state.quantized_key()
+        if key not in self.trees:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.trees.move_to_end(key)
+        root, _ = self.trees[key]
+        return root
+
+    def put(self, state, root):
+        """Keep the tree of `root`, searched from `state`"""
+        key = state.quantized_key()
+        if key in self.trees:
+            _, n_nodes = self.trees.pop(key)
+            self.n_nodes -= n_nodes
+        n_nodes = count_nodes(root)
+        self.trees[key] = (root, n_nodes)
+        self.n_nodes += n_nodes
+        while len(self.trees) > 1 and (
+            len(self.trees) > self.max_trees or self.n_nodes > self.max_nodes
+        ):
+            _, (_, n_nodes) = self.trees.popitem(last=False)
+            self.n_nodes -= n_nodes
+
+    def clear(self):
+        self.trees.clear()
+        self.n_nodes = 0
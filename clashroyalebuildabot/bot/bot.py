@@ -5,24 +5,24 @@ import time
 import keyboard
 from loguru import logger
 
-from clashroyalebuildabot.constants import ALL_TILES
-from clashroyalebuildabot.constants import ALLY_TILES
 from clashroyalebuildabot.constants import DISPLAY_CARD_DELTA_X
 from clashroyalebuildabot.constants import DISPLAY_CARD_HEIGHT
 from clashroyalebuildabot.constants import DISPLAY_CARD_INIT_X
 from clashroyalebuildabot.constants import DISPLAY_CARD_WIDTH
 from clashroyalebuildabot.constants import DISPLAY_CARD_Y
 from clashroyalebuildabot.constants import DISPLAY_HEIGHT
-from clashroyalebuildabot.constants import LEFT_PRINCESS_TILES
-from clashroyalebuildabot.constants import RIGHT_PRINCESS_TILES
 from clashroyalebuildabot.constants import TILE_HEIGHT
 from clashroyalebuildabot.constants import TILE_INIT_X
 from clashroyalebuildabot.constants import TILE_INIT_Y
 from clashroyalebuildabot.constants import TILE_WIDTH
+from clashroyalebuildabot.constants import VALID_TILES
 from clashroyalebuildabot.detectors.detector import Detector
 from clashroyalebuildabot.emulator.emulator import Emulator
 from clashroyalebuildabot.namespaces import Screens
+from clashroyalebuildabot.ai.action_space import ActionSpace
 from clashroyalebuildabot.ai.mcts import run_mcts
+from clashroyalebuildabot.ai.mcts import run_one_ply
+from clashroyalebuildabot.ai.tree_cache import TreeCache
 from clashroyalebuildabot.visualizer import Visualizer
 from error_handling import WikifiedError
 
@@ -51,9 +51,15 @@ class Bot:
 
         self.visualizer = Visualizer(**config["visuals"])
         self.emulator = Emulator(**config["adb"])
-        self.detector = Detector(cards=cards)
+        self.detector = Detector(cards=cards, **config.get("detector", {}))
         self.state = None
         self.play_action_delay = config.get("ingame", {}).get("play_action", 1)
+        # "mcts", or "one_ply" to score every action at once instead
+        self.search = config.get("ingame", {}).get("search", "mcts")
+        # Search trees kept between decisions, see TreeCache
+        self.tree_cache = TreeCache(
+            **config.get("ingame", {}).get("tree_cache", {})
+        )
 
         # End-game screen handling coordinates (720x1280 resolution)
         self.battle_button_xy = (357.8, 984.2)  # Battle button on lobby screen
@@ -131,30 +137,21 @@ class Bot:
         return x, y
 
     def _get_valid_tiles(self):
-        tiles = ALLY_TILES
-        if self.state.numbers.left_enemy_princess_hp.number == 0:
-            tiles += LEFT_PRINCESS_TILES
-        if self.state.numbers.right_enemy_princess_hp.number == 0:
-            tiles += RIGHT_PRINCESS_TILES
-        return tiles
+        numbers = self.state.numbers
+        return VALID_TILES[
+            (
+                numbers.left_enemy_princess_hp.number == 0,
+                numbers.right_enemy_princess_hp.number == 0,
+            )
+        ]
+
+    def get_action_space(self):
+        return ActionSpace.from_state(self.state, self.cards_to_actions)
 
     def get_actions(self):
         if not self.state:
             return []
-        valid_tiles = self._get_valid_tiles()
-        actions = []
-        for i in self.state.ready:
-            card = self.state.cards[i + 1]
-            if self.state.numbers.elixir.number < card.cost:
-                continue
-
-            tiles = ALL_TILES if card.target_anywhere else valid_tiles
-            card_actions = [
-                self.cards_to_actions[card](i, x, y) for (x, y) in tiles
-            ]
-            actions.extend(card_actions)
-
-        return actions
+        return self.get_action_space().actions()
 
     def set_state(self):
         screenshot = self.emulator.take_screenshot()
@@ -166,6 +163,24 @@ class Bot:
         tile_centre = self._get_tile_centre(action.tile_x, action.tile_y)
         self.emulator.click(*card_centre)
         self.emulator.click(*tile_centre)
+        self.detector.record_play(
+            self.state.cards[action.index + 1], time.time()
+        )
+
+    def _next_action_delay(self):
+        """
+        Seconds to wait for the next decision. When the elixir is
+        tracked and no ready card is affordable, that is until the
+        cheapest one becomes affordable.
+        """
+        tracker = self.detector.elixir_tracker
+        if tracker is None or not tracker.started or not self.state.ready:
+            return self.play_action_delay
+        cost = min(self.state.cards[i + 1].cost for i in self.state.ready)
+        wait = tracker.time_until(cost, time.time())
+        if wait <= 0:
+            return self.play_action_delay
+        return round(wait, 2)
 
     def _handle_play_pause_in_step(self):
         if not pause_event.is_set():
@@ -206,6 +221,7 @@ class Bot:
             return
 
         if new_screen == Screens.END_OF_GAME:
+            self.tree_cache.clear()
             if not self.end_of_game_clicked:
                 self.emulator.click(*self.state.screen.click_xy)
                 self.end_of_game_clicked = True
@@ -230,24 +246,29 @@ class Bot:
         """
         This is the new AI core. It uses MCTS to decide the best move.
         """
-        logger.debug("Running MCTS to find best action...")
+        logger.debug(f"Running {self.search} search to find best action...")
 
         try:
-            best_action = run_mcts(self, time_limit_ms=200)  # Increased for better AI quality
+            if self.search == "one_ply":
+                best_action = run_one_ply(self)
+            else:
+                best_action = run_mcts(
+                    self, time_limit_ms=200, cache=self.tree_cache
+                )  # Increased for better AI quality
         except Exception as e:
-            logger.warning(f"MCTS failed: {e}, falling back to original scoring")
+            logger.warning(f"{self.search} search failed: {e}, falling back to original scoring")
             # Fallback to original scoring system
             best_action = self._get_best_action_fallback()
 
         if best_action is None:
             self._log_and_wait(
-                "No good actions available", self.play_action_delay
+                "No good actions available", self._next_action_delay()
             )
             return
 
         self.play_action(best_action)
         self._log_and_wait(
-            f"Playing {best_action} (chosen by MCTS)",
+            f"Playing {best_action} (chosen by {self.search})",
             self.play_action_delay,
         )
 
@@ -6,12 +6,14 @@ from clashroyalebuildabot.namespaces import Units
 SRC_DIR = os.path.dirname(__file__)
 DEBUG_DIR = os.path.join(SRC_DIR, "debug")
 MODELS_DIR = os.path.join(SRC_DIR, "models")
+OPTIMIZED_MODELS_DIR = os.path.join(MODELS_DIR, "optimized")
 IMAGES_DIR = os.path.join(SRC_DIR, "images")
 EMULATOR_DIR = os.path.join(SRC_DIR, "emulator")
 ADB_DIR = os.path.join(EMULATOR_DIR, "platform-tools")
 ADB_PATH = os.path.normpath(os.path.join(ADB_DIR, "adb"))
 SCREENSHOTS_DIR = os.path.join(DEBUG_DIR, "screenshots")
 LABELS_DIR = os.path.join(DEBUG_DIR, "labels")
+FRAMES_DIR = os.path.join(DEBUG_DIR, "frames")
 
 # Display dimensions
 DISPLAY_WIDTH = 720
@@ -28,24 +30,36 @@ N_HEIGHT_TILES = 15
 N_WIDE_TILES = 18
 TILE_INIT_X = 52
 TILE_INIT_Y = 296
-ALLY_TILES = [[x, 0] for x in range(N_WIDE_TILES // 3, 2 * N_WIDE_TILES // 3)]
-ALLY_TILES += [
-    [x, y] for x in range(N_WIDE_TILES) for y in range(1, N_HEIGHT_TILES)
-]
-ENEMY_TILES = [[x, 31 - y] for x, y in ALLY_TILES]
+# Tiles are immutable (x, y) tuples, so that no caller can grow them
+ALLY_TILES = tuple(
+    (x, 0) for x in range(N_WIDE_TILES // 3, 2 * N_WIDE_TILES // 3)
+)
+ALLY_TILES += tuple(
+    (x, y) for x in range(N_WIDE_TILES) for y in range(1, N_HEIGHT_TILES)
+)
+ENEMY_TILES = tuple((x, 31 - y) for x, y in ALLY_TILES)
 ALL_TILES = ALLY_TILES + ENEMY_TILES
-LEFT_PRINCESS_TILES = [[3, N_HEIGHT_TILES], [3, N_HEIGHT_TILES + 1]]
-LEFT_PRINCESS_TILES += [
-    [x, y]
+LEFT_PRINCESS_TILES = ((3, N_HEIGHT_TILES), (3, N_HEIGHT_TILES + 1))
+LEFT_PRINCESS_TILES += tuple(
+    (x, y)
     for x in range(N_WIDE_TILES // 2)
     for y in range(N_HEIGHT_TILES + 2, N_HEIGHT_TILES + 6)
-]
-RIGHT_PRINCESS_TILES = [[14, N_HEIGHT_TILES], [14, N_HEIGHT_TILES + 1]]
-RIGHT_PRINCESS_TILES += [
-    [x, y]
+)
+RIGHT_PRINCESS_TILES = ((14, N_HEIGHT_TILES), (14, N_HEIGHT_TILES + 1))
+RIGHT_PRINCESS_TILES += tuple(
+    (x, y)
     for x in range(N_WIDE_TILES // 2, N_WIDE_TILES)
     for y in range(N_HEIGHT_TILES + 2, N_HEIGHT_TILES + 6)
-]
+)
+# Tiles troops can be placed on, by whether the left and right enemy
+# princess towers are destroyed
+VALID_TILES = {
+    (left_down, right_down): ALLY_TILES
+    + (LEFT_PRINCESS_TILES if left_down else ())
+    + (RIGHT_PRINCESS_TILES if right_down else ())
+    for left_down in (False, True)
+    for right_down in (False, True)
+}
 DISPLAY_CARD_Y = 1067
 DISPLAY_CARD_INIT_X = 164
 DISPLAY_CARD_WIDTH = 117
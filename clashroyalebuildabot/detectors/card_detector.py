@@ -6,6 +6,7 @@ from scipy.optimize import linear_sum_assignment
 
 from clashroyalebuildabot.constants import CARD_CONFIG
 from clashroyalebuildabot.constants import IMAGES_DIR
+from clashroyalebuildabot.detectors.resampling import bilinear_weights
 from clashroyalebuildabot.namespaces.cards import Cards
 from error_handling import WikifiedError
 
@@ -14,14 +15,28 @@ class CardDetector:
     HAND_SIZE = 5
     MULTI_HASH_SCALE = 0.355
     MULTI_HASH_INTERCEPT = 163
+    # ITU-R 601-2 luma, as in PIL's convert("L")
+    LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    CHANNEL_MEAN = np.full(3, 1 / 3, dtype=np.float32)
 
-    def __init__(self, cards, hash_size=8, grey_std_threshold=5):
+    def __init__(
+        self,
+        cards,
+        hash_size=8,
+        grey_std_threshold=5,
+        hash_change_threshold=2.0,
+    ):
         self.cards = cards
         self.hash_size = hash_size
         self.grey_std_threshold = grey_std_threshold
+        self.hash_change_threshold = hash_change_threshold
 
         self.cards.extend([Cards.BLANK for _ in range(5)])
         self.card_hashes = self._calculate_card_hashes()
+        self._calculate_slot_windows()
+
+        self._last_hashes = None
+        self._last_cards = None
 
     def _calculate_multi_hash(self, image):
         gray_image = self._calculate_hash(image)
@@ -46,51 +61,117 @@ class CardDetector:
 
     def _calculate_card_hashes(self):
         card_hashes = np.zeros(
-            (
-                len(self.cards),
-                3,
-                self.hash_size * self.hash_size,
-                self.HAND_SIZE,
-            ),
+            (len(self.cards), 3, self.hash_size * self.hash_size),
             dtype=np.float32,
         )
         try:
             for i, card in enumerate(self.cards):
                 path = os.path.join(IMAGES_DIR, "cards", f"{card.name}.jpg")
                 pil_image = Image.open(path)
-
-                multi_hash = self._calculate_multi_hash(pil_image)
-                card_hashes[i] = np.tile(
-                    np.expand_dims(multi_hash, axis=2), (1, 1, self.HAND_SIZE)
-                )
+                card_hashes[i] = self._calculate_multi_hash(pil_image)
         except Exception as e:
             raise WikifiedError(
                 "005", "Can't load cards and their images."
             ) from e
         return card_hashes
 
-    def _detect_cards(self, image):
-        crops = [image.crop(position) for position in CARD_CONFIG]
-        crop_hashes = np.array(
-            [self._calculate_hash(crop) for crop in crops]
-        ).T
+    def _calculate_slot_windows(self):
+        """
+        Every hand slot is read from a window of a common size in one crop
+        of the hand area, so that all slots are hashed in one go
+        """
+        widths = [right - left for left, _, right, _ in CARD_CONFIG]
+        heights = [bottom - top for _, top, _, bottom in CARD_CONFIG]
+        window_width = max(widths)
+        window_height = max(heights)
+
+        left = min(position[0] for position in CARD_CONFIG)
+        top = min(position[1] for position in CARD_CONFIG)
+        self._hand_area = (
+            left,
+            top,
+            max(position[0] for position in CARD_CONFIG) + window_width,
+            max(position[1] for position in CARD_CONFIG) + window_height,
+        )
+        self._slot_offsets = [
+            (position[1] - top, position[0] - left) for position in CARD_CONFIG
+        ]
+        self._window_size = (window_height, window_width)
+
+        self._y_weights = np.stack(
+            [
+                bilinear_weights(h, self.hash_size, window_height)
+                for h in heights
+            ]
+        )
+        self._x_weights_t = np.stack(
+            [
+                bilinear_weights(w, self.hash_size, window_width).T
+                for w in widths
+            ]
+        )
+        # Pixels of each window that belong to the slot, for the std
+        masks = np.zeros((len(CARD_CONFIG), window_height, window_width))
+        for mask, h, w in zip(masks, heights, widths):
+            mask[:h, :w] = 1 / (h * w)
+        self._slot_masks = masks
+
+    def _slot_windows(self, image):
+        area = np.asarray(image.crop(self._hand_area))
+        window_height, window_width = self._window_size
+        return np.stack(
+            [
+                area[y : y + window_height, x : x + window_width]
+                for y, x in self._slot_offsets
+            ]
+        )
+
+    def _calculate_slot_hashes(self, windows):
+        """(HAND_SIZE, hash_size**2) grey hashes of the slot windows"""
+        grey = windows @ self.LUMA
+        hashes = self._y_weights @ grey @ self._x_weights_t
+        return hashes.reshape(len(windows), -1)
+
+    def _assign_cards(self, crop_hashes):
         hash_diffs = np.mean(
-            np.amin(np.abs(crop_hashes - self.card_hashes), axis=1), axis=1
+            np.amin(
+                np.abs(crop_hashes[None, None] - self.card_hashes[:, :, None]),
+                axis=1,
+            ),
+            axis=2,
         ).T
         _, idx = linear_sum_assignment(hash_diffs)
-        cards = [self.cards[i] for i in idx]
+        return [self.cards[i] for i in idx]
+
+    def _detect_cards(self, windows):
+        """
+        Match the slots with the deck, reusing the last hand while no
+        slot hash moved by more than hash_change_threshold
+        """
+        crop_hashes = self._calculate_slot_hashes(windows)
+        if self._last_hashes is not None and (
+            np.abs(crop_hashes - self._last_hashes).mean(axis=1).max()
+            <= self.hash_change_threshold
+        ):
+            return list(self._last_cards)
 
-        return cards, crops
+        cards = self._assign_cards(crop_hashes)
+        self._last_hashes = crop_hashes
+        self._last_cards = cards
+        return cards
 
-    def _detect_if_ready(self, crops):
-        ready = []
-        for i, crop in enumerate(crops[1:]):
-            std = np.mean(np.std(np.array(crop), axis=2))
-            if std > self.grey_std_threshold:
-                ready.append(i)
-        return ready
+    def _detect_if_ready(self, windows):
+        # Std across the channels from the first two moments, as
+        # matrix products are much faster than np.std on a length-3 axis
+        pixels = windows[1:].astype(np.float32)
+        mean = pixels @ self.CHANNEL_MEAN
+        mean_square = (pixels * pixels) @ self.CHANNEL_MEAN
+        std = np.sqrt(np.maximum(mean_square - mean * mean, 0))
+        scores = np.sum(std * self._slot_masks[1:], axis=(1, 2))
+        return np.flatnonzero(scores > self.grey_std_threshold).tolist()
 
     def run(self, image):
-        cards, crops = self._detect_cards(image)
-        ready = self._detect_if_ready(crops)
+        windows = self._slot_windows(image)
+        cards = self._detect_cards(windows)
+        ready = self._detect_if_ready(windows)
         return cards, ready
@@ -0,0 +1,60 @@
+from collections import Counter
+
+import numpy as np
+
+
+class CascadePolicy:
+    """
+    Decides when the medium units model has to run after the small one:
+    every `full_interval` detections, when more than `max_ambiguous` of
+    the small model's detections score between `low_conf` and
+    `high_conf`, or when a unit type shows up more often than in the last
+    result.
+    """
+
+    def __init__(
+        self, low_conf=0.1, high_conf=0.5, max_ambiguous=0, full_interval=10
+    ):
+        self.low_conf = low_conf
+        self.high_conf = high_conf
+        self.max_ambiguous = max_ambiguous
+        self.full_interval = max(int(full_interval), 1)
+
+        self.frames_since_full = None
+
+    @staticmethod
+    def _class_counts(pred):
+        return Counter(np.rint(pred[:, 5]).astype(int).tolist())
+
+    def _has_new_units(self, pred, previous):
+        previous_counts = self._class_counts(previous)
+        return any(
+            count > previous_counts[cls]
+            for cls, count in self._class_counts(pred).items()
+        )
+
+    def escalation_reason(self, pred, previous):
+        """
+        Why the small model detections `pred`, filtered at `low_conf`,
+        need the medium model, or None when they can be used as is
+        """
+        if (
+            previous is None
+            or self.frames_since_full is None
+            or self.frames_since_full + 1 >= self.full_interval
+        ):
+            return "interval"
+        if np.count_nonzero(pred[:, 4] < self.high_conf) > self.max_ambiguous:
+            return "ambiguous"
+        if self._has_new_units(pred, previous):
+            return "new_units"
+        return None
+
+    def record(self, escalated):
+        if escalated:
+            self.frames_since_full = 0
+        else:
+            self.frames_since_full += 1
+
+    def reset(self):
+        self.frames_since_full = None
@@ -0,0 +1,59 @@
+import numpy as np
+from scipy import ndimage
+
+
+class ChangeDetector:
+    """
+    Block-wise frame differencing against the last frame the detections
+    were computed on. Blocks are compared on a grayscale image reduced by
+    `block_size`, so each block costs a single pixel.
+    """
+
+    def __init__(self, block_size=16, threshold=8.0, margin=1):
+        self.block_size = block_size
+        self.threshold = threshold
+        self.margin = margin
+
+        self.reference = None
+        self.current = None
+
+    def run(self, image):
+        """
+        Return the boolean (rows, cols) mask of blocks that changed, or
+        None when there is no comparable reference frame.
+        """
+        self.current = np.asarray(
+            image.convert("L").reduce(self.block_size), dtype=np.int16
+        )
+        if self.reference is None or self.reference.shape != (
+            self.current.shape
+        ):
+            return None
+        return np.abs(self.current - self.reference) > self.threshold
+
+    def commit(self, mask=None):
+        """Mark the blocks in `mask`, or all of them, as processed"""
+        if mask is None or self.reference is None:
+            self.reference = self.current.copy()
+        else:
+            self.reference[mask] = self.current[mask]
+
+    def expand(self, mask):
+        if not self.margin:
+            return mask
+        return ndimage.binary_dilation(mask, iterations=self.margin)
+
+    def bounding_box(self, mask):
+        """Pixel (left, top, right, bottom) of all the changed blocks"""
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        return (
+            int(cols[0]) * self.block_size,
+            int(rows[0]) * self.block_size,
+            (int(cols[-1]) + 1) * self.block_size,
+            (int(rows[-1]) + 1) * self.block_size,
+        )
+
+    def reset(self):
+        self.reference = None
+        self.current = None
@@ -1,14 +1,20 @@
+from collections import Counter
 from copy import deepcopy
-import os
+from dataclasses import replace
 import time
 
 from loguru import logger
 
-from clashroyalebuildabot.constants import MODELS_DIR
 from clashroyalebuildabot.detectors.card_detector import CardDetector
+from clashroyalebuildabot.detectors.cascade_policy import CascadePolicy
+from clashroyalebuildabot.detectors.change_detector import ChangeDetector
+from clashroyalebuildabot.detectors.elixir_tracker import ElixirTracker
 from clashroyalebuildabot.detectors.number_detector import NumberDetector
+from clashroyalebuildabot.detectors.onnx_detector import get_model_path
+from clashroyalebuildabot.detectors.resolution_policy import ResolutionPolicy
 from clashroyalebuildabot.detectors.screen_detector import ScreenDetector
 from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+from clashroyalebuildabot.namespaces import Screens
 from clashroyalebuildabot.namespaces import State
 from error_handling import WikifiedError
 
@@ -16,7 +22,23 @@ from error_handling import WikifiedError
 class Detector:
     DECK_SIZE = 8
 
-    def __init__(self, cards):
+    def __init__(
+        self,
+        cards,
+        track_units=True,
+        unit_detection_interval=1,
+        unit_change_detection=False,
+        skip_duplicate_frames=True,
+        duplicate_frame_threshold=4.0,
+        session=None,
+        model_variant=None,
+        cascade_model=None,
+        cascade=None,
+        adaptive_resolution=False,
+        resolution=None,
+        elixir_tracking=False,
+        elixir=None,
+    ):
         if len(cards) != self.DECK_SIZE:
             raise WikifiedError(
                 "005", f"You must specify all {self.DECK_SIZE} of your cards"
@@ -27,21 +49,124 @@ class Detector:
         self.card_detector = CardDetector(self.cards)
         self.number_detector = NumberDetector()
         self.unit_detector = UnitDetector(
-            os.path.join(MODELS_DIR, "units_M_480x352.onnx"), self.cards
+            get_model_path("units_M_480x352", model_variant),
+            self.cards,
+            track_units=track_units,
+            detection_interval=unit_detection_interval,
+            change_detection=unit_change_detection,
+            session_options=session,
+            model_variant=model_variant,
+            small_model_path=(
+                get_model_path(cascade_model, model_variant)
+                if cascade_model
+                else None
+            ),
+            cascade_policy=CascadePolicy(**(cascade or {})),
+            resolution_policy=(
+                ResolutionPolicy(**(resolution or {}))
+                if adaptive_resolution
+                else None
+            ),
         )
         self.screen_detector = ScreenDetector()
+        self.elixir_tracker = (
+            ElixirTracker(**(elixir or {})) if elixir_tracking else None
+        )
+
+        self.frame_fingerprint = (
+            ChangeDetector(threshold=duplicate_frame_threshold, margin=0)
+            if skip_duplicate_frames
+            else None
+        )
+        self.last_state = None
+        self.stats = Counter()
+        self.detection_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def _is_duplicate(self, image):
+        """
+        Whether no block of the frame moved beyond the tolerance since the
+        last frame that was fully detected
+        """
+        if self.frame_fingerprint is None:
+            return False
+        changed = self.frame_fingerprint.run(image)
+        return (
+            changed is not None
+            and not changed.any()
+            and self.last_state is not None
+        )
+
+    def record_play(self, card, timestamp):
+        """Spend the elixir of `card`, played at `timestamp`"""
+        if self.elixir_tracker is not None:
+            self.elixir_tracker.spend(card.cost, timestamp)
+
+    def _track_elixir(self, numbers, screen, timestamp):
+        numbers = self.elixir_tracker.run(numbers, timestamp)
+        if screen != Screens.IN_GAME:
+            self.elixir_tracker.reset()
+        return numbers
+
+    @property
+    def skip_rate(self):
+        return self.stats["skipped"] / max(self.stats["frames"], 1)
 
     def run(self, image):
         logger.debug("Setting state...")
+        timestamp = time.time()
+        self.stats["frames"] += 1
+        if self.stats["frames"] % 100 == 0:
+            logger.debug(
+                f"Skipped {self.skip_rate:.1%} of frames as duplicates, "
+                f"saving {self.saved_seconds:.1f}s of detection"
+            )
+            if self.unit_detector.small_detector is not None:
+                logger.debug(
+                    f"Unit cascade: {self.unit_detector.cascade_summary()}"
+                )
+            if self.unit_detector.resolution is not None:
+                logger.debug(
+                    "Unit resolutions: "
+                    f"{self.unit_detector.resolution.summary()}"
+                )
+        if self._is_duplicate(image):
+            self.stats["skipped"] += 1
+            self.saved_seconds += self.detection_seconds
+            logger.debug("Frame unchanged, reusing the previous state")
+            numbers = self.last_state.numbers
+            if self.elixir_tracker is not None:
+                numbers = self.elixir_tracker.estimate(numbers, timestamp)
+            return replace(
+                self.last_state, numbers=numbers, timestamp=timestamp
+            )
+
         retries = 3
         for attempt in range(retries):
             try:
+                start = time.perf_counter()
                 cards, ready = self.card_detector.run(image)
-                allies, enemies = self.unit_detector.run(image)
-                numbers = self.number_detector.run(image)
+                allies, enemies = self.unit_detector.run(image, timestamp)
+                numbers = self.number_detector.run(
+                    image,
+                    read_elixir=self.elixir_tracker is None
+                    or self.elixir_tracker.needs_reading(timestamp),
+                )
                 screen = self.screen_detector.run(image)
+                if self.elixir_tracker is not None:
+                    numbers = self._track_elixir(numbers, screen, timestamp)
 
-                state = State(allies, enemies, numbers, cards, ready, screen)
+                state = State(
+                    allies, enemies, numbers, cards, ready, screen, timestamp
+                )
+                # Running mean of the cost of a full detection
+                self.stats["detected"] += 1
+                self.detection_seconds += (
+                    time.perf_counter() - start - self.detection_seconds
+                ) / self.stats["detected"]
+                if self.frame_fingerprint is not None:
+                    self.frame_fingerprint.commit()
+                self.last_state = state
                 return state
             except Exception as e:
                 logger.error(
@@ -0,0 +1,183 @@
+from dataclasses import replace
+import math
+
+
+class ElixirTracker:
+    """
+    Estimates our elixir with a one-dimensional Kalman filter. Between
+    readings the estimate follows the regeneration rate, one elixir every
+    `regen_seconds` scaled by the multiplier of the current phase of the
+    match, `phases` being (start second, multiplier) pairs. Our plays are
+    subtracted when they are made and the bar readings of NumberDetector
+    are noisy measurements of the estimate. A reading more than `gate`
+    standard deviations away is ignored, unless `max_rejections` of them
+    in a row disagree, in which case the filter restarts from the reading.
+
+    The match clock starts at the first reading, so the phases are only
+    right for matches followed from the start.
+    """
+
+    MAX_ELIXIR = 10
+    DEFAULT_PHASES = ((0, 1), (120, 2), (240, 3))
+
+    def __init__(
+        self,
+        regen_seconds=2.8,
+        phases=DEFAULT_PHASES,
+        sample_interval=0.5,
+        measurement_var=1.0,
+        process_var=0.05,
+        gate=3.0,
+        max_rejections=3,
+    ):
+        self.regen_seconds = regen_seconds
+        self.phases = sorted(tuple(phase) for phase in phases)
+        self.sample_interval = sample_interval
+        self.measurement_var = measurement_var
+        self.process_var = process_var
+        self.gate = gate
+        self.max_rejections = max_rejections
+        self.reset()
+
+    @property
+    def started(self):
+        return self.start is not None
+
+    def reset(self):
+        self.start = None
+        self.elixir = None
+        self.variance = None
+        self.last_update = None
+        self.last_reading = None
+        self.rejections = 0
+
+    def _rate(self, elapsed):
+        """Elixir per second `elapsed` seconds into the match"""
+        multiplier = 1
+        for start, phase_multiplier in self.phases:
+            if elapsed >= start:
+                multiplier = phase_multiplier
+        return multiplier / self.regen_seconds
+
+    def _segments(self, elapsed):
+        """(duration, rate) of the phases from `elapsed` onwards"""
+        starts = [start for start, _ in self.phases if start > elapsed]
+        for end in starts:
+            yield end - elapsed, self._rate(elapsed)
+            elapsed = end
+        yield math.inf, self._rate(elapsed)
+
+    def _regenerated(self, elapsed, seconds):
+        gained = 0.0
+        for duration, rate in self._segments(elapsed):
+            step = min(duration, seconds)
+            gained += step * rate
+            seconds -= step
+            if seconds <= 0:
+                break
+        return gained
+
+    def predict(self, timestamp):
+        """Estimate at `timestamp`, regenerating from the last update"""
+        if not self.started or timestamp <= self.last_update:
+            return self.elixir
+        seconds = timestamp - self.last_update
+        gained = self._regenerated(self.last_update - self.start, seconds)
+        self.elixir = min(self.elixir + gained, self.MAX_ELIXIR)
+        self.variance += self.process_var * seconds
+        self.last_update = timestamp
+        return self.elixir
+
+    @staticmethod
+    def _measurement(reading):
+        # The bar reading is the number of full elixir drops
+        if reading >= ElixirTracker.MAX_ELIXIR:
+            return ElixirTracker.MAX_ELIXIR
+        return reading + 0.5
+
+    def _restart(self, measurement, timestamp):
+        if not self.started:
+            self.start = timestamp
+        self.elixir = measurement
+        self.variance = self.measurement_var
+        self.last_update = timestamp
+        self.rejections = 0
+
+    def update(self, reading, timestamp):
+        """Fuse a bar reading taken at `timestamp`"""
+        self.last_reading = timestamp
+        measurement = self._measurement(reading)
+        if not self.started:
+            self._restart(measurement, timestamp)
+            return self.elixir
+
+        self.predict(timestamp)
+        innovation = measurement - self.elixir
+        innovation_var = self.variance + self.measurement_var
+        if innovation**2 > self.gate**2 * innovation_var:
+            self.rejections += 1
+            if self.rejections >= self.max_rejections:
+                self._restart(measurement, timestamp)
+            return self.elixir
+
+        self.rejections = 0
+        gain = self.variance / innovation_var
+        self.elixir = min(
+            max(self.elixir + gain * innovation, 0), self.MAX_ELIXIR
+        )
+        self.variance *= 1 - gain
+        return self.elixir
+
+    def spend(self, cost, timestamp):
+        """Subtract the cost of a card played at `timestamp`"""
+        if not self.started:
+            return
+        self.predict(timestamp)
+        self.elixir = max(self.elixir - cost, 0)
+
+    def needs_reading(self, timestamp):
+        return (
+            not self.started
+            or timestamp - self.last_reading >= self.sample_interval
+        )
+
+    def time_until(self, amount, timestamp):
+        """Seconds from `timestamp` until the estimate reaches `amount`"""
+        if not self.started:
+            return 0.0
+        elixir = self.elixir
+        elapsed = self.last_update - self.start
+        if timestamp > self.last_update:
+            elixir = min(
+                elixir
+                + self._regenerated(elapsed, timestamp - self.last_update),
+                self.MAX_ELIXIR,
+            )
+            elapsed = timestamp - self.start
+        missing = min(amount, self.MAX_ELIXIR) - elixir
+        seconds = 0.0
+        for duration, rate in self._segments(elapsed):
+            if missing <= duration * rate:
+                return seconds + max(missing, 0) / rate
+            missing -= duration * rate
+            seconds += duration
+        return seconds
+
+    def estimate(self, numbers, timestamp):
+        """`numbers` with the elixir estimate at `timestamp`"""
+        if not self.started:
+            return numbers
+        self.predict(timestamp)
+        return replace(
+            numbers, elixir=replace(numbers.elixir, number=self.elixir)
+        )
+
+    def run(self, numbers, timestamp):
+        """
+        Fuse the elixir reading of `numbers`, unless it was skipped (None),
+        and return them with the estimate
+        """
+        reading = numbers.elixir.number
+        if reading is not None:
+            self.update(reading, timestamp)
+        return self.estimate(numbers, timestamp)
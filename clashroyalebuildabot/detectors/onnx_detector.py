@@ -1,41 +1,192 @@
+import os
+
+from loguru import logger
 import numpy as np
 import onnxruntime as ort
 
+from clashroyalebuildabot.constants import MODELS_DIR
+from clashroyalebuildabot.constants import OPTIMIZED_MODELS_DIR
+
+PAD_VALUE = 114
+# Tried in this order, among the available providers
+PROVIDER_PRIORITY = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+ORT_TYPES = {
+    "tensor(float16)": np.float16,
+    "tensor(float)": np.float32,
+    "tensor(uint8)": np.uint8,
+}
+
+
+def _is_static(shape):
+    return all(isinstance(dim, int) for dim in shape)
+
+
+def get_model_path(name, variant=None):
+    """
+    Path of the `name` model in MODELS_DIR, or of its `variant` (e.g.
+    "uint8" for units_M_480x352_uint8.onnx) when that has been exported
+    """
+    path = os.path.join(MODELS_DIR, f"{name}.onnx")
+    if not variant:
+        return path
+    variant_path = os.path.join(MODELS_DIR, f"{name}_{variant}.onnx")
+    if os.path.isfile(variant_path):
+        return variant_path
+    logger.warning(f"No {variant} variant of {name}, using {path}")
+    return path
+
 
 class OnnxDetector:
-    def __init__(self, model_path):
+    # Letterbox size used for models exported with dynamic height/width
+    DEFAULT_MODEL_SIZE = (480, 352)
+    STRIDE = 32
+
+    def __init__(
+        self,
+        model_path,
+        intra_op_num_threads=0,
+        inter_op_num_threads=0,
+        execution_mode="sequential",
+        graph_optimization_level="all",
+        cache_optimized_model=False,
+        providers=None,
+        io_binding=True,
+    ):
         self.model_path = model_path
 
-        providers = list(
-            set(ort.get_available_providers())
-            & {"CUDAExecutionProvider", "CPUExecutionProvider"}
-        )
+        available = ort.get_available_providers()
+        self.providers = [
+            provider
+            for provider in (providers or PROVIDER_PRIORITY)
+            if provider in available
+        ]
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_num_threads
+        options.inter_op_num_threads = inter_op_num_threads
+        options.execution_mode = EXECUTION_MODES[execution_mode]
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+            graph_optimization_level
+        ]
+        session_path = self.model_path
+        if cache_optimized_model:
+            session_path = self._use_optimized_model_cache(
+                options, graph_optimization_level
+            )
+
         self.sess = ort.InferenceSession(
-            self.model_path,
-            providers=providers,
+            session_path,
+            sess_options=options,
+            providers=self.providers,
         )
-        self.output_name = self.sess.get_outputs()[0].name
+        output = self.sess.get_outputs()[0]
+        self.output_name = output.name
 
         input_ = self.sess.get_inputs()[0]
         self.input_name = input_.name
-        self.model_height, self.model_width = input_.shape[2:]
+        self.input_dtype = ORT_TYPES.get(input_.type, np.float32)
+        # uint8 models take raw NHWC pixels and normalize in the graph
+        self.raw_input = self.input_dtype == np.uint8
+        self.channels_last = input_.shape[-1] == 3
+        if self.channels_last:
+            model_height, model_width = input_.shape[1:3]
+        else:
+            model_height, model_width = input_.shape[2:]
+        self.dynamic_shape = not (
+            isinstance(model_height, int) and isinstance(model_width, int)
+        )
+        if self.dynamic_shape:
+            model_height, model_width = self.DEFAULT_MODEL_SIZE
+        self.model_height, self.model_width = model_height, model_width
+
+        self.io_binding = None
+        self.input_buffer = None
+        self.output_buffer = None
+        self._letterbox_buffer = None
+        self._scaled_values = None
+        if io_binding and _is_static(input_.shape):
+            self._bind_buffers(input_, output)
+
+    def _use_optimized_model_cache(self, options, level):
+        """
+        Load the graph optimized on a previous run if it is up to date,
+        otherwise have ORT save the optimized graph for the next run.
+        Optimized graphs are specific to the host and the providers.
+        """
+        name = os.path.splitext(os.path.basename(self.model_path))[0]
+        provider = self.providers[0] if self.providers else "default"
+        cached_path = os.path.join(
+            OPTIMIZED_MODELS_DIR, f"{name}.{level}.{provider}.onnx"
+        )
+        if os.path.isfile(cached_path) and os.path.getmtime(
+            cached_path
+        ) >= os.path.getmtime(self.model_path):
+            logger.debug(f"Loading optimized model {cached_path}")
+            options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+                "disable"
+            ]
+            return cached_path
+
+        os.makedirs(OPTIMIZED_MODELS_DIR, exist_ok=True)
+        options.optimized_model_filepath = cached_path
+        return self.model_path
+
+    def _bind_buffers(self, input_, output):
+        """
+        Preallocate the input, and the output when its shape is static,
+        and bind them once so that every frame reuses the same memory
+        """
+        self.io_binding = self.sess.io_binding()
+        self.input_buffer = np.zeros(input_.shape, dtype=self.input_dtype)
+        self.io_binding.bind_cpu_input(self.input_name, self.input_buffer)
 
-    def resize(self, x):
+        if _is_static(output.shape):
+            output_dtype = ORT_TYPES.get(output.type, np.float32)
+            self.output_buffer = np.empty(output.shape, dtype=output_dtype)
+            self.io_binding.bind_output(
+                self.output_name,
+                "cpu",
+                0,
+                output_dtype,
+                self.output_buffer.shape,
+                self.output_buffer.ctypes.data,
+            )
+        else:
+            self.io_binding.bind_output(self.output_name, "cpu")
+
+    def _model_size(self, size):
+        if size is None:
+            return self.model_height, self.model_width
+        return size
+
+    def resize(self, x, size=None):
+        model_height, model_width = self._model_size(size)
         ratio = x.height / x.width
-        if ratio > self.model_height / self.model_width:
-            height = self.model_height
-            width = int(self.model_height / ratio)
+        if ratio > model_height / model_width:
+            height = model_height
+            width = int(model_height / ratio)
         else:
-            width = self.model_width
-            height = int(self.model_width * ratio)
+            width = model_width
+            height = int(model_width * ratio)
 
         x = x.resize((width, height))
         return x
 
-    def pad(self, x):
+    def pad(self, x, size=None):
+        model_height, model_width = self._model_size(size)
         height, width = x.shape[:2]
-        dx = self.model_width - width
-        dy = self.model_height - height
+        dx = model_width - width
+        dy = model_height - height
         pad_right = dx // 2
         pad_left = dx - pad_right
         pad_bottom = dy // 2
@@ -45,29 +196,104 @@ class OnnxDetector:
             x,
             ((pad_top, pad_bottom), (pad_left, pad_right), (0, 0)),
             mode="constant",
-            constant_values=114,
+            constant_values=PAD_VALUE,
         )
         return x, padding
 
-    def resize_pad_transpose_and_scale(self, image):
-        image = self.resize(image)
+    def resize_pad_transpose_and_scale(self, image, size=None):
+        image = self.resize(image, size)
         image = np.array(image, dtype=np.float16)
-        image, padding = self.pad(image)
+        image, padding = self.pad(image, size)
         image = image.transpose(2, 0, 1)
         image /= 255
         return image, padding
 
-    def fix_bboxes(self, x, width, height, padding):
+    def _get_letterbox_buffer(self, model_height, model_width):
+        if self.channels_last:
+            shape = (1, model_height, model_width, 3)
+        else:
+            shape = (1, 3, model_height, model_width)
+        if self.input_buffer is not None and self.input_buffer.shape == shape:
+            return self.input_buffer
+        if (
+            self._letterbox_buffer is None
+            or self._letterbox_buffer.shape != shape
+        ):
+            self._letterbox_buffer = np.empty(shape, dtype=self.input_dtype)
+        return self._letterbox_buffer
+
+    def _get_scaled_values(self, dtype):
+        if self._scaled_values is None or self._scaled_values.dtype != dtype:
+            self._scaled_values = np.arange(256, dtype=dtype)
+            if not self.raw_input:
+                self._scaled_values /= dtype.type(255)
+        return self._scaled_values
+
+    def letterbox(self, image, size=None):
+        """
+        Fused resize_pad_transpose_and_scale: the resized pixels are
+        scaled straight into a reused (1, 3, height, width) buffer, the
+        IO binding input when there is one, and only the borders are
+        padded. Models with uint8 input get the raw pixels in their
+        (1, height, width, 3) layout instead. The buffer is overwritten
+        by the next call.
+        """
+        model_height, model_width = self._model_size(size)
+        buffer = self._get_letterbox_buffer(model_height, model_width)
+        pixels = np.asarray(self.resize(image, size))
+
+        height, width = pixels.shape[:2]
+        dx = model_width - width
+        dy = model_height - height
+        pad_right = dx // 2
+        pad_left = dx - pad_right
+        pad_bottom = dy // 2
+        pad_top = dy - pad_bottom
+        padding = [pad_left, pad_right, pad_top, pad_bottom]
+
+        # Channels-first view of the buffer, whatever its layout
+        canvas = (
+            np.moveaxis(buffer[0], -1, 0) if self.channels_last else buffer[0]
+        )
+        rows = slice(pad_top, pad_top + height)
+        cols = slice(pad_left, pad_left + width)
+        # Table lookup of the scaled values, float16 division is slow
+        scaled = self._get_scaled_values(buffer.dtype)
+        pad_value = scaled[PAD_VALUE]
+        canvas[:, :pad_top] = pad_value
+        canvas[:, pad_top + height :] = pad_value
+        canvas[:, rows, :pad_left] = pad_value
+        canvas[:, rows, pad_left + width :] = pad_value
+        if self.raw_input:
+            canvas[:, rows, cols] = pixels.transpose(2, 0, 1)
+        else:
+            np.take(
+                scaled, pixels.transpose(2, 0, 1), out=canvas[:, rows, cols]
+            )
+        return buffer, padding
+
+    def fix_bboxes(self, x, width, height, padding, size=None):
+        model_height, model_width = self._model_size(size)
         x[:, [0, 2]] -= padding[0]
         x[:, [1, 3]] -= padding[2]
-        x[..., [0, 2]] *= width / (self.model_width - padding[0] - padding[1])
-        x[..., [1, 3]] *= height / (
-            self.model_height - padding[2] - padding[3]
-        )
+        x[..., [0, 2]] *= width / (model_width - padding[0] - padding[1])
+        x[..., [1, 3]] *= height / (model_height - padding[2] - padding[3])
         return x
 
     def _infer(self, x):
-        return self.sess.run([self.output_name], {self.input_name: x})[0]
+        """
+        Run the model. With IO binding, the returned array may be a buffer
+        that is overwritten by the next call.
+        """
+        if self.io_binding is None or x.shape != self.input_buffer.shape:
+            return self.sess.run([self.output_name], {self.input_name: x})[0]
+
+        if x is not self.input_buffer:
+            np.copyto(self.input_buffer, x, casting="same_kind")
+        self.sess.run_with_iobinding(self.io_binding)
+        if self.output_buffer is not None:
+            return self.output_buffer
+        return self.io_binding.copy_outputs_to_cpu()[0]
 
     def run(self, image):
         raise NotImplementedError
@@ -0,0 +1,22 @@
+import numpy as np
+
+
+def bilinear_weights(size, out_size, window=None):
+    """
+    (out_size, window) antialiased bilinear weights placed like PIL's
+    resampler, mapping `size` pixels onto `out_size` pixels. Columns past
+    `size`, up to `window`, are zero so that inputs of different sizes
+    can share one padded array.
+    """
+    window = size if window is None else window
+    scale = size / out_size
+    filter_scale = max(scale, 1.0)
+    centres = (np.arange(out_size) + 0.5) * scale
+    pixels = np.arange(size) + 0.5
+    weights = np.clip(
+        1 - np.abs(pixels[None, :] - centres[:, None]) / filter_scale, 0, None
+    )
+    weights /= weights.sum(axis=1, keepdims=True)
+    padded = np.zeros((out_size, window), dtype=np.float32)
+    padded[:, :size] = weights
+    return padded
@@ -0,0 +1,96 @@
+from collections import Counter
+
+
+class ResolutionPolicy:
+    """
+    Picks the letterbox size of a dynamic-shape units model per detection.
+    It steps down one size when the mean inference time at the current
+    size goes over `budget_ms` or when at most `sparse_units` units are on
+    screen, and steps up one size in fights of at least `dense_units`
+    units, if the larger size is expected to stay within budget. The size
+    changes at most once every `cooldown` detections.
+    """
+
+    DEFAULT_SIZES = ((320, 224), (384, 288), (480, 352), (576, 416))
+
+    def __init__(
+        self,
+        sizes=DEFAULT_SIZES,
+        budget_ms=60.0,
+        sparse_units=2,
+        dense_units=10,
+        cooldown=5,
+        smoothing=0.3,
+        initial_size=(480, 352),
+    ):
+        self.sizes = sorted(
+            (tuple(size) for size in sizes), key=lambda s: s[0] * s[1]
+        )
+        self.budget_ms = budget_ms
+        self.sparse_units = sparse_units
+        self.dense_units = dense_units
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+
+        initial_size = tuple(initial_size)
+        self.level = (
+            self.sizes.index(initial_size)
+            if initial_size in self.sizes
+            else len(self.sizes) - 1
+        )
+        self.mean_ms = {}
+        self.since_change = 0
+        self.frames = Counter()
+        self.seconds = Counter()
+
+    @property
+    def size(self):
+        return self.sizes[self.level]
+
+    def _expected_ms(self, level):
+        """Mean latency at `level`, scaled by area when never measured"""
+        size = self.sizes[level]
+        if size in self.mean_ms:
+            return self.mean_ms[size]
+        current = self.size
+        return self.mean_ms[current] * (
+            size[0] * size[1] / (current[0] * current[1])
+        )
+
+    def update(self, latency_ms, n_units):
+        """Record a detection at the current size and pick the next size"""
+        size = self.size
+        self.frames[size] += 1
+        self.seconds[size] += latency_ms / 1000
+        mean_ms = self.mean_ms.get(size, latency_ms)
+        self.mean_ms[size] = mean_ms + self.smoothing * (latency_ms - mean_ms)
+
+        self.since_change += 1
+        if self.since_change < self.cooldown:
+            return self.size
+
+        level = self.level
+        if self.mean_ms[size] > self.budget_ms or n_units <= self.sparse_units:
+            level = max(level - 1, 0)
+        elif (
+            n_units >= self.dense_units
+            and level + 1 < len(self.sizes)
+            and self._expected_ms(level + 1) <= self.budget_ms
+        ):
+            level += 1
+        if level != self.level:
+            self.level = level
+            self.since_change = 0
+        return self.size
+
+    def summary(self):
+        """Detections and time spent at each size"""
+        return ", ".join(
+            f"{height}x{width}: {self.frames[(height, width)]} detections "
+            f"in {self.seconds[(height, width)]:.1f}s"
+            for height, width in self.sizes
+            if self.frames[(height, width)]
+        )
+
+    def reset(self):
+        self.since_change = 0
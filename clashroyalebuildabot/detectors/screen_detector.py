@@ -4,15 +4,29 @@ import numpy as np
 from PIL import Image
 
 from clashroyalebuildabot.constants import IMAGES_DIR
+from clashroyalebuildabot.detectors.resampling import bilinear_weights
 from clashroyalebuildabot.namespaces import Screens
 from clashroyalebuildabot.namespaces.screens import Screen
 
+# Screen.ltrb coordinates are scaled to this frame size
+SCREEN_REFERENCE_SIZE = (720, 1280)
+
 
 class ScreenDetector:
     def __init__(self, hash_size=8, threshold=30):
         self.hash_size = hash_size
         self.threshold = threshold
+        self.screens = [
+            screen
+            for screen in Screens.__dict__.values()
+            if screen.ltrb is not None
+        ]
         self.screen_hashes = self._calculate_screen_hashes()
+        # (screens, hash_size * hash_size * 3) reference hashes
+        self.reference_hashes = np.stack(
+            [self.screen_hashes[screen] for screen in self.screens]
+        )
+        self._rois = {}
 
     def _image_hash(self, image):
         crop = image.resize(
@@ -23,34 +37,70 @@ class ScreenDetector:
 
     def _calculate_screen_hashes(self):
         screen_hashes = {}
-        for screen in Screens.__dict__.values():
-            if screen.ltrb is None:
-                continue
+        for screen in self.screens:
             path = os.path.join(IMAGES_DIR, "screen", f"{screen.name}.jpg")
             image = Image.open(path)
             screen_hashes[screen] = self._image_hash(image)
         return screen_hashes
 
-    def run(self, image: Image) -> Screen:
-        current_screen = Screens.UNKNOWN
-        best_diff = self.threshold
-
-        for screen in Screens.__dict__.values():
-            if screen.ltrb is None:
-                continue
-            # screen.ltb are dimensions scaled to 720x1280 so we scale them :
-            treated_ltrb = (
-                int(screen.ltrb[0] * image.size[0] / 720),
-                int(screen.ltrb[1] * image.size[1] / 1280),
-                int(screen.ltrb[2] * image.size[0] / 720),
-                int(screen.ltrb[3] * image.size[1] / 1280),
+    def _get_rois(self, size):
+        """
+        ROI boxes of every screen for frames of `size`, and the weights
+        that resize them all to hash_size in one go, computed once per
+        frame size
+        """
+        if size not in self._rois:
+            ref_width, ref_height = SCREEN_REFERENCE_SIZE
+            boxes = [
+                (
+                    int(screen.ltrb[0] * size[0] / ref_width),
+                    int(screen.ltrb[1] * size[1] / ref_height),
+                    int(screen.ltrb[2] * size[0] / ref_width),
+                    int(screen.ltrb[3] * size[1] / ref_height),
+                )
+                for screen in self.screens
+            ]
+            widths = [max(right - left, 1) for left, _, right, _ in boxes]
+            heights = [max(bottom - top, 1) for _, top, _, bottom in boxes]
+            window = (max(heights), max(widths))
+            y_weights = np.stack(
+                [
+                    bilinear_weights(h, self.hash_size, window[0])
+                    for h in heights
+                ]
+            )
+            x_weights = np.stack(
+                [
+                    bilinear_weights(w, self.hash_size, window[1])
+                    for w in widths
+                ]
             )
-            hash_ = self._image_hash(image.crop(treated_ltrb))
-            target_hash = self.screen_hashes[screen]
+            self._rois[size] = (boxes, window, y_weights, x_weights)
+        return self._rois[size]
 
-            diff = np.mean(np.abs(hash_ - target_hash))
-            if diff < best_diff:
-                best_diff = diff
-                current_screen = screen
+    def _roi_hashes(self, image):
+        """(screens, hash_size * hash_size * 3) hashes of the frame ROIs"""
+        boxes, (height, width), y_weights, x_weights = self._get_rois(
+            image.size
+        )
+        windows = np.zeros((len(boxes), height, width, 3), dtype=np.float32)
+        for window, (left, top, right, bottom) in zip(windows, boxes):
+            roi = np.asarray(image.crop((left, top, right, bottom)))
+            window[: roi.shape[0], : roi.shape[1]] = roi
+        n = len(boxes)
+        hashes = np.matmul(y_weights, windows.reshape(n, height, -1))
+        hashes = np.matmul(
+            x_weights[:, None], hashes.reshape(n, self.hash_size, width, 3)
+        )
+        return hashes.reshape(len(boxes), -1)
 
-        return current_screen
+    def run(self, image: Image) -> Screen:
+        if not self.screens:
+            return Screens.UNKNOWN
+        diffs = np.mean(
+            np.abs(self._roi_hashes(image) - self.reference_hashes), axis=1
+        )
+        best = int(np.argmin(diffs))
+        if diffs[best] < self.threshold:
+            return self.screens[best]
+        return Screens.UNKNOWN
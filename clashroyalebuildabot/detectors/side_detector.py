@@ -6,14 +6,103 @@ from clashroyalebuildabot.detectors.onnx_detector import OnnxDetector
 
 class SideDetector(OnnxDetector):
     SIDE_SIZE = 16
+    BICUBIC_A = -0.5
+    BICUBIC_SUPPORT = 2.0
+
+    def __init__(self, model_path, **session_options):
+        super().__init__(model_path, **session_options)
+        batch_size = self.sess.get_inputs()[0].shape[0]
+        self.max_batch_size = batch_size if isinstance(batch_size, int) else 0
+        self._weights_cache = {}
 
     def _preprocess(self, image):
         image = image.resize(
             (self.SIDE_SIZE, self.SIDE_SIZE), Image.Resampling.BICUBIC
         )
-        image = np.array(image, dtype=np.float32) / 255
+        if self.raw_input:
+            image = np.array(image, dtype=np.uint8)
+        else:
+            image = np.array(image, dtype=np.float32) / 255
         return np.expand_dims(image, axis=0)
 
+    @classmethod
+    def _bicubic(cls, x):
+        a = cls.BICUBIC_A
+        x = np.abs(x)
+        near = ((a + 2) * x - (a + 3)) * x * x + 1
+        far = ((a * x - 5 * a) * x + 8 * a) * x - 4 * a
+        return np.where(x < 1, near, np.where(x < cls.BICUBIC_SUPPORT, far, 0))
+
+    def _crop_weights(self, size):
+        """
+        Antialiased bicubic weights placed like PIL's resampler, mapping a
+        crop of `size` pixels onto SIDE_SIZE pixels
+        """
+        if size not in self._weights_cache:
+            scale = size / self.SIDE_SIZE
+            filter_scale = max(scale, 1.0)
+            centres = (np.arange(self.SIDE_SIZE) + 0.5) * scale
+            pixels = np.arange(size) + 0.5
+            weights = self._bicubic(
+                (pixels[None, :] - centres[:, None]) / filter_scale
+            )
+            weights /= np.maximum(weights.sum(axis=1, keepdims=True), 1e-12)
+            self._weights_cache[size] = weights.astype(np.float32)
+        return self._weights_cache[size]
+
+    def _resize_weights(self, sizes, window):
+        """One (SIDE_SIZE, window) weight matrix per crop"""
+        weights = np.zeros((len(sizes), self.SIDE_SIZE, window), np.float32)
+        for i, size in enumerate(sizes):
+            weights[i, :, :size] = self._crop_weights(size)
+        return weights
+
+    def _preprocess_batch(self, image, bboxes):
+        """
+        Crop every bbox into a window of a common size, so that all crops
+        stack into one array, and resize them to SIDE_SIZE x SIDE_SIZE in
+        one go. Out-of-frame pixels are black, as with PIL's crop. Models
+        with uint8 input get the pixels rounded like PIL's resize.
+        """
+        crop_widths = [max(right - left, 1) for left, _, right, _ in bboxes]
+        crop_heights = [max(bottom - top, 1) for _, top, _, bottom in bboxes]
+        window_width = max(crop_widths)
+        window_height = max(crop_heights)
+
+        patches = np.stack(
+            [
+                np.asarray(
+                    image.crop(
+                        (left, top, left + window_width, top + window_height)
+                    )
+                )
+                for left, top, _, _ in bboxes
+            ]
+        ).astype(np.float32)
+        y_weights = self._resize_weights(crop_heights, window_height)
+        x_weights = self._resize_weights(crop_widths, window_width)
+
+        n = len(bboxes)
+        resized = np.matmul(y_weights, patches.reshape(n, window_height, -1))
+        resized = np.matmul(
+            x_weights[:, None], resized.reshape(n, self.SIDE_SIZE, -1, 3)
+        )
+        np.clip(resized, 0, 255, out=resized)
+        if self.raw_input:
+            return np.rint(resized).astype(np.uint8)
+        resized /= 255
+        return resized
+
+    def _infer_batch(self, x):
+        if not self.max_batch_size:
+            return self._infer(x)
+        return np.concatenate(
+            [
+                self._infer(x[i : i + self.max_batch_size])
+                for i in range(0, len(x), self.max_batch_size)
+            ]
+        )
+
     @staticmethod
     def _post_process(pred):
         return ("ally", "enemy")[np.argmax(pred[0])]
@@ -22,3 +111,13 @@ class SideDetector(OnnxDetector):
         image = self._preprocess(image)
         pred = self._infer(image)
         return self._post_process(pred)
+
+    def run_batch(self, image, bboxes):
+        """
+        Classify the side of every bbox with a single inference call
+        """
+        if len(bboxes) == 0:
+            return []
+        x = self._preprocess_batch(image, bboxes)
+        pred = self._infer_batch(x)
+        return [("ally", "enemy")[i] for i in np.argmax(pred, axis=1)]
@@ -1,36 +1,92 @@
-import os
+from collections import Counter
+from collections import deque
+import math
+import time
 
+from loguru import logger
 import numpy as np
 
 from clashroyalebuildabot.constants import DETECTOR_UNITS
 from clashroyalebuildabot.constants import DISPLAY_HEIGHT
 from clashroyalebuildabot.constants import DISPLAY_WIDTH
-from clashroyalebuildabot.constants import MODELS_DIR
 from clashroyalebuildabot.constants import SCREENSHOT_HEIGHT
 from clashroyalebuildabot.constants import SCREENSHOT_WIDTH
 from clashroyalebuildabot.constants import TILE_HEIGHT
 from clashroyalebuildabot.constants import TILE_INIT_X
 from clashroyalebuildabot.constants import TILE_INIT_Y
 from clashroyalebuildabot.constants import TILE_WIDTH
+from clashroyalebuildabot.detectors.cascade_policy import CascadePolicy
+from clashroyalebuildabot.detectors.change_detector import ChangeDetector
+from clashroyalebuildabot.detectors.onnx_detector import get_model_path
 from clashroyalebuildabot.detectors.onnx_detector import OnnxDetector
 from clashroyalebuildabot.detectors.side_detector import SideDetector
-from clashroyalebuildabot.namespaces.units import Position
-from clashroyalebuildabot.namespaces.units import UnitDetection
+from clashroyalebuildabot.detectors.unit_tracker import UnitTracker
+from clashroyalebuildabot.namespaces.units import DETECTION_DTYPE
+from clashroyalebuildabot.namespaces.units import SIDES
+from clashroyalebuildabot.namespaces.units import UnitDetections
 
 
 class UnitDetector(OnnxDetector):
     MIN_CONF = 0.2  # Lowered from 0.3 for better detection sensitivity
     UNIT_Y_START = 0.05
     UNIT_Y_END = 0.85  # Increased from 0.80 for better coverage
+    # Above this fraction of changed blocks, run on the whole band
+    ROI_MAX_FRACTION = 0.4
+    # Model call latencies kept for the cascade stats
+    LATENCY_WINDOW = 1000
 
-    def __init__(self, model_path, cards):
-        super().__init__(model_path)
+    def __init__(
+        self,
+        model_path,
+        cards,
+        track_units=True,
+        detection_interval=1,
+        change_detection=False,
+        session_options=None,
+        model_variant=None,
+        small_model_path=None,
+        cascade_policy=None,
+        resolution_policy=None,
+    ):
+        session_options = session_options or {}
+        super().__init__(model_path, **session_options)
         self.cards = cards
 
         self.side_detector = SideDetector(
-            os.path.join(MODELS_DIR, "side.onnx")
+            get_model_path("side", model_variant), **session_options
         )
         self.possible_ally_names = self._get_possible_ally_names()
+        self.unit_classes = {}
+        for i, unit in enumerate(DETECTOR_UNITS):
+            self.unit_classes.setdefault(unit, i)
+
+        self.tracker = UnitTracker() if track_units else None
+        self.detection_interval = max(int(detection_interval), 1)
+        self.frames_since_detection = None
+
+        self.change_detector = ChangeDetector() if change_detection else None
+        self.stats = Counter()
+        self._last_pred = None
+        self._last_result = None
+
+        self.small_detector = None
+        if small_model_path is not None:
+            self.small_detector = OnnxDetector(
+                small_model_path, **session_options
+            )
+        self.cascade = cascade_policy or CascadePolicy()
+        self.latencies = {
+            "small": deque(maxlen=self.LATENCY_WINDOW),
+            "medium": deque(maxlen=self.LATENCY_WINDOW),
+        }
+
+        self.resolution = resolution_policy
+        if self.resolution is not None and not self.dynamic_shape:
+            logger.warning(
+                f"{model_path} has a fixed input shape, "
+                "ignoring the adaptive resolution"
+            )
+            self.resolution = None
 
     @staticmethod
     def _get_tile_xy(bbox):
@@ -42,6 +98,46 @@ class UnitDetector(OnnxDetector):
         )
         return tile_x, tile_y
 
+    @staticmethod
+    def _get_tiles(bboxes):
+        """_get_tile_xy of an (n, 4) array of bboxes"""
+        x = (
+            (bboxes[:, 0] + bboxes[:, 2])
+            * DISPLAY_WIDTH
+            / (2 * SCREENSHOT_WIDTH)
+        )
+        y = bboxes[:, 3] * DISPLAY_HEIGHT / SCREENSHOT_HEIGHT
+        tile_x = np.rint((x - TILE_INIT_X) / TILE_WIDTH - 0.5)
+        tile_y = np.rint(
+            (DISPLAY_HEIGHT - TILE_INIT_Y - y) / TILE_HEIGHT - 0.5
+        )
+        return tile_x, tile_y
+
+    @classmethod
+    def _to_array(
+        cls, bboxes, confs, classes, sides, track_ids=None, velocities=None
+    ):
+        """DETECTION_DTYPE array of the detections, bboxes rounded"""
+        bboxes = np.rint(np.asarray(bboxes, dtype=np.float64).reshape(-1, 4))
+        array = np.zeros(len(bboxes), dtype=DETECTION_DTYPE)
+        array["cls"] = classes
+        array["bbox"] = bboxes
+        array["conf"] = confs
+        array["tile_x"], array["tile_y"] = cls._get_tiles(bboxes)
+        array["side"] = [SIDES.index(side) for side in sides]
+        array["track_id"] = -1 if track_ids is None else track_ids
+        if velocities is not None:
+            array["velocity"] = np.reshape(velocities, (-1, 2))
+        return array
+
+    @staticmethod
+    def _split_sides(array):
+        ally = array["side"] == SIDES.index("ally")
+        return (
+            UnitDetections(array[ally], DETECTOR_UNITS),
+            UnitDetections(array[~ally], DETECTOR_UNITS),
+        )
+
     def _get_possible_ally_names(self):
         possible_ally_names = set()
         for card in self.cards:
@@ -49,54 +145,215 @@ class UnitDetector(OnnxDetector):
                 possible_ally_names.add(unit.name)
         return possible_ally_names
 
-    def _calculate_side(self, image, bbox, name):
-        if name not in self.possible_ally_names:
-            side = "enemy"
-        else:
-            crop = image.crop(bbox)
-            side = self.side_detector.run(crop)
-        return side
-
-    def _preprocess(self, image):
-        image = image.crop(
-            (
-                0,
-                self.UNIT_Y_START * image.height,
-                image.width,
-                self.UNIT_Y_END * image.height,
+    def _calculate_sides(self, image, bboxes, names):
+        sides = ["enemy"] * len(bboxes)
+        idx = [
+            i
+            for i, name in enumerate(names)
+            if name in self.possible_ally_names
+        ]
+        if idx:
+            batch_sides = self.side_detector.run_batch(
+                image, [bboxes[i] for i in idx]
             )
+            for i, side in zip(idx, batch_sides):
+                sides[i] = side
+        return sides
+
+    def _preprocess(self, image, size=None):
+        return self.letterbox(image, size)
+
+    def _detect(self, image, left, top, size=None, model=None, min_conf=None):
+        """
+        Run the units model, or `model`, on a crop, returning frame
+        coordinates
+        """
+        model = model or self
+        min_conf = self.MIN_CONF if min_conf is None else min_conf
+        start = time.perf_counter()
+        np_image, padding = model.letterbox(image, size)
+        pred = model._infer(np_image)[0]
+        pred = pred[pred[:, 4] > min_conf]
+        pred = model.fix_bboxes(pred, image.width, image.height, padding, size)
+        pred[:, [0, 2]] += left
+        pred[:, [1, 3]] += top
+        tier = "small" if model is self.small_detector else "medium"
+        self.latencies[tier].append((time.perf_counter() - start) * 1000)
+        return pred
+
+    def _detect_cascade(self, band, top):
+        """
+        Run the small model, and the medium one only when the policy asks
+        for it
+        """
+        pred = self._detect(
+            band,
+            0,
+            top,
+            model=self.small_detector,
+            min_conf=self.cascade.low_conf,
+        )
+        reason = self.cascade.escalation_reason(pred, self._last_pred)
+        self.cascade.record(reason is not None)
+        if reason is None:
+            self.stats["small_only"] += 1
+            return pred[pred[:, 4] > self.MIN_CONF]
+
+        self.stats["escalated"] += 1
+        self.stats[f"escalated_{reason}"] += 1
+        return self._detect(band, 0, top)
+
+    @staticmethod
+    def _percentiles(latencies):
+        if not latencies:
+            return "n/a"
+        p50, p95 = np.percentile(latencies, [50, 95])
+        return f"p50 {p50:.1f} ms, p95 {p95:.1f} ms"
+
+    def cascade_summary(self):
+        """How often the medium model ran, and the latency of each model"""
+        escalated = self.stats["escalated"]
+        total = escalated + self.stats["small_only"]
+        reasons = ", ".join(
+            f"{reason} {self.stats[f'escalated_{reason}']}"
+            for reason in ("interval", "ambiguous", "new_units")
         )
-        image, padding = self.resize_pad_transpose_and_scale(image)
-        image = np.expand_dims(image, axis=0)
-        return image, padding
-
-    def _post_process(self, pred, height, image):
-        pred[:, [1, 3]] *= self.UNIT_Y_END - self.UNIT_Y_START
-        pred[:, [1, 3]] += self.UNIT_Y_START * height
-
-        allies = []
-        enemies = []
-        for p in pred:
-            l, t, r, b, conf, cls = p
-            bbox = (round(l), round(t), round(r), round(b))
-            tile_x, tile_y = self._get_tile_xy(bbox)
-            position = Position(bbox, conf, tile_x, tile_y)
-            unit = DETECTOR_UNITS[int(cls)]
-            unit_detection = UnitDetection(unit, position)
-
-            side = self._calculate_side(image, bbox, unit.name)
-            if side == "ally":
-                allies.append(unit_detection)
-            else:
-                enemies.append(unit_detection)
-
-        return allies, enemies
-
-    def run(self, image):
-        height, width = image.height, image.width
-        np_image, padding = self._preprocess(image)
-        pred = self._infer(np_image)[0]
-        pred = pred[pred[:, 4] > self.MIN_CONF]
-        pred = self.fix_bboxes(pred, width, height, padding)
-        allies, enemies = self._post_process(pred, height, image)
-        return allies, enemies
+        return (
+            f"medium model on {escalated}/{total} detections ({reasons}); "
+            f"small {self._percentiles(self.latencies['small'])}, "
+            f"medium {self._percentiles(self.latencies['medium'])}"
+        )
+
+    def _detect_roi(self, band, roi, top):
+        """
+        Run on the changed region only, at the scale of the whole band,
+        and keep the previous detections centred outside of it
+        """
+        scale = min(
+            self.model_height / band.height, self.model_width / band.width
+        )
+        left, roi_top, right, bottom = roi
+        size = tuple(
+            math.ceil(length * scale / self.STRIDE) * self.STRIDE
+            for length in (bottom - roi_top, right - left)
+        )
+        pred = self._detect(band.crop(roi), left, top + roi_top, size)
+
+        previous = self._last_pred
+        x = (previous[:, 0] + previous[:, 2]) / 2
+        y = (previous[:, 1] + previous[:, 3]) / 2 - top
+        inside = (x >= left) & (x < right) & (y >= roi_top) & (y < bottom)
+        return np.concatenate([previous[~inside], pred])
+
+    def _detect_frame(self, image):
+        """
+        Detect the units of a frame, in frame coordinates. Returns None
+        when nothing changed since the last detection.
+        """
+        if self.resolution is not None:
+            self.model_height, self.model_width = self.resolution.size
+        top = round(self.UNIT_Y_START * image.height)
+        bottom = round(self.UNIT_Y_END * image.height)
+        band = image.crop((0, top, image.width, bottom))
+
+        if self.change_detector is not None:
+            changed = self.change_detector.run(band)
+            if changed is not None and self._last_pred is not None:
+                if not changed.any():
+                    self.stats["skipped"] += 1
+                    return None
+                changed = self.change_detector.expand(changed)
+                if (
+                    self.dynamic_shape
+                    and changed.mean() <= self.ROI_MAX_FRACTION
+                ):
+                    left, roi_top, right, roi_bottom = (
+                        self.change_detector.bounding_box(changed)
+                    )
+                    roi = (
+                        left,
+                        roi_top,
+                        min(right, band.width),
+                        min(roi_bottom, band.height),
+                    )
+                    self.change_detector.commit(changed)
+                    self.stats["roi"] += 1
+                    return self._detect_roi(band, roi, top)
+            self.change_detector.commit()
+
+        self.stats["full"] += 1
+        start = time.perf_counter()
+        if self.small_detector is not None:
+            pred = self._detect_cascade(band, top)
+        else:
+            pred = self._detect(band, 0, top)
+        if self.resolution is not None:
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.resolution.update(latency_ms, len(pred))
+        return pred
+
+    def _post_process_tracked(self, pred, image, timestamp):
+        units = [DETECTOR_UNITS[cls] for cls in pred[:, 5].astype(int)]
+        tracks = self.tracker.update(units, pred[:, :4], pred[:, 4], timestamp)
+
+        stale = [
+            track
+            for track in tracks
+            if track.misses == 0
+            and track.unit.name in self.possible_ally_names
+            and self.tracker.needs_side(track)
+        ]
+        sides = self.side_detector.run_batch(
+            image, [tuple(round(v) for v in track.bbox) for track in stale]
+        )
+        for track, side in zip(stale, sides):
+            self.tracker.set_side(track, side)
+
+        return self._tracks_to_sides(tracks, timestamp)
+
+    def _tracks_to_sides(self, tracks, timestamp):
+        array = self._to_array(
+            [track.predict_bbox(timestamp) for track in tracks],
+            [track.conf for track in tracks],
+            [self.unit_classes[track.unit] for track in tracks],
+            [track.side or "enemy" for track in tracks],
+            [track.track_id for track in tracks],
+            [track.tile_velocity for track in tracks],
+        )
+        return self._split_sides(array)
+
+    def _post_process(self, pred, image, timestamp=None):
+        if self.tracker is not None:
+            return self._post_process_tracked(pred, image, timestamp)
+
+        classes = pred[:, 5].astype(int)
+        bboxes = [tuple(round(v) for v in p[:4]) for p in pred]
+        sides = self._calculate_sides(
+            image, bboxes, [DETECTOR_UNITS[cls].name for cls in classes]
+        )
+        return self._split_sides(
+            self._to_array(pred[:, :4], pred[:, 4], classes, sides)
+        )
+
+    def _should_detect(self):
+        if self.tracker is None or self.frames_since_detection is None:
+            return True
+        return self.frames_since_detection + 1 >= self.detection_interval
+
+    def run(self, image, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+
+        if not self._should_detect():
+            # Extrapolate the tracks instead of running the units model
+            self.frames_since_detection += 1
+            return self._tracks_to_sides(self.tracker.tracks, timestamp)
+        self.frames_since_detection = 0
+
+        pred = self._detect_frame(image)
+        if pred is None:
+            return self._last_result
+
+        self._last_pred = pred
+        self._last_result = self._post_process(pred, image, timestamp)
+        return self._last_result
@@ -0,0 +1,187 @@
+from dataclasses import dataclass
+from dataclasses import field
+import itertools
+from typing import Optional
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from clashroyalebuildabot.constants import DISPLAY_HEIGHT
+from clashroyalebuildabot.constants import DISPLAY_WIDTH
+from clashroyalebuildabot.constants import SCREENSHOT_HEIGHT
+from clashroyalebuildabot.constants import SCREENSHOT_WIDTH
+from clashroyalebuildabot.constants import TILE_HEIGHT
+from clashroyalebuildabot.constants import TILE_WIDTH
+from clashroyalebuildabot.namespaces.units import Unit
+
+# Screenshot pixels per tile, along x and y
+PIXELS_PER_TILE = np.array(
+    [
+        TILE_WIDTH * SCREENSHOT_WIDTH / DISPLAY_WIDTH,
+        TILE_HEIGHT * SCREENSHOT_HEIGHT / DISPLAY_HEIGHT,
+    ]
+)
+
+
+@dataclass
+class Track:
+    track_id: int
+    unit: Unit
+    bbox: np.ndarray
+    conf: float
+    last_seen: float
+    velocity: np.ndarray = field(default_factory=lambda: np.zeros(2))
+    side: Optional[str] = None
+    side_age: int = 0
+    hits: int = 1
+    misses: int = 0
+
+    def predict_bbox(self, timestamp):
+        shift = self.velocity * max(timestamp - self.last_seen, 0.0)
+        return self.bbox + np.tile(shift, 2)
+
+    @property
+    def tile_velocity(self):
+        """Velocity in tiles per second, with y pointing up the arena"""
+        vx, vy = self.velocity / PIXELS_PER_TILE
+        return float(vx), float(-vy)
+
+
+def _iou_matrix(a, b):
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def _tile_distance_matrix(a, b):
+    centre_a = (a[:, :2] + a[:, 2:]) / 2 / PIXELS_PER_TILE
+    centre_b = (b[:, :2] + b[:, 2:]) / 2 / PIXELS_PER_TILE
+    return np.linalg.norm(centre_a[:, None] - centre_b[None, :], axis=2)
+
+
+def _assign(cost, max_cost):
+    if cost.size == 0:
+        return []
+    rows, cols = linear_sum_assignment(np.minimum(cost, max_cost + 1))
+    return [(r, c) for r, c in zip(rows, cols) if cost[r, c] <= max_cost]
+
+
+class UnitTracker:
+    """
+    SORT-style tracker: detections are associated with the tracks of the
+    same unit type by IoU against the constant-velocity prediction, then
+    by tile distance for whatever is left. Tracks that go unmatched coast
+    on their last velocity for up to `max_misses` detector frames.
+    """
+
+    def __init__(
+        self,
+        iou_threshold=0.3,
+        max_tile_distance=1.5,
+        max_misses=2,
+        velocity_smoothing=0.5,
+        side_ttl=10,
+    ):
+        self.iou_threshold = iou_threshold
+        self.max_tile_distance = max_tile_distance
+        self.max_misses = max_misses
+        self.velocity_smoothing = velocity_smoothing
+        self.side_ttl = side_ttl
+
+        self.tracks = []
+        self._ids = itertools.count()
+
+    def _match(self, units, bboxes, timestamp):
+        if not self.tracks or not units:
+            return []
+
+        predicted = np.array(
+            [track.predict_bbox(timestamp) for track in self.tracks]
+        )
+        same_unit = np.array(
+            [[track.unit == unit for unit in units] for track in self.tracks]
+        )
+
+        iou = np.where(same_unit, _iou_matrix(predicted, bboxes), 0.0)
+        matches = _assign(1 - iou, 1 - self.iou_threshold)
+
+        track_left = sorted(
+            set(range(len(self.tracks))) - {m[0] for m in matches}
+        )
+        det_left = sorted(set(range(len(units))) - {m[1] for m in matches})
+        if track_left and det_left:
+            distance = _tile_distance_matrix(
+                predicted[track_left], bboxes[det_left]
+            )
+            distance[~same_unit[np.ix_(track_left, det_left)]] = np.inf
+            matches += [
+                (track_left[r], det_left[c])
+                for r, c in _assign(distance, self.max_tile_distance)
+            ]
+        return matches
+
+    def _update_track(self, track, bbox, conf, timestamp):
+        dt = timestamp - track.last_seen
+        if dt > 0:
+            centre_shift = (
+                bbox[:2] + bbox[2:] - track.bbox[:2] - track.bbox[2:]
+            ) / 2
+            alpha = self.velocity_smoothing if track.hits > 1 else 1.0
+            track.velocity = (
+                alpha * centre_shift / dt + (1 - alpha) * track.velocity
+            )
+        track.bbox = bbox
+        track.conf = conf
+        track.last_seen = timestamp
+        track.hits += 1
+        track.misses = 0
+        track.side_age += 1
+
+    def update(self, units, bboxes, confs, timestamp):
+        """
+        Associate the detections of a new frame with the tracks.
+
+        Returns the track of each detection, in the order given, followed
+        by the tracks that were missed this frame but are still coasting.
+        """
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        matches = dict(
+            (det, track)
+            for track, det in self._match(units, bboxes, timestamp)
+        )
+
+        det_tracks = []
+        for i, (unit, bbox, conf) in enumerate(zip(units, bboxes, confs)):
+            if i in matches:
+                track = self.tracks[matches[i]]
+                self._update_track(track, bbox, conf, timestamp)
+            else:
+                track = Track(next(self._ids), unit, bbox, conf, timestamp)
+            det_tracks.append(track)
+
+        matched = set(matches.values())
+        coasting = []
+        for i, track in enumerate(self.tracks):
+            if i in matched:
+                continue
+            track.misses += 1
+            if track.misses <= self.max_misses:
+                coasting.append(track)
+
+        self.tracks = det_tracks + coasting
+        return det_tracks + coasting
+
+    def needs_side(self, track):
+        return track.side is None or track.side_age >= self.side_ttl
+
+    @staticmethod
+    def set_side(track, side):
+        track.side = side
+        track.side_age = 0
+
+    def reset(self):
+        self.tracks = []
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import List, Sequence, Tuple
 
 from clashroyalebuildabot.namespaces.cards import Card
 from clashroyalebuildabot.namespaces.numbers import Numbers
@@ -9,9 +9,12 @@ from clashroyalebuildabot.namespaces.units import UnitDetection
 
 @dataclass
 class State:
-    allies: List[UnitDetection]
-    enemies: List[UnitDetection]
+    # UnitDetections from the detector, with the structured array as
+    # `array`
+    allies: Sequence[UnitDetection]
+    enemies: Sequence[UnitDetection]
     numbers: Numbers
     cards: Tuple[Card, Card, Card, Card]
     ready: List[int]
     screen: Screen
+    timestamp: float = 0.0
@@ -1,7 +1,10 @@
+from collections.abc import Sequence
 from dataclasses import asdict
 from dataclasses import dataclass
 from typing import Literal, Optional, Tuple
 
+import numpy as np
+
 
 @dataclass(frozen=True)
 class UnitCategory:
@@ -43,6 +46,98 @@ class Position:
 class UnitDetection:
     unit: Unit
     position: Position
+    track_id: Optional[int] = None
+    # Tiles per second, with y pointing up the arena
+    velocity: Tuple[float, float] = (0.0, 0.0)
+
+
+# Side codes of DETECTION_DTYPE
+SIDES = ("enemy", "ally")
+
+# One row per detection: the index of the unit in the detector classes,
+# the bbox in screenshot pixels, the tile of its bottom centre, the side
+# code, the track id (-1 when untracked) and the velocity in tiles per
+# second, with y pointing up the arena
+DETECTION_DTYPE = np.dtype(
+    [
+        ("cls", np.int16),
+        ("bbox", np.int32, (4,)),
+        ("conf", np.float32),
+        ("tile_x", np.int16),
+        ("tile_y", np.int16),
+        ("side", np.int8),
+        ("track_id", np.int32),
+        ("velocity", np.float32, (2,)),
+    ]
+)
+
+
+class UnitDetections(Sequence):
+    """
+    Sequence of UnitDetection over a DETECTION_DTYPE array, `units`
+    mapping the class ids to units. The dataclasses are only built for
+    the items that are accessed; vectorized consumers use `array`.
+    """
+
+    def __init__(self, array, units):
+        self.array = array
+        self.units = units
+        self._views = [None] * len(array)
+        self._columns = None
+
+    @classmethod
+    def empty(cls, units):
+        return cls(np.zeros(0, dtype=DETECTION_DTYPE), units)
+
+    def __len__(self):
+        return len(self.array)
+
+    def _view(self, i):
+        if self._columns is None:
+            # Python scalars, converted in one go for all the views
+            self._columns = {
+                name: self.array[name].tolist()
+                for name in self.array.dtype.names
+            }
+        columns = self._columns
+        position = Position(
+            tuple(columns["bbox"][i]),
+            columns["conf"][i],
+            columns["tile_x"][i],
+            columns["tile_y"][i],
+        )
+        track_id = columns["track_id"][i]
+        return UnitDetection(
+            self.units[columns["cls"][i]],
+            position,
+            track_id if track_id >= 0 else None,
+            tuple(columns["velocity"][i]),
+        )
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("detection index out of range")
+        if self._views[i] is None:
+            self._views[i] = self._view(i)
+        return self._views[i]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"UnitDetections({list(self)!r})"
 
 
 @dataclass(frozen=True)
@@ -8,6 +8,7 @@ from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtCore import QObject
 
 from clashroyalebuildabot.constants import CARD_CONFIG
+from clashroyalebuildabot.constants import FRAMES_DIR
 from clashroyalebuildabot.constants import LABELS_DIR
 from clashroyalebuildabot.constants import SCREENSHOTS_DIR
 from clashroyalebuildabot.namespaces.numbers import NumberDetection
@@ -35,17 +36,22 @@ class Visualizer(QObject):
 
     frame_ready = pyqtSignal(np.ndarray)
 
-    def __init__(self, save_labels, save_images, show_images):
+    def __init__(
+        self, save_labels, save_images, show_images, save_frames=False
+    ):
         super().__init__()
         self.save_labels = save_labels
         self.save_images = save_images
         self.show_images = show_images
+        self.save_frames = save_frames
 
         self.font = ImageFont.load_default()
         self.unit_names = [unit["name"] for unit in list(NAME2UNIT.values())]
 
         os.makedirs(LABELS_DIR, exist_ok=True)
         os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+        if self.save_frames:
+            os.makedirs(FRAMES_DIR, exist_ok=True)
 
     @staticmethod
     def _write_label(image, state, basename):
@@ -110,6 +116,11 @@ class Visualizer(QObject):
         if self.save_labels:
             self._write_label(image, state, basename)
 
+        if self.save_frames:
+            # Raw frames, for replaying sessions through the detectors
+            n_frames = len(os.listdir(FRAMES_DIR))
+            image.save(os.path.join(FRAMES_DIR, f"{n_frames + 1:06d}.png"))
+
         if not self.save_images and not self.show_images:
             return
 
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Export uint8-input variants of the detection models.
+
+The float input of each model is replaced by a uint8 NHWC input, followed
+by Cast, Transpose (for NCHW models) and /255 nodes at the front of the
+graph, so that the detectors can feed raw frame bytes. The variants are
+saved next to the models as <name>_uint8.onnx and are picked with
+`detector.model_variant: uint8` in config.yaml.
+
+Runs offline, with onnx and onnxruntime only.
+"""
+
+import argparse
+import os
+import sys
+
+from loguru import logger
+import numpy as np
+import onnx
+from onnx import helper
+from onnx import numpy_helper
+from onnx import TensorProto
+import onnxruntime as ort
+
+from clashroyalebuildabot.constants import MODELS_DIR
+from clashroyalebuildabot.detectors.onnx_detector import OnnxDetector
+
+RAW_INPUT_NAME = "raw_pixels"
+VARIANT = "uint8"
+DEFAULT_MODELS = ["units_M_480x352.onnx", "side.onnx"]
+
+
+def _dims(value_info):
+    return [
+        dim.dim_value if dim.HasField("dim_value") else dim.dim_param
+        for dim in value_info.type.tensor_type.shape.dim
+    ]
+
+
+def add_uint8_input(model):
+    """Rewrite `model` in place to take uint8 NHWC pixels"""
+    graph = model.graph
+    input_ = graph.input[0]
+    elem_type = input_.type.tensor_type.elem_type
+    dims = _dims(input_)
+    channels_first = dims[1] == 3
+    if not channels_first and dims[-1] != 3:
+        raise ValueError(f"Cannot find the channel axis of {dims}")
+    if channels_first:
+        dims = [dims[0], dims[2], dims[3], dims[1]]
+
+    scale = numpy_helper.from_array(
+        np.array(255, dtype=helper.tensor_dtype_to_np_dtype(elem_type)),
+        f"{RAW_INPUT_NAME}_scale",
+    )
+    nodes = [
+        helper.make_node(
+            "Cast",
+            [RAW_INPUT_NAME],
+            [f"{RAW_INPUT_NAME}_cast"],
+            to=elem_type,
+        )
+    ]
+    if channels_first:
+        nodes.append(
+            helper.make_node(
+                "Transpose",
+                [f"{RAW_INPUT_NAME}_cast"],
+                [f"{RAW_INPUT_NAME}_nchw"],
+                perm=[0, 3, 1, 2],
+            )
+        )
+    nodes.append(
+        helper.make_node(
+            "Div", [nodes[-1].output[0], scale.name], [input_.name]
+        )
+    )
+
+    graph_nodes = list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes + graph_nodes)
+    graph.initializer.append(scale)
+    graph.input.remove(input_)
+    graph.input.insert(
+        0,
+        helper.make_tensor_value_info(RAW_INPUT_NAME, TensorProto.UINT8, dims),
+    )
+    onnx.checker.check_model(model)
+    return model
+
+
+def _test_shape(dims):
+    """Concrete NHWC shape for the symbolic dimensions of a uint8 input"""
+    height, width = OnnxDetector.DEFAULT_MODEL_SIZE
+    defaults = [2, height, width, 3]
+    return [
+        dim if isinstance(dim, int) else defaults[i]
+        for i, dim in enumerate(dims)
+    ]
+
+
+def verify(model_path, variant_path):
+    """Largest output difference between the model and its variant"""
+    original = ort.InferenceSession(
+        model_path, providers=["CPUExecutionProvider"]
+    )
+    variant = ort.InferenceSession(
+        variant_path, providers=["CPUExecutionProvider"]
+    )
+    input_ = original.get_inputs()[0]
+    shape = _test_shape(variant.get_inputs()[0].shape)
+    pixels = np.random.default_rng(0).integers(0, 256, shape, np.uint8)
+
+    x = pixels if input_.shape[-1] == 3 else pixels.transpose(0, 3, 1, 2)
+    dtype = np.float16 if input_.type == "tensor(float16)" else np.float32
+    x = x.astype(dtype) / dtype(255)
+
+    expected = original.run(None, {input_.name: x})[0]
+    actual = variant.run(None, {RAW_INPUT_NAME: pixels})[0]
+    return float(np.abs(expected.astype(np.float32) - actual).max())
+
+
+def convert(model_path):
+    stem, ext = os.path.splitext(model_path)
+    variant_path = f"{stem}_{VARIANT}{ext}"
+    model = add_uint8_input(onnx.load(model_path))
+    onnx.save(model, variant_path)
+    max_diff = verify(model_path, variant_path)
+    logger.info(
+        f"✅ Saved {variant_path} (max output difference {max_diff:.2e})"
+    )
+    return variant_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "models",
+        nargs="*",
+        default=[os.path.join(MODELS_DIR, name) for name in DEFAULT_MODELS],
+    )
+    args = parser.parse_args()
+
+    converted = 0
+    for model_path in args.models:
+        if not os.path.isfile(model_path):
+            logger.warning(f"Skipping, model not found: {model_path}")
+            continue
+        convert(model_path)
+        converted += 1
+    return 0 if converted else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Export INT8 variants of the detection models and compare them with the
+float models.
+
+The models are quantized with onnxruntime's static quantization (QDQ,
+per-channel weights), calibrated on the raw frames saved with
+`visuals.save_frames` (clashroyalebuildabot/debug/frames by default). The
+variants are saved next to the models as <name>_int8.onnx and are picked
+with `detector.model_variant: int8` in config.yaml.
+
+The report gives, on the same frames, the mAP@0.5 of the INT8 units model
+taking the float model detections as ground truth, the share of side
+classifications that agree, and the median latency of both on this host.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+
+from loguru import logger
+import numpy as np
+import onnx
+from onnx import numpy_helper
+from onnx import TensorProto
+from onnx import version_converter
+from onnxruntime import quantization
+from PIL import Image
+
+from clashroyalebuildabot.constants import FRAMES_DIR
+from clashroyalebuildabot.constants import MODELS_DIR
+from clashroyalebuildabot.detectors.onnx_detector import OnnxDetector
+from clashroyalebuildabot.detectors.side_detector import SideDetector
+from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+from clashroyalebuildabot.detectors.unit_tracker import _iou_matrix
+from tune_onnx_session import measure_latency
+
+VARIANT = "int8"
+UNITS_MODEL = "units_M_480x352"
+SIDE_MODEL = "side"
+# QDQ with per-channel weights needs opset 13
+MIN_OPSET = 13
+SIDE_BATCH_SIZE = 32
+
+
+def _load_frames(frames_dir, limit=None):
+    paths = sorted(
+        glob.glob(os.path.join(frames_dir, "*.png"))
+        + glob.glob(os.path.join(frames_dir, "*.jpg"))
+    )
+    return [Image.open(path).convert("RGB") for path in paths[:limit]]
+
+
+def _to_float32(model):
+    """
+    Rewrite a float16 model to float32 in place, as the quantizer only
+    calibrates float32 graphs
+    """
+    graph = model.graph
+
+    def convert_tensor(tensor):
+        if tensor.data_type == TensorProto.FLOAT16:
+            array = numpy_helper.to_array(tensor).astype(np.float32)
+            tensor.CopyFrom(numpy_helper.from_array(array, tensor.name))
+
+    for tensor in graph.initializer:
+        convert_tensor(tensor)
+    for node in graph.node:
+        for attr in node.attribute:
+            if attr.name == "to" and attr.i == TensorProto.FLOAT16:
+                attr.i = TensorProto.FLOAT
+            elif attr.HasField("t"):
+                convert_tensor(attr.t)
+    for value_info in [*graph.input, *graph.output, *graph.value_info]:
+        tensor_type = value_info.type.tensor_type
+        if tensor_type.elem_type == TensorProto.FLOAT16:
+            tensor_type.elem_type = TensorProto.FLOAT
+    return model
+
+
+def _prepare(model_path, prepared_path):
+    """Float32 copy of the model at an opset the quantizer supports"""
+    model = _to_float32(onnx.load(model_path))
+    opset = next(
+        (
+            op.version
+            for op in model.opset_import
+            if op.domain in ("", "ai.onnx")
+        ),
+        MIN_OPSET,
+    )
+    if opset < MIN_OPSET:
+        model = version_converter.convert_version(model, MIN_OPSET)
+    # The quantizer refers to nodes by name
+    for i, node in enumerate(model.graph.node):
+        if not node.name:
+            node.name = f"{node.op_type}_{i}"
+    onnx.checker.check_model(model)
+    onnx.save(model, prepared_path)
+    return prepared_path
+
+
+def _head_nodes(model):
+    """
+    Nodes after the last convolution, which decode boxes, confidences and
+    classes on very different scales and are kept in float
+    """
+    nodes = model.graph.node
+    last_conv = max(
+        (i for i, node in enumerate(nodes) if node.op_type == "Conv"),
+        default=-1,
+    )
+    return [node.name for node in nodes[last_conv + 1 :]]
+
+
+class _CalibrationReader(quantization.CalibrationDataReader):
+    def __init__(self, input_name, batches):
+        self.input_name = input_name
+        self.batches = iter(batches)
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        if batch is None:
+            return None
+        return {self.input_name: batch.astype(np.float32)}
+
+
+def _unit_band(frame):
+    top = round(UnitDetector.UNIT_Y_START * frame.height)
+    bottom = round(UnitDetector.UNIT_Y_END * frame.height)
+    return frame.crop((0, top, frame.width, bottom))
+
+
+def _units_batches(detector, frames):
+    for frame in frames:
+        x, _ = detector.letterbox(_unit_band(frame))
+        yield x.copy()
+
+
+def _side_bboxes(frames, units_detector=None, seed=0):
+    """
+    Unit bboxes of each frame, as detected by the float units model when
+    there is one, else random unit-sized boxes over the arena
+    """
+    rng = np.random.default_rng(seed)
+    for frame in frames:
+        if units_detector is not None:
+            pred = units_detector._detect_frame(frame)
+            yield [tuple(round(v) for v in p[:4]) for p in pred]
+            continue
+        sizes = rng.integers(12, 50, (SIDE_BATCH_SIZE, 2))
+        lefts = rng.integers(0, frame.width - 50, SIDE_BATCH_SIZE)
+        tops = rng.integers(0, frame.height - 50, SIDE_BATCH_SIZE)
+        yield [
+            (int(left), int(top), int(left + w), int(top + h))
+            for left, top, (w, h) in zip(lefts, tops, sizes)
+        ]
+
+
+def _side_batches(detector, frames, bboxes):
+    for frame, frame_bboxes in zip(frames, bboxes):
+        if frame_bboxes:
+            yield detector._preprocess_batch(frame, frame_bboxes)
+
+
+def quantize(model_path, variant_path, batches):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        prepared_path = _prepare(
+            model_path, os.path.join(tmp_dir, "prepared.onnx")
+        )
+        prepared = onnx.load(prepared_path)
+        quantization.quantize_static(
+            prepared_path,
+            variant_path,
+            _CalibrationReader(prepared.graph.input[0].name, batches),
+            quant_format=quantization.QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=quantization.QuantType.QUInt8,
+            weight_type=quantization.QuantType.QInt8,
+            calibrate_method=quantization.CalibrationMethod.MinMax,
+            nodes_to_exclude=_head_nodes(prepared),
+        )
+    logger.info(f"✅ Saved {variant_path}")
+
+
+def average_precision(references, detections, iou_threshold=0.5):
+    """
+    mAP of `detections` against `references`, two lists with one
+    (n, 6) array of (left, top, right, bottom, conf, cls) per frame
+    """
+    classes = np.unique(
+        np.rint(np.concatenate([ref[:, 5] for ref in references] or [[]]))
+    )
+    precisions = []
+    for cls in classes:
+        refs = [ref[np.rint(ref[:, 5]) == cls, :4] for ref in references]
+        scored = [
+            (det[4], i, det[:4])
+            for i, dets in enumerate(detections)
+            for det in dets[np.rint(dets[:, 5]) == cls]
+        ]
+        scored.sort(key=lambda item: -item[0])
+        matched = [np.zeros(len(ref), dtype=bool) for ref in refs]
+        hits = []
+        for _, i, bbox in scored:
+            hit = False
+            if len(refs[i]):
+                iou = _iou_matrix(bbox[None], refs[i])[0]
+                iou[matched[i]] = 0
+                best = int(np.argmax(iou))
+                if iou[best] >= iou_threshold:
+                    matched[i][best] = hit = True
+            hits.append(hit)
+
+        n_refs = sum(len(ref) for ref in refs)
+        true_positives = np.cumsum(hits)
+        recall = np.concatenate([[0], true_positives / n_refs])
+        precision = np.concatenate(
+            [[1], true_positives / np.arange(1, len(hits) + 1)]
+        )
+        # All-point interpolation, as in VOC 2010+
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        precisions.append(float(np.sum(np.diff(recall) * precision[1:])))
+    return float(np.mean(precisions)) if precisions else 1.0
+
+
+def compare_units(model_path, variant_path, frames):
+    float_detector = UnitDetector(model_path, [], track_units=False)
+    int8_detector = UnitDetector(variant_path, [], track_units=False)
+    references = [float_detector._detect_frame(frame) for frame in frames]
+    detections = [int8_detector._detect_frame(frame) for frame in frames]
+    return average_precision(references, detections)
+
+
+def compare_sides(model_path, variant_path, frames, bboxes):
+    float_detector = SideDetector(model_path)
+    int8_detector = SideDetector(variant_path)
+    agree = total = 0
+    for frame, frame_bboxes in zip(frames, bboxes):
+        expected = float_detector.run_batch(frame, frame_bboxes)
+        actual = int8_detector.run_batch(frame, frame_bboxes)
+        agree += sum(e == a for e, a in zip(expected, actual))
+        total += len(frame_bboxes)
+    return agree / max(total, 1)
+
+
+def _report(name, model_path, variant_path, accuracy, runs):
+    float_ms = measure_latency(model_path, {}, runs)
+    int8_ms = measure_latency(variant_path, {}, runs)
+    logger.info(f"{name}: {accuracy}")
+    logger.info(
+        f"  latency: float {float_ms:.2f} ms, int8 {int8_ms:.2f} ms "
+        f"({float_ms / int8_ms:.2f}x)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", default=FRAMES_DIR)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument(
+        "--report-only",
+        action="store_true",
+        help="Compare the existing INT8 variants without quantizing",
+    )
+    args = parser.parse_args()
+
+    frames = _load_frames(args.frames, args.limit)
+    if not frames:
+        logger.error(
+            f"❌ No frames found in {args.frames}, record a session with "
+            "visuals.save_frames enabled first"
+        )
+        return 1
+
+    units_path = os.path.join(MODELS_DIR, f"{UNITS_MODEL}.onnx")
+    units_variant = os.path.join(MODELS_DIR, f"{UNITS_MODEL}_{VARIANT}.onnx")
+    side_path = os.path.join(MODELS_DIR, f"{SIDE_MODEL}.onnx")
+    side_variant = os.path.join(MODELS_DIR, f"{SIDE_MODEL}_{VARIANT}.onnx")
+
+    units_detector = None
+    if os.path.isfile(units_path):
+        units_detector = UnitDetector(units_path, [], track_units=False)
+        if not args.report_only:
+            quantize(
+                units_path,
+                units_variant,
+                _units_batches(OnnxDetector(units_path), frames),
+            )
+        mean_ap = compare_units(units_path, units_variant, frames)
+        _report(
+            "Units model",
+            units_path,
+            units_variant,
+            f"mAP@0.5 against the float model {mean_ap:.3f}",
+            args.runs,
+        )
+    else:
+        logger.warning(f"Skipping, model not found: {units_path}")
+
+    bboxes = list(_side_bboxes(frames, units_detector))
+    if not args.report_only:
+        quantize(
+            side_path,
+            side_variant,
+            _side_batches(SideDetector(side_path), frames, bboxes),
+        )
+    agreement = compare_sides(side_path, side_variant, frames, bboxes)
+    _report(
+        "Side model",
+        side_path,
+        side_variant,
+        f"agreement with the float model {agreement:.1%}",
+        args.runs,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the Bot's action generation
+"""
+
+from dataclasses import replace
+import sys
+from types import SimpleNamespace
+
+from loguru import logger
+
+
+def _bot(state):
+    """Bot with only what get_actions needs"""
+    from benchmark_mcts import ACTIONS
+    from clashroyalebuildabot.bot.bot import Bot
+
+    bot = SimpleNamespace(
+        state=state,
+        cards_to_actions={action.CARD: action for action in ACTIONS},
+    )
+    bot._get_valid_tiles = lambda: Bot._get_valid_tiles(bot)
+    bot.get_action_space = lambda: Bot.get_action_space(bot)
+    bot.get_actions = lambda: Bot.get_actions(bot)
+    return bot
+
+
+def test_action_count_is_stable():
+    """Destroyed towers must not grow the legal tiles from step to step"""
+    from benchmark_mcts import synthetic_state
+    from clashroyalebuildabot.constants import ALLY_TILES
+    from clashroyalebuildabot.constants import LEFT_PRINCESS_TILES
+    from clashroyalebuildabot.constants import RIGHT_PRINCESS_TILES
+
+    n_ally_tiles = len(ALLY_TILES)
+    for towers in [
+        (1.0, 1.0, 1.0, 1.0),
+        (1.0, 1.0, 0.0, 1.0),
+        (1.0, 1.0, 1.0, 0.0),
+        (1.0, 1.0, 0.0, 0.0),
+    ]:
+        state = synthetic_state(10, elixir=10.0, towers=towers)
+        bot = _bot(state)
+        counts = {len(bot._get_valid_tiles()) for _ in range(5000)}
+        assert len(counts) == 1, f"tile count changed: {sorted(counts)}"
+
+        _, _, left_enemy, right_enemy = towers
+        tiles = bot._get_valid_tiles()
+        expected = n_ally_tiles
+        expected += len(LEFT_PRINCESS_TILES) * (left_enemy == 0)
+        expected += len(RIGHT_PRINCESS_TILES) * (right_enemy == 0)
+        assert len(tiles) == len(set(tiles)) == expected
+
+    # Both towers down, four ready cards that all target our side
+    counts = {len(bot.get_actions()) for _ in range(2000)}
+    assert counts == {4 * expected}, f"action count changed: {counts}"
+
+    assert len(ALLY_TILES) == n_ally_tiles, "ALLY_TILES was modified"
+
+    # The elixir still gates the actions
+    bot = _bot(replace(synthetic_state(0, elixir=4.0), ready=[0, 2]))
+    assert {action.index for action in bot.get_actions()} == {0}
+
+    logger.info("✅ Action count stays constant across steps")
+    return True
+
+
+def test_action_space():
+    """Encoded actions decode to what get_actions used to build"""
+    from benchmark_mcts import synthetic_state
+    from clashroyalebuildabot.actions import ArrowsAction
+    from clashroyalebuildabot.ai.action_space import decode
+    from clashroyalebuildabot.ai.action_space import encode
+    from clashroyalebuildabot.constants import ALL_TILES
+    from clashroyalebuildabot.namespaces import Cards
+
+    def expected_actions(bot):
+        state = bot.state
+        actions = []
+        for i in state.ready:
+            card = state.cards[i + 1]
+            if state.numbers.elixir.number < card.cost:
+                continue
+            tiles = bot._get_valid_tiles()
+            if card.target_anywhere:
+                tiles = ALL_TILES
+            action = bot.cards_to_actions[card]
+            actions.extend(action(i, x, y) for x, y in tiles)
+        return actions
+
+    def key(action):
+        return type(action), action.index, action.tile_x, action.tile_y
+
+    arrows = (Cards.MINIONS, Cards.ARROWS, Cards.KNIGHT, Cards.ARCHERS)
+    arrows += (Cards.GIANT,)
+    for elixir, towers, ready, cards in [
+        (10.0, (1.0, 1.0, 1.0, 1.0), [0, 1, 2, 3], None),
+        (5.0, (1.0, 1.0, 0.0, 1.0), [3, 1, 0], None),
+        (10.0, (1.0, 1.0, 0.0, 0.0), [2], None),
+        (0.0, (1.0, 1.0, 1.0, 0.0), [0, 1, 2, 3], None),
+        (6.0, (1.0, 1.0, 1.0, 0.0), [1, 0], arrows),
+    ]:
+        state = replace(synthetic_state(0, elixir, towers), ready=ready)
+        if cards is not None:
+            state = replace(state, cards=cards)
+        bot = _bot(state)
+        bot.cards_to_actions[Cards.ARROWS] = ArrowsAction
+        expected = expected_actions(bot)
+        space = bot.get_action_space()
+        assert len(space) == len(expected)
+        assert list(map(key, space.actions())) == list(map(key, expected))
+        assert list(map(key, bot.get_actions())) == list(map(key, expected))
+
+        for code, action in zip(space.codes, expected):
+            assert decode(int(code)) == key(action)[1:]
+            assert encode(*key(action)[1:]) == code
+
+    # The spell adds every tile of the arena
+    assert len(space) == len(ALL_TILES) + len(bot._get_valid_tiles())
+
+    logger.info("✅ Encoded actions match the generated ones")
+    return True
+
+
+def main():
+    """Run all tests"""
+    tests = [
+        ("Action Count Test", test_action_count_is_stable),
+        ("Action Space Test", test_action_space),
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        logger.info(f"\nRunning: {test_name}")
+        if test_func():
+            passed += 1
+        else:
+            logger.error(f"Test failed: {test_name}")
+
+    logger.info(f"RESULTS: {passed}/{len(tests)} tests passed")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
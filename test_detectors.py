@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the detectors against their reference implementations
+"""
+
+import os
+import sys
+
+from loguru import logger
+import numpy as np
+from PIL import Image
+
+from clashroyalebuildabot.constants import IMAGES_DIR
+from clashroyalebuildabot.constants import MODELS_DIR
+from clashroyalebuildabot.constants import SCREENSHOT_HEIGHT
+from clashroyalebuildabot.constants import SCREENSHOT_WIDTH
+
+
+def _synthetic_frame(seed=0):
+    rng = np.random.default_rng(seed)
+    small = rng.integers(
+        0, 256, (SCREENSHOT_HEIGHT // 4, SCREENSHOT_WIDTH // 4, 3), np.uint8
+    )
+    return Image.fromarray(small).resize(
+        (SCREENSHOT_WIDTH, SCREENSHOT_HEIGHT), Image.Resampling.BILINEAR
+    )
+
+
+def test_side_detector_batch():
+    """Batched side classification must agree with the per-crop path"""
+    from clashroyalebuildabot.detectors.side_detector import SideDetector
+
+    side_detector = SideDetector(os.path.join(MODELS_DIR, "side.onnx"))
+    image = _synthetic_frame()
+    bboxes = [
+        (10, 10, 26, 26),
+        (100, 200, 131, 245),
+        (-5, 300, 20, 330),
+        (350, 630, 380, 660),
+        (200, 400, 203, 440),
+    ]
+
+    reference = np.concatenate(
+        [side_detector._preprocess(image.crop(bbox)) for bbox in bboxes]
+    )
+    batch = side_detector._preprocess_batch(image, bboxes)
+    assert batch.shape == (len(bboxes), 16, 16, 3)
+    max_diff = np.abs(reference - batch).max() * 255
+    assert max_diff < 2, f"Resized crops differ by {max_diff:.2f} levels"
+
+    per_crop = [side_detector.run(image.crop(bbox)) for bbox in bboxes]
+    batched = side_detector.run_batch(image, bboxes)
+    assert per_crop == batched, f"{per_crop} != {batched}"
+    assert side_detector.run_batch(image, []) == []
+
+    logger.info("✅ Batched side classification matches per-crop path")
+    return True
+
+
+def test_unit_tracker():
+    """Tracks keep their ids and velocities across frames"""
+    from clashroyalebuildabot.detectors.unit_tracker import PIXELS_PER_TILE
+    from clashroyalebuildabot.detectors.unit_tracker import UnitTracker
+    from clashroyalebuildabot.namespaces.units import Units
+
+    tracker = UnitTracker(max_misses=1)
+    units = [Units.KNIGHT, Units.ARCHER]
+    ids = None
+    for frame in range(5):
+        # The knight walks up the arena at one tile per second
+        dy = -frame * PIXELS_PER_TILE[1] * 0.5
+        bboxes = [(100, 300 + dy, 120, 330 + dy), (200, 200, 215, 220)]
+        tracks = tracker.update(units, bboxes, [0.9, 0.8], frame * 0.5)
+        assert len(tracks) == 2
+        frame_ids = [track.track_id for track in tracks]
+        assert ids is None or frame_ids == ids, f"{frame_ids} != {ids}"
+        ids = frame_ids
+
+    vx, vy = tracks[0].tile_velocity
+    assert abs(vx) < 1e-6 and abs(vy - 1) < 1e-6, (vx, vy)
+
+    # A different unit type at the same place starts a new track
+    tracks = tracker.update([Units.GIANT], [(100, 250, 120, 280)], [0.9], 3)
+    assert tracks[0].track_id not in ids
+    # Missed tracks coast for max_misses frames, then are dropped
+    assert len(tracks) == 3
+    tracks = tracker.update([], [], [], 3.5)
+    assert len(tracks) == 1
+
+    track = tracks[0]
+    assert tracker.needs_side(track)
+    tracker.set_side(track, "ally")
+    assert not tracker.needs_side(track)
+
+    logger.info("✅ Unit tracker keeps stable ids and velocities")
+    return True
+
+
+def test_unit_detections():
+    """Structured detections match the per-object tile conversion"""
+    from clashroyalebuildabot.constants import DETECTOR_UNITS
+    from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+
+    rng = np.random.default_rng(0)
+    n_units = 50
+    pred = np.zeros((n_units, 6), dtype=np.float32)
+    pred[:, :2] = rng.uniform(0, 600, (n_units, 2))
+    pred[:, 2:4] = pred[:, :2] + rng.uniform(10, 60, (n_units, 2))
+    pred[:, 4] = rng.uniform(0.2, 1, n_units)
+    pred[:, 5] = rng.integers(0, len(DETECTOR_UNITS), n_units)
+    sides = rng.choice(["ally", "enemy"], n_units).tolist()
+    track_ids = np.arange(n_units)
+    track_ids[::3] = -1
+
+    array = UnitDetector._to_array(
+        pred[:, :4], pred[:, 4], pred[:, 5].astype(int), sides, track_ids
+    )
+    allies, enemies = UnitDetector._split_sides(array)
+    assert len(allies) + len(enemies) == n_units
+    assert (allies.array["side"] == 1).all()
+    assert (enemies.array["side"] == 0).all()
+
+    detections = iter(allies + enemies)
+    ally = array["side"] == 1
+    for i in [*np.flatnonzero(ally), *np.flatnonzero(~ally)]:
+        detection = next(detections)
+        bbox = tuple(round(v) for v in pred[i, :4])
+        assert detection.position.bbox == bbox
+        tile = (detection.position.tile_x, detection.position.tile_y)
+        assert tile == UnitDetector._get_tile_xy(bbox)
+        assert detection.unit == DETECTOR_UNITS[int(pred[i, 5])]
+        assert detection.track_id == (None if i % 3 == 0 else i)
+    assert allies[-1] is allies[len(allies) - 1]
+    assert allies[:2] == list(allies)[:2]
+
+    logger.info("✅ Structured unit detections match the dataclass path")
+    return True
+
+
+def test_change_detector():
+    """Only blocks that differ from the last processed frame are flagged"""
+    from clashroyalebuildabot.detectors.change_detector import ChangeDetector
+
+    change_detector = ChangeDetector(block_size=16, margin=0)
+    frame = _synthetic_frame()
+    assert change_detector.run(frame) is None
+    change_detector.commit()
+    assert not change_detector.run(frame).any()
+
+    moved = np.array(frame)
+    moved[100:120, 40:70] = 255
+    changed = change_detector.run(Image.fromarray(moved))
+    assert changed.sum() > 0
+    left, top, right, bottom = change_detector.bounding_box(changed)
+    assert left <= 40 and top <= 100 and right >= 70 and bottom >= 120
+    assert right - left <= 64 and bottom - top <= 48
+
+    # Changed blocks stay flagged until they are committed
+    change_detector.commit(changed)
+    assert not change_detector.run(Image.fromarray(moved)).any()
+
+    logger.info("✅ Change detector flags only the changed blocks")
+    return True
+
+
+def test_onnx_session_options():
+    """Tuned session options must not change the model outputs"""
+    from clashroyalebuildabot.detectors.side_detector import SideDetector
+
+    model_path = os.path.join(MODELS_DIR, "side.onnx")
+    default = SideDetector(model_path)
+    tuned = SideDetector(
+        model_path,
+        intra_op_num_threads=1,
+        graph_optimization_level="basic",
+        providers=["TensorrtExecutionProvider", "CPUExecutionProvider"],
+    )
+    assert tuned.providers == ["CPUExecutionProvider"]
+
+    x = np.random.default_rng(0).random((4, 16, 16, 3), dtype=np.float32)
+    assert np.allclose(default._infer(x), tuned._infer(x), atol=1e-5)
+
+    logger.info("✅ Session options keep the model outputs unchanged")
+    return True
+
+
+def test_letterbox():
+    """The fused letterbox must match the four-pass preprocessing"""
+    from clashroyalebuildabot.detectors.side_detector import SideDetector
+
+    detector = SideDetector(os.path.join(MODELS_DIR, "side.onnx"))
+    image = _synthetic_frame()
+    for size, crop in [
+        ((480, 352), (0, 33, image.width, 554)),
+        ((480, 352), (0, 0, image.width, image.height)),
+        ((96, 64), (50, 100, 250, 160)),
+    ]:
+        region = image.crop(crop)
+        reference, reference_padding = detector.resize_pad_transpose_and_scale(
+            region, size
+        )
+        fused, padding = detector.letterbox(region, size)
+        assert (
+            padding == reference_padding
+        ), f"{padding} != {reference_padding}"
+        # The side model takes float32 NHWC, the reference is float16 NCHW
+        assert fused.shape == (1,) + size + (3,)
+        assert np.allclose(
+            reference[None], fused.transpose(0, 3, 1, 2), atol=1e-3
+        )
+
+    logger.info("✅ Fused letterbox matches the four-pass preprocessing")
+    return True
+
+
+def test_cascade_policy():
+    """The medium model runs on schedule, on doubt and on new units"""
+    from clashroyalebuildabot.detectors.cascade_policy import CascadePolicy
+
+    policy = CascadePolicy(high_conf=0.5, max_ambiguous=0, full_interval=3)
+    confident = np.array([[0, 0, 10, 10, 0.9, 4], [20, 20, 30, 30, 0.8, 7]])
+
+    assert policy.escalation_reason(confident, None) == "interval"
+    policy.record(True)
+    for _ in range(2):
+        assert policy.escalation_reason(confident, confident) is None
+        policy.record(False)
+    # Every third detection goes to the medium model
+    assert policy.escalation_reason(confident, confident) == "interval"
+    policy.record(True)
+
+    ambiguous = confident.copy()
+    ambiguous[1, 4] = 0.3
+    assert policy.escalation_reason(ambiguous, confident) == "ambiguous"
+
+    new_unit = np.concatenate([confident, [[50, 50, 60, 60, 0.9, 4]]])
+    assert policy.escalation_reason(new_unit, confident) == "new_units"
+    # Units leaving the arena do not need the medium model
+    assert policy.escalation_reason(confident[:1], confident) is None
+
+    logger.info("✅ Cascade policy escalates on schedule, doubt and new units")
+    return True
+
+
+def test_resolution_policy():
+    """The resolution follows the unit count and the latency budget"""
+    from clashroyalebuildabot.detectors.resolution_policy import (
+        ResolutionPolicy,
+    )
+
+    sizes = [(320, 224), (480, 352), (576, 416)]
+    policy = ResolutionPolicy(
+        sizes, budget_ms=50, sparse_units=2, dense_units=10, cooldown=1
+    )
+    assert policy.size == (480, 352)
+
+    # Dense fight, the larger size is expected to fit in the budget
+    assert policy.update(30, n_units=12) == (576, 416)
+    # Over budget, step back down whatever the unit count
+    assert policy.update(80, n_units=12) == (480, 352)
+    # Few units on screen
+    assert policy.update(30, n_units=1) == (320, 224)
+    assert policy.update(15, n_units=1) == (320, 224)
+    # Back up when the fight gets dense, one size at a time
+    assert policy.update(15, n_units=6) == (320, 224)
+    assert policy.update(15, n_units=15) == (480, 352)
+
+    assert policy.frames[(320, 224)] == 3
+    assert abs(policy.seconds[(480, 352)] - 0.06) < 1e-9
+
+    logger.info("✅ Resolution policy trades resolution for latency")
+    return True
+
+
+def test_elixir_tracker():
+    """The elixir estimate follows regeneration, plays and noisy readings"""
+    from clashroyalebuildabot.detectors.elixir_tracker import ElixirTracker
+
+    rng = np.random.default_rng(0)
+    tracker = ElixirTracker(regen_seconds=2.8, sample_interval=0.5)
+    assert tracker.needs_reading(0.0)
+
+    # Regeneration from 5 with readings off by one drop now and then
+    errors = []
+    for t in np.arange(0, 10, 0.1):
+        truth = min(5 + t / 2.8, 10)
+        if tracker.needs_reading(t):
+            reading = int(truth) + int(rng.choice([-1, 0, 0, 0, 1]))
+            tracker.update(reading, t)
+        errors.append(abs(tracker.predict(t) - truth))
+    assert np.mean(errors[20:]) < 0.5, np.mean(errors[20:])
+
+    # Plays are subtracted at once, a lone outlier is ignored
+    tracker.update(10, 20.0)
+    tracker.spend(4, 20.0)
+    assert abs(tracker.predict(20.0) - 6) < 1e-6
+    tracker.update(10, 20.1)
+    assert tracker.elixir < 7
+    # but not a play that never happened
+    tracker.update(10, 20.2)
+    tracker.update(10, 20.3)
+    assert tracker.elixir == 10
+
+    # Affordable times across the double elixir phase, 120s into the match
+    tracker.spend(10, 119.0)
+    assert tracker.time_until(0, 119.0) == 0
+    for cost in (1, 3):
+        expected = 1 + (cost - 1 / 2.8) * 2.8 / 2
+        assert abs(tracker.time_until(cost, 119.0) - expected) < 1e-6
+
+    logger.info("✅ Elixir tracker fuses regeneration, plays and readings")
+    return True
+
+
+def _hand_frame(hand, grey=(), seed=0):
+    """Synthetic frame showing `hand`, with the `grey` slots greyed out"""
+    from clashroyalebuildabot.constants import CARD_CONFIG
+
+    frame = _synthetic_frame(seed)
+    for slot, (card, position) in enumerate(zip(hand, CARD_CONFIG)):
+        card_image = Image.open(
+            os.path.join(IMAGES_DIR, "cards", f"{card.name}.jpg")
+        ).resize((position[2] - position[0], position[3] - position[1]))
+        if slot in grey:
+            card_image = card_image.convert("L").convert("RGB")
+        frame.paste(card_image, position[:2])
+    return frame
+
+
+def test_card_detector():
+    """Vectorized hand detection matches PIL hashing and caches the hand"""
+    from clashroyalebuildabot.constants import CARD_CONFIG
+    from clashroyalebuildabot.detectors.card_detector import CardDetector
+    from clashroyalebuildabot.namespaces.cards import Cards
+
+    deck = [
+        Cards.KNIGHT,
+        Cards.ARCHERS,
+        Cards.GIANT,
+        Cards.MUSKETEER,
+        Cards.MINIONS,
+        Cards.FIREBALL,
+        Cards.ARROWS,
+        Cards.HOG_RIDER,
+    ]
+    card_detector = CardDetector(list(deck))
+    hand = [deck[i] for i in (6, 0, 3, 7, 2)]
+    frame = _hand_frame(hand, grey=(2,))
+
+    reference = np.array(
+        [
+            card_detector._calculate_hash(frame.crop(position))
+            for position in CARD_CONFIG
+        ]
+    )
+    hashes = card_detector._calculate_slot_hashes(
+        card_detector._slot_windows(frame)
+    )
+    max_diff = np.abs(reference - hashes).max()
+    assert max_diff < 2, f"Slot hashes differ by {max_diff:.2f} levels"
+
+    cards, ready = card_detector.run(frame)
+    assert cards == hand, f"{cards} != {hand}"
+    # Slot 2 is greyed out, ready indices skip the next-card slot
+    assert ready == [0, 2, 3], ready
+
+    # Unchanged slots reuse the last assignment
+    last_hashes = card_detector._last_hashes
+    assert card_detector.run(frame) == (hand, [0, 2, 3])
+    assert card_detector._last_hashes is last_hashes
+
+    new_hand = [hand[2], hand[0], hand[4], hand[3], hand[1]]
+    cards, _ = card_detector.run(_hand_frame(new_hand))
+    assert cards == new_hand, f"{cards} != {new_hand}"
+
+    logger.info("✅ Card detector matches PIL hashing and caches the hand")
+    return True
+
+
+def _numbers_frame(hps, elixir, seed=0):
+    """Synthetic frame with HP bars filled to `hps` and `elixir` elixir"""
+    from clashroyalebuildabot.constants import ELIXIR_BOUNDING_BOX
+    from clashroyalebuildabot.constants import HP_HEIGHT
+    from clashroyalebuildabot.constants import HP_WIDTH
+    from clashroyalebuildabot.constants import NUMBER_CONFIG
+
+    rng = np.random.default_rng(seed)
+    frame = np.array(_synthetic_frame(seed), dtype=np.int16)
+    for (x, y, lhs, rhs), hp in zip(NUMBER_CONFIG.values(), hps):
+        split = round(hp * HP_WIDTH)
+        frame[y : y + HP_HEIGHT, x : x + split] = lhs
+        frame[y : y + HP_HEIGHT, x + split : x + HP_WIDTH] = rhs
+
+    left, top, right, bottom = ELIXIR_BOUNDING_BOX
+    split = left + (right - left) * elixir // 10
+    frame[top:bottom, left:split] = (210, 40, 220)
+    frame[top:bottom, split:right] = (60, 60, 60)
+    frame += rng.integers(-8, 9, frame.shape, dtype=np.int16)
+    return Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8))
+
+
+def test_number_detector():
+    """Batched HP bars and elixir match the per-bar PIL path"""
+    from PIL import ImageFilter
+
+    from clashroyalebuildabot.constants import ELIXIR_BOUNDING_BOX
+    from clashroyalebuildabot.constants import HP_HEIGHT
+    from clashroyalebuildabot.constants import HP_WIDTH
+    from clashroyalebuildabot.constants import NUMBER_CONFIG
+    from clashroyalebuildabot.detectors.number_detector import NumberDetector
+    from clashroyalebuildabot.detectors.number_detector import smooth_more
+
+    bars = np.random.default_rng(0).integers(0, 256, (4, 8, 40, 3), np.uint8)
+    reference = np.stack(
+        [
+            np.asarray(Image.fromarray(bar).filter(ImageFilter.SMOOTH_MORE))
+            for bar in bars
+        ]
+    )
+    assert np.abs(reference.astype(int) - smooth_more(bars)).max() <= 1
+
+    number_detector = NumberDetector()
+    for seed, (hps, elixir) in enumerate(
+        [
+            ((1.0, 0.5, 0.25, 0.75), 7),
+            ((0.1, 0.9, 1.0, 1.0), 0),
+            ((0.6, 0.3, 0.8, 0.45), 10),
+        ]
+    ):
+        frame = _numbers_frame(hps, elixir, seed)
+        numbers = number_detector.run(frame)
+        for name, (x, y, lhs, rhs) in NUMBER_CONFIG.items():
+            bbox = (x, y, x + HP_WIDTH, y + HP_HEIGHT)
+            expected = number_detector._calculate_hp(frame, bbox, lhs, rhs)
+            actual = getattr(numbers, name).number
+            assert actual == expected, f"{name}: {actual} != {expected}"
+
+        crop = np.array(frame.crop(ELIXIR_BOUNDING_BOX))
+        assert np.allclose(
+            number_detector._column_std(crop), crop.std(axis=(0, 2))
+        )
+        assert numbers.elixir.number == elixir, numbers.elixir
+
+    logger.info("✅ Batched number detection matches the per-bar path")
+    return True
+
+
+def test_screen_detector():
+    """Batched ROI hashes match PIL and each screen is recognised"""
+    from clashroyalebuildabot.detectors.screen_detector import ScreenDetector
+    from clashroyalebuildabot.namespaces import Screens
+
+    screen_detector = ScreenDetector()
+    assert screen_detector.run(_synthetic_frame()) == Screens.UNKNOWN
+
+    for screen in screen_detector.screens:
+        frame = _synthetic_frame(1)
+        rois = screen_detector._get_rois(frame.size)[0]
+        left, top, right, bottom = rois[screen_detector.screens.index(screen)]
+        screen_image = Image.open(
+            os.path.join(IMAGES_DIR, "screen", f"{screen.name}.jpg")
+        )
+        frame.paste(
+            screen_image.resize((right - left, bottom - top)), (left, top)
+        )
+
+        reference = np.stack(
+            [screen_detector._image_hash(frame.crop(roi)) for roi in rois]
+        )
+        max_diff = np.abs(reference - screen_detector._roi_hashes(frame)).max()
+        assert max_diff < 2, f"ROI hashes differ by {max_diff:.2f} levels"
+        assert screen_detector.run(frame) == screen, screen.name
+
+    logger.info("✅ Batched screen classification recognises every screen")
+    return True
+
+
+def main():
+    """Run all tests"""
+    logger.info("=" * 50)
+    logger.info("TESTING DETECTORS")
+    logger.info("=" * 50)
+
+    tests = [
+        ("Side Detector Batch Test", test_side_detector_batch),
+        ("Unit Tracker Test", test_unit_tracker),
+        ("Change Detector Test", test_change_detector),
+        ("ONNX Session Options Test", test_onnx_session_options),
+        ("Letterbox Test", test_letterbox),
+        ("Cascade Policy Test", test_cascade_policy),
+        ("Resolution Policy Test", test_resolution_policy),
+        ("Card Detector Test", test_card_detector),
+        ("Number Detector Test", test_number_detector),
+        ("Screen Detector Test", test_screen_detector),
+        ("Elixir Tracker Test", test_elixir_tracker),
+        ("Unit Detections Test", test_unit_detections),
+    ]
+
+    passed = 0
+    total = len(tests)
+
+    for test_name, test_func in tests:
+        logger.info(f"\nRunning: {test_name}")
+        try:
+            if test_func():
+                passed += 1
+            else:
+                logger.error(f"Test failed: {test_name}")
+        except Exception as e:
+            logger.error(f"Test crashed: {test_name} - {e}")
+
+    logger.info("=" * 50)
+    logger.info(f"RESULTS: {passed}/{total} tests passed")
+
+    if passed == total:
+        logger.info("🎉 All tests passed!")
+        return 0
+    logger.error("❌ Some tests failed. Check the errors above.")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,25 +3,42 @@
 Test script to verify MCTS implementation works correctly
 """
 
+from dataclasses import replace
+import math
+import random
 import sys
+from types import SimpleNamespace
+
 from loguru import logger
+import numpy as np
+
 
 def test_mcts_import():
     """Test that MCTS can be imported without errors"""
     try:
-        from clashroyalebuildabot.ai.mcts import run_mcts, MCTSNode, simulate_action, heuristic_evaluation
+        from clashroyalebuildabot.ai.mcts import (
+            run_mcts,
+            MCTSNode,
+            simulate_action,
+            heuristic_evaluation,
+        )
+
         logger.info("✅ MCTS imports successful")
         return True
     except Exception as e:
         logger.error(f"❌ MCTS import error: {e}")
         return False
 
+
 def test_mcts_components():
     """Test that MCTS components work correctly"""
     try:
         from clashroyalebuildabot.ai.mcts import MCTSNode, heuristic_evaluation
         from clashroyalebuildabot.namespaces.state import State
-        from clashroyalebuildabot.namespaces.numbers import Numbers, NumberDetection
+        from clashroyalebuildabot.namespaces.numbers import (
+            Numbers,
+            NumberDetection,
+        )
 
         # Create a mock state for testing
         mock_elixir = NumberDetection(bbox=(0, 0, 0, 0), number=5.0)
@@ -31,7 +48,7 @@ def test_mcts_components():
             right_enemy_princess_hp=mock_hp,
             left_ally_princess_hp=mock_hp,
             right_ally_princess_hp=mock_hp,
-            elixir=mock_elixir
+            elixir=mock_elixir,
         )
 
         mock_state = State(
@@ -40,7 +57,7 @@ def test_mcts_components():
             numbers=mock_numbers,
             cards=(),
             ready=[],
-            screen=None
+            screen=None,
         )
 
         # Test MCTSNode creation
@@ -56,30 +73,374 @@ def test_mcts_components():
         logger.error(f"❌ MCTS components error: {e}")
         return False
 
+
+def test_search_state():
+    """The compact search state plays and evaluates like the State path"""
+    from benchmark_mcts import _reference_heuristic_evaluation
+    from benchmark_mcts import _reference_simulate_action
+    from benchmark_mcts import synthetic_actions
+    from benchmark_mcts import synthetic_state
+    from clashroyalebuildabot.ai.mcts import heuristic_evaluation
+    from clashroyalebuildabot.ai.mcts import simulate_action
+    from clashroyalebuildabot.ai.search_state import SearchState
+    from clashroyalebuildabot.constants import DETECTOR_UNITS
+    from clashroyalebuildabot.detectors.unit_detector import UnitDetector
+    from clashroyalebuildabot.namespaces.units import UnitDetections
+
+    actions = synthetic_actions()
+    first, second = actions[0], actions[-1]
+    for seed, (n_units, elixir, towers) in enumerate(
+        [
+            (0, 10.0, (1.0, 1.0, 1.0, 1.0)),
+            (10, 7.0, (1.0, 0.4, 1.0, 0.7)),
+            (30, 9.0, (0.0, 0.5, 0.2, 0.0)),
+            (30, 4.0, (0.6, 0.5, 0.2, 0.9)),
+        ]
+    ):
+        state = synthetic_state(n_units, elixir, towers, seed)
+        search_state = SearchState.from_state(state)
+        assert len(search_state.units) == n_units
+        assert heuristic_evaluation(search_state) == (
+            _reference_heuristic_evaluation(state)
+        )
+
+        simulated = simulate_action(simulate_action(state, first), second)
+        reference = _reference_simulate_action(state, first)
+        reference = _reference_simulate_action(reference, second)
+        assert simulated.elixir == reference.numbers.elixir.number
+        assert len(simulated.allies) == len(reference.allies)
+        assert len(state.allies) == n_units // 2, "the state was modified"
+        assert heuristic_evaluation(simulated) == (
+            _reference_heuristic_evaluation(reference)
+        )
+
+        # Equal states hash alike, whichever path built them
+        again = simulate_action(simulate_action(search_state, first), second)
+        assert again == simulated and hash(again) == hash(simulated)
+        assert again != search_state
+
+    # Detector output converts through its structured array
+    detections = [
+        UnitDetections(
+            UnitDetector._to_array(
+                [(0, 0, 0, 0)] * len(units),
+                [det.position.conf for det in units],
+                [DETECTOR_UNITS.index(det.unit) for det in units],
+                [side] * len(units),
+            ),
+            DETECTOR_UNITS,
+        )
+        for units, side in ((state.allies, "ally"), (state.enemies, "enemy"))
+    ]
+    for detection, units in zip(detections, (state.allies, state.enemies)):
+        tiles = [(det.position.tile_x, det.position.tile_y) for det in units]
+        detection.array["tile_x"], detection.array["tile_y"] = zip(*tiles)
+    detected = replace(state, allies=detections[0], enemies=detections[1])
+    assert SearchState.from_state(detected) == SearchState.from_state(state)
+
+    logger.info("✅ Search states play and evaluate like the State path")
+    return True
+
+
+def test_evaluate_actions():
+    """Batched action scores match evaluating each simulated child"""
+    from benchmark_mcts import synthetic_actions
+    from benchmark_mcts import synthetic_space
+    from benchmark_mcts import synthetic_state
+    from clashroyalebuildabot.ai.mcts import evaluate_actions
+    from clashroyalebuildabot.ai.mcts import evaluate_codes
+    from clashroyalebuildabot.ai.mcts import heuristic_evaluation
+    from clashroyalebuildabot.ai.mcts import run_one_ply
+    from clashroyalebuildabot.ai.mcts import simulate_action
+    from clashroyalebuildabot.ai.mcts import simulate_code
+
+    actions = synthetic_actions()
+    for seed, (n_units, elixir, towers) in enumerate(
+        [
+            (0, 10.0, (1.0, 1.0, 1.0, 1.0)),
+            (0, 9.0, (1.0, 1.0, 1.0, 1.0)),
+            (10, 7.0, (1.0, 0.4, 1.0, 0.7)),
+            (30, 9.0, (0.0, 0.5, 0.2, 0.0)),
+            (30, 4.0, (0.6, 0.5, 0.2, 0.9)),
+        ]
+    ):
+        state = synthetic_state(n_units, elixir, towers, seed)
+        values = evaluate_actions(state, actions)
+        expected = [
+            heuristic_evaluation(simulate_action(state, action))
+            for action in actions
+        ]
+        assert values.shape == (len(actions),)
+        assert values.tolist() == expected, seed
+
+        # Encoded actions score like the Action objects they decode to
+        space = synthetic_space(state)
+        values = evaluate_codes(state, space.codes)
+        assert values.tolist() == [
+            heuristic_evaluation(simulate_code(state, int(code)))
+            for code in space.codes
+        ]
+        assert (values == evaluate_actions(state, space.actions())).all()
+
+    # One-ply search plays one of the best scored actions
+    bot = SimpleNamespace(state=state, get_action_space=lambda: space)
+    action = run_one_ply(bot)
+    best = [
+        (a.index, a.tile_x, a.tile_y)
+        for a, value in zip(space.actions(), values)
+        if value == values.max()
+    ]
+    assert (action.index, action.tile_x, action.tile_y) in best
+
+    logger.info("✅ Batched action scores match the per-child evaluation")
+    return True
+
+
+def test_puct_search():
+    """PUCT search with calculate_score priors finds the best scored move"""
+    from benchmark_mcts import synthetic_space
+    from benchmark_mcts import synthetic_state
+    from clashroyalebuildabot.ai.mcts import action_priors
+    from clashroyalebuildabot.ai.mcts import best_action
+    from clashroyalebuildabot.ai.mcts import evaluate_codes
+    from clashroyalebuildabot.ai.mcts import MinMaxStats
+    from clashroyalebuildabot.ai.mcts import run_mcts
+    from clashroyalebuildabot.ai.mcts import search
+    from clashroyalebuildabot.ai.search_state import SearchState
+
+    stats = MinMaxStats()
+    assert stats.normalize(np.array([5.0])).tolist() == [0.0]
+    for value in (-20000.0, 500.0, 30000.0):
+        stats.update(value)
+    assert stats.normalize(np.array([-20000.0, 5000.0])).tolist() == [0, 0.5]
+
+    for n_units, elixir, seed in [(10, 6.0, 1), (30, 8.0, 4)]:
+        state = synthetic_state(n_units, elixir, seed=seed)
+        space = synthetic_space(state)
+        actions = space.actions()
+        priors = action_priors(state, actions)
+        assert priors.shape == (len(actions),)
+        assert np.isclose(priors.sum(), 1) and (priors > 0).all()
+        scored = [a.calculate_score(state)[0] > 0 for a in actions]
+        assert priors[scored].min() > priors[~np.array(scored)].max()
+
+        random.seed(0)
+        root, iterations = search(
+            SearchState.from_state(state),
+            space.codes,
+            math.inf,
+            priors=priors,
+            c_puct=30,
+            widening=None,
+            max_iterations=800,
+        )
+        assert iterations == root.visits == root.child_visits.sum() == 800
+        assert len(root.children) == len(root.expanded) < len(actions)
+        values = evaluate_codes(state, space.codes)
+        move = list(space.codes).index(best_action(root))
+        assert values[move] == values.max()
+
+    bot = SimpleNamespace(state=state, get_action_space=lambda: space)
+    action = run_mcts(bot, time_limit_ms=50)
+    assert type(action) in {type(a) for a in actions}
+
+    logger.info("✅ PUCT search finds the best scored move")
+    return True
+
+
+def test_macro_actions():
+    """The card, region and tile hierarchy searches to the best move"""
+    from benchmark_mcts import synthetic_space
+    from benchmark_mcts import synthetic_state
+    from clashroyalebuildabot.ai.action_space import decode
+    from clashroyalebuildabot.ai.macro_actions import ANYWHERE
+    from clashroyalebuildabot.ai.macro_actions import build_hierarchy
+    from clashroyalebuildabot.ai.macro_actions import ENEMY_SIDE
+    from clashroyalebuildabot.ai.macro_actions import KING
+    from clashroyalebuildabot.ai.macro_actions import MacroAction
+    from clashroyalebuildabot.ai.macro_actions import OVERHEAD
+    from clashroyalebuildabot.ai.macro_actions import tile_regions
+    from clashroyalebuildabot.ai.mcts import action_priors
+    from clashroyalebuildabot.ai.mcts import best_action
+    from clashroyalebuildabot.ai.mcts import evaluate_codes
+    from clashroyalebuildabot.ai.mcts import search
+    from clashroyalebuildabot.ai.search_state import SearchState
+
+    def leaves(choice, prior=1.0):
+        for action, action_prior in zip(choice.actions, choice.priors):
+            if isinstance(action, MacroAction):
+                yield from leaves(action, prior * action_prior)
+            else:
+                yield action, prior * action_prior
+
+    for n_units, elixir, seed in [(0, 10.0, 0), (10, 6.0, 1), (30, 8.0, 4)]:
+        state = synthetic_state(n_units, elixir, seed=seed)
+        space = synthetic_space(state)
+        priors = action_priors(state, space.actions())
+        cards = build_hierarchy(state, space.codes, priors)
+        assert len(cards) == len(state.ready)
+
+        # Every action once, with its prior along the path
+        found = dict(leaves(cards))
+        assert sorted(found) == sorted(space.codes.tolist())
+        for code, prior in zip(space.codes.tolist(), priors):
+            assert np.isclose(found[code], prior)
+
+        # Tiles over an enemy unit are their own region
+        enemies = SearchState.from_state(state).enemies
+        enemy_tiles = set(zip(enemies["tile_x"], enemies["tile_y"]))
+        for card in cards.actions:
+            for region in card.actions:
+                _, tile_x, tile_y = decode(np.array(region.actions))
+                overhead = region.label[1] == OVERHEAD
+                for tile in enemy_tiles & set(zip(tile_x, tile_y)):
+                    assert overhead, (region.label, tile)
+
+        random.seed(0)
+        root, iterations = search(
+            SearchState.from_state(state),
+            cards.actions,
+            math.inf,
+            priors=cards.priors,
+            max_iterations=300,
+        )
+        assert iterations == root.visits == 300
+
+        # Progressive widening keeps most tiles unexpanded
+        def n_tiles(node):
+            if not isinstance(node.action, MacroAction):
+                return 1
+            return sum(n_tiles(child) for child in node.children)
+
+        assert sum(map(n_tiles, root.children)) < len(space) // 4
+        values = evaluate_codes(state, space.codes)
+        move = list(space.codes).index(best_action(root))
+        assert values[move] == values.max()
+
+    # Spells group the tiles away from the enemies together
+    enemies = np.array([(9, 20)], dtype=[("tile_x", int), ("tile_y", int)])
+    tile_x, tile_y = np.array([9, 9, 3, 3]), np.array([21, 25, 10, 1])
+    assert tile_regions(tile_x, tile_y, enemies).tolist() == [
+        OVERHEAD,
+        ENEMY_SIDE,
+        "left lane",
+        KING,
+    ]
+    assert tile_regions(tile_x, tile_y, enemies, True).tolist() == [
+        OVERHEAD,
+        ANYWHERE,
+        ANYWHERE,
+        ANYWHERE,
+    ]
+
+    logger.info("✅ Macro-action search finds the best scored move")
+    return True
+
+
+def test_tree_reuse():
+    """Searches resume the kept tree of a state within tolerance"""
+    from benchmark_mcts import next_frame
+    from benchmark_mcts import synthetic_space
+    from benchmark_mcts import synthetic_state
+    from clashroyalebuildabot.ai.mcts import MCTSNode
+    from clashroyalebuildabot.ai.mcts import run_mcts
+    from clashroyalebuildabot.ai.search_state import SearchState
+    from clashroyalebuildabot.ai.tree_cache import TreeCache
+
+    state = synthetic_state(30, 6.2, seed=4)
+    key = SearchState.from_state(state).quantized_key()
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        state = next_frame(state, rng)
+        assert SearchState.from_state(state).quantized_key() == key
+
+    # Elixir, tower health, units and the hand all matter
+    for changed in [
+        replace(
+            state,
+            numbers=replace(
+                state.numbers,
+                elixir=replace(state.numbers.elixir, number=7.0),
+            ),
+        ),
+        replace(
+            state,
+            numbers=replace(
+                state.numbers,
+                left_ally_princess_hp=replace(
+                    state.numbers.left_ally_princess_hp, number=0.0
+                ),
+            ),
+        ),
+        replace(state, enemies=state.enemies[1:]),
+        replace(state, ready=[0, 1, 2]),
+    ]:
+        assert SearchState.from_state(changed).quantized_key() != key
+
+    # Least recently used trees go first, within the tree and node caps
+    cache = TreeCache(max_trees=2, max_nodes=5)
+    states = [
+        SearchState.from_state(synthetic_state(1, float(elixir)))
+        for elixir in range(4)
+    ]
+    roots = [MCTSNode(search_state) for search_state in states]
+    roots[0].children = [MCTSNode(None), MCTSNode(None)]
+    for search_state, root in zip(states[:2], roots):
+        cache.put(search_state, root)
+    assert cache.get(states[0]) is roots[0] and cache.n_nodes == 4
+    cache.put(states[2], roots[2])
+    assert cache.get(states[1]) is None and len(cache) == 2
+    roots[3].children = [MCTSNode(None)]
+    cache.put(states[3], roots[3])
+    assert cache.get(states[0]) is None and cache.n_nodes == 3
+
+    # The next decision on a similar frame goes on from the first tree
+    cache = TreeCache()
+    state = synthetic_state(30, 6.2, seed=4)
+    space = synthetic_space(state)
+    bot = SimpleNamespace(state=state, get_action_space=lambda: space)
+    run_mcts(bot, time_limit_ms=20, cache=cache)
+    root = cache.get(SearchState.from_state(state))
+    visits = root.visits
+    assert visits > 0
+    bot.state = next_frame(state, rng)
+    run_mcts(bot, time_limit_ms=20, cache=cache)
+    assert len(cache) == 1 and cache.get(SearchState.from_state(state)) is root
+    assert root.visits > visits
+
+    logger.info("✅ Search trees are reused across decisions")
+    return True
+
+
 def main():
     """Run all tests"""
     logger.info("=" * 50)
     logger.info("TESTING MCTS IMPLEMENTATION")
     logger.info("=" * 50)
-    
+
     tests = [
         ("MCTS Import Test", test_mcts_import),
         ("MCTS Components Test", test_mcts_components),
+        ("Search State Test", test_search_state),
+        ("Evaluate Actions Test", test_evaluate_actions),
+        ("PUCT Search Test", test_puct_search),
+        ("Macro-Action Test", test_macro_actions),
+        ("Tree Reuse Test", test_tree_reuse),
     ]
-    
+
     passed = 0
     total = len(tests)
-    
+
     for test_name, test_func in tests:
         logger.info(f"\nRunning: {test_name}")
         if test_func():
             passed += 1
         else:
             logger.error(f"Test failed: {test_name}")
-    
+
     logger.info("=" * 50)
     logger.info(f"RESULTS: {passed}/{total} tests passed")
-    
+
     if passed == total:
         logger.info("🎉 All tests passed! MCTS is ready to use.")
         return 0
@@ -87,5 +448,6 @@ def main():
         logger.error("❌ Some tests failed. Check the errors above.")
         return 1
 
+
 if __name__ == "__main__":
     sys.exit(main())
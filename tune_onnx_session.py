@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Auto-tune the ONNX Runtime session options on this host.
+
+Measures the units model latency for each intra-op thread count (and the
+parallel execution mode) and stores the fastest options under
+detector.session in clashroyalebuildabot/config.yaml.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from loguru import logger
+import numpy as np
+
+from clashroyalebuildabot.constants import MODELS_DIR
+from clashroyalebuildabot.detectors.onnx_detector import OnnxDetector
+from clashroyalebuildabot.gui.utils import load_config
+from clashroyalebuildabot.gui.utils import save_config
+
+
+def _thread_counts():
+    n_cpus = os.cpu_count() or 1
+    counts = {1, n_cpus}
+    count = 2
+    while count < n_cpus:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+
+def _random_input(detector):
+    input_ = detector.sess.get_inputs()[0]
+    shape = [dim if isinstance(dim, int) else 1 for dim in input_.shape]
+    if detector.dynamic_shape:
+        shape[2:] = [detector.model_height, detector.model_width]
+    return np.random.rand(*shape).astype(detector.input_dtype)
+
+
+def measure_latency(model_path, session_options, runs=50, warmup=5):
+    """Median latency in milliseconds of one inference call"""
+    detector = OnnxDetector(model_path, **session_options)
+    x = _random_input(detector)
+    for _ in range(warmup):
+        detector._infer(x)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        detector._infer(x)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+
+def autotune(model_path, runs=50):
+    candidates = [
+        {
+            "intra_op_num_threads": n,
+            "inter_op_num_threads": 0,
+            "execution_mode": "sequential",
+        }
+        for n in _thread_counts()
+    ]
+    results = []
+    for options in candidates:
+        latency = measure_latency(model_path, options, runs)
+        logger.info(f"{options}: {latency:.2f} ms")
+        results.append((latency, options))
+
+    latency, best = min(results, key=lambda result: result[0])
+    # Parallel execution only pays off on branchy graphs, try it last
+    parallel = {
+        **best,
+        "execution_mode": "parallel",
+        "inter_op_num_threads": 2,
+    }
+    parallel_latency = measure_latency(model_path, parallel, runs)
+    logger.info(f"{parallel}: {parallel_latency:.2f} ms")
+    if parallel_latency < latency:
+        latency, best = parallel_latency, parallel
+
+    logger.info(f"Best session options: {best} ({latency:.2f} ms)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--model", default=os.path.join(MODELS_DIR, "units_M_480x352.onnx")
+    )
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Do not update config.yaml"
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.model):
+        logger.error(f"❌ Model not found: {args.model}")
+        return 1
+
+    best = autotune(args.model, args.runs)
+    if args.dry_run:
+        return 0
+
+    config = load_config()
+    session = config.setdefault("detector", {}).setdefault("session", {})
+    session.update(best)
+    save_config(config)
+    logger.info("✅ Saved the session options to config.yaml")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())